@@ -1,29 +1,41 @@
-import asyncio, os, sqlite3, json, re
+import asyncio, os, sqlite3, json, re, time
 from datetime import datetime, timedelta
 from collections import defaultdict
+from functools import lru_cache, wraps
 
 from aiogram import Bot, Dispatcher, F
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
 from aiogram.filters import CommandStart, Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import (
     CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton,
-    Message, LabeledPrice, PreCheckoutQuery,
+    Message, LabeledPrice, PreCheckoutQuery, BufferedInputFile,
     ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 )
 from dotenv import load_dotenv
 import logging
+from logging.handlers import RotatingFileHandler
 
 from database import DatabaseManager, init_database
-from rate_limiter import RateLimiter
+from rate_limiter import RateLimiter, SendLimiter
+from ttl_cache import TTLCache
+from middlewares import DB_TS_FORMAT, NowMiddleware, RateLimitMiddleware, UserRoleMiddleware, now_ts
 
-# Настройка логирования
+# Настройка логирования: консоль + файл с ротацией (10 МБ x 5), чтобы лог не рос бесконечно.
+# Сообщения пишем в стиле logging.error("[TAG] %s", e) — строка собирается только при выводе.
+LOG_FILE = "bot.log"
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S"
+    datefmt="%Y-%m-%d %H:%M:%S",
+    handlers=[
+        logging.StreamHandler(),
+        RotatingFileHandler(LOG_FILE, maxBytes=10 * 1024 * 1024, backupCount=5, encoding="utf-8"),
+    ]
 )
 
 # ----------------- ENV -----------------
@@ -31,21 +43,74 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_CHAT_ID = int(os.getenv("ADMIN_CHAT_ID", "0"))
 PAY_PROVIDER_TOKEN = os.getenv("PAY_PROVIDER_TOKEN", "")  # когда подключишь провайдера
+REDIS_URL = os.getenv("REDIS_URL", "")  # общий лимитер для нескольких процессов
+
+# Пул соединений к api.telegram.org: TCP/TLS переиспользуются между отправками.
+# Только публичные параметры AiohttpSession, без настройки внутреннего коннектора.
+session = AiohttpSession(limit=100, timeout=30)
+bot = Bot(BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode="HTML"))
+# Черновики анкет/заявок (FSM) живут часами; брошенные не копим
+FSM_TTL = 24 * 3600
+
+def make_fsm_storage():
+    """
+    FSM по умолчанию в памяти процесса. При REDIS_URL — в Redis (общий для процессов,
+    переживает рестарт); данные сериализуются на каждый update_data, поэтому JSON — через
+    orjson, если он установлен.
+    """
+    if not REDIS_URL:
+        return MemoryStorage()
+    from aiogram.fsm.storage.redis import RedisStorage
+    try:
+        import orjson
+        dumps, loads = (lambda data: orjson.dumps(data).decode()), orjson.loads
+    except ImportError:
+        dumps, loads = json.dumps, json.loads
+    return RedisStorage.from_url(
+        REDIS_URL, state_ttl=FSM_TTL, data_ttl=FSM_TTL, json_dumps=dumps, json_loads=loads
+    )
 
-bot = Bot(BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-dp = Dispatcher(storage=MemoryStorage())
+dp = Dispatcher(storage=make_fsm_storage())
+# Одно значение «сейчас» на апдейт (для is_active и форматирования)
+dp.update.outer_middleware(NowMiddleware())
 
 # ----------------- DB ------------------
 # Инициализируем менеджер БД
 DB_PATH = "vp_masters.sqlite"
 db = DatabaseManager(DB_PATH)
 
-# Создаем глобальный экземпляр лимитера
+# Создаем глобальный экземпляр лимитера (в памяти процесса)
 rate_limiter = RateLimiter()
 
+# При REDIS_URL лимиты хранятся в Redis и общие для всех процессов бота
+redis_limiter = None
+if REDIS_URL:
+    from redis_rate_limiter import RedisRateLimiter
+    redis_limiter = RedisRateLimiter(REDIS_URL)
+# Лимитер исходящих сообщений (лимиты Telegram на отправку)
+send_limiter = SendLimiter()
+
 # Инициализируем структуру БД
 init_database(db)
 
+# Окна лимитера сохраняются в rate_limits пачками (UPSERT раз в RATE_LIMITS_FLUSH_INTERVAL секунд),
+# поэтому рестарт не обнуляет лимиты. Окна старше двух периодов уже ни на что не влияют.
+RATE_LIMITS_FLUSH_INTERVAL = 5
+RATE_LIMITS_UPSERT_SQL = """
+    INSERT INTO rate_limits(user_id, action, window_start, prev_count, curr_count, period)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id, action) DO UPDATE SET
+        window_start = excluded.window_start,
+        prev_count = excluded.prev_count,
+        curr_count = excluded.curr_count,
+        period = excluded.period
+"""
+rate_limiter.load(db.fetch_all(
+    "SELECT user_id, action, window_start, prev_count, curr_count, period FROM rate_limits "
+    "WHERE window_start + 2 * period > ?",
+    (time.time(),), row_factory=None
+))
+
 # ----------------- PRICING -------------
 SUB_PRICE_RUB = 99000         # 990 ₽ (в копейках)
 PRIORITY_PRICE_RUB = 49000    # 490 ₽/мес
@@ -64,24 +129,78 @@ CATS = [
     ("💅 Красота", "krasota"),
     ("👶 Персонал", "person"),
 ]
+# Название категории по коду из callback_data
+CATS_BY_CODE = {code: title for title, code in CATS}
+
+# Статичные клавиатуры собираем один раз при импорте, а не на каждый вызов
+CATEGORIES_KB = InlineKeyboardMarkup(inline_keyboard=[
+    *[[InlineKeyboardButton(text=t, callback_data=f"cat:{c}")] for t, c in CATS],
+    [InlineKeyboardButton(text="🏠 Меню", callback_data="go:menu")]
+])
+
+SHARE_PHONE_KB = ReplyKeyboardMarkup(
+    keyboard=[[KeyboardButton(text="📱 Отправить номер", request_contact=True)]],
+    resize_keyboard=True, one_time_keyboard=True
+)
+
+CANCEL_TEXT_KB = ReplyKeyboardMarkup(
+    keyboard=[[KeyboardButton(text="❌ Отмена")]],
+    resize_keyboard=True,
+    one_time_keyboard=False
+)
+
+# Телефон в анкете мастера: кнопка контакта + отмена
+SHARE_PHONE_CANCEL_KB = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="📱 Отправить номер", request_contact=True)],
+        [KeyboardButton(text="❌ Отмена")]
+    ],
+    resize_keyboard=True,
+    one_time_keyboard=True
+)
+
+PREVIEW_SUBMIT_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="✅ Отправить", callback_data="req:submit"),
+     InlineKeyboardButton(text="✏️ Исправить", callback_data="go:req")]
+])
+
+VERIFY_OFFER_KB = InlineKeyboardMarkup(inline_keyboard=[[
+    InlineKeyboardButton(text="Да, пройти проверку", callback_data="mf:verify:yes"),
+    InlineKeyboardButton(text="Нет, оставить Кандидатом", callback_data="mf:verify:no")
+]])
+
+CONSENT_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="✅ Я согласен", callback_data="consent:given")]
+])
+
+SUBSCRIBE_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="💳 Оформить подписку (990 ₽/мес)", callback_data="pay:sub")]
+])
 
 def categories_kb():
-    rows = [[InlineKeyboardButton(text=t, callback_data=f"cat:{c}")] for t, c in CATS]
-    rows.append([InlineKeyboardButton(text="🏠 Меню", callback_data="go:menu")])
-    return InlineKeyboardMarkup(inline_keyboard=rows)
+    return CATEGORIES_KB
 
 def share_phone_kb():
-    return ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="📱 Отправить номер", request_contact=True)]],
-        resize_keyboard=True, one_time_keyboard=True
-    )
+    return SHARE_PHONE_KB
 
 def cancel_text_kb():
-    return ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="❌ Отмена")]],
-        resize_keyboard=True,
-        one_time_keyboard=False
-    )
+    return CANCEL_TEXT_KB
+
+BILLING_TEXT = (
+    "<b>Подписка и услуги для мастеров</b>\n\n"
+    "🔹 Новым мастерам: 3 заказа бесплатно\n"
+    "🔹 Далее подписка: 990 ₽/мес (безлимит)\n\n"
+    "Доп.услуги:\n"
+    "⚡ Приоритет заказов — 490 ₽/мес\n"
+    "📌 Закреп анкеты — 190 ₽/нед\n"
+)
+
+BILLING_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="💳 Подписка 990 ₽", callback_data="pay:sub")],
+    [InlineKeyboardButton(text="⚡ Приоритет 490 ₽", callback_data="pay:priority")],
+    [InlineKeyboardButton(text="📌 Закреп 190 ₽", callback_data="pay:pin")],
+    [InlineKeyboardButton(text="🏠 Меню", callback_data="go:menu")]
+])
 
 # ----------------- STATES --------------
 class Req(StatesGroup):
@@ -118,25 +237,238 @@ class Complaint(StatesGroup):
     text = State()
 
 # ----------------- HELPERS -------------
+# Разбор callback_data с несколькими полями
+CB_REVIEW = re.compile(r"^review:(\d+):(\d+)$")
+CB_CONFIRM = re.compile(r"^confirm:(\d+):(yes|no)$")
+# Все, кроме строчной кириллицы (применяется после lower()): эмодзи, пробелы, знаки
+CYR_NONLETTER_RE = re.compile(r"[^а-яё]")
+
+@lru_cache(maxsize=4096)
+def normalize_master_cats(cats_auto: str) -> tuple:
+    """
+    Основные категории мастера без эмодзи и подкатегорий
+    ("Ремонт/электрика" -> "ремонт"). Строка categories_auto меняется редко,
+    поэтому результат кэшируется по ней самой.
+    """
+    master_cats = []
+    for cat in cats_auto.split(","):
+        clean_cat = CYR_NONLETTER_RE.sub("", cat.split("/")[0].lower())
+        if clean_cat:
+            master_cats.append(clean_cat)
+    return tuple(master_cats)
+
 def is_active(until_str: str | None) -> bool:
+    # Формат 'YYYY-MM-DD HH:MM:SS' сравнивается как строка без разбора даты
     if not until_str: return False
-    try:
-        return datetime.utcnow() < datetime.strptime(until_str, "%Y-%m-%d %H:%M:%S")
-    except:
-        return False
+    return now_ts() < until_str
+
+def truncate(text: str, limit: int) -> str:
+    """Обрезать текст до limit символов с многоточием (без копии, если короче)"""
+    return text if len(text) <= limit else text[:limit] + "..."
+
+def fmt_db_date(ts: str | None) -> str:
+    """Дата из БД ('ГГГГ-ММ-ДД ЧЧ:ММ:СС') в виде ДД.ММ.ГГГГ — срезами строки, без datetime"""
+    if not ts or len(ts) < 10:
+        return "—"
+    return f"{ts[8:10]}.{ts[5:7]}.{ts[:4]}"
 
 def is_admin(user_id: int) -> bool:
-    """Проверка, является ли пользователь администратором"""
-    if not ADMIN_CHAT_ID or ADMIN_CHAT_ID == 0:
-        return False
-    return str(user_id) == str(ADMIN_CHAT_ID)
+    """
+    Проверка, является ли пользователь администратором.
+    Админ задается в конфиге (ADMIN_CHAT_ID), поэтому это сравнение двух int — кэш не нужен.
+    """
+    return ADMIN_CHAT_ID != 0 and user_id == ADMIN_CHAT_ID
+
+# Кэш мастеров по contact (user_id): строка (id, fio) или None, если не мастер
+master_cache = TTLCache(maxsize=10_000, ttl=30)
+_NOT_CACHED = object()
+
+async def aget_master_by_contact(user_id: str):
+    """Мастер (id, fio) по Telegram user_id с коротким кэшем; None — не мастер (запрос в БД — в потоке)"""
+    master = master_cache.get(user_id, _NOT_CACHED)
+    if master is _NOT_CACHED:
+        master = await db.afetch_one("SELECT id, fio FROM masters WHERE contact = ?", (user_id,))
+        master_cache.set(user_id, master)
+    return master
+
+# Флаг «является мастером» нужен только для отрисовки меню и меняется
+# лишь при регистрации/удалении анкеты, поэтому живёт дольше (на сессию)
+master_flag_cache = TTLCache(maxsize=50_000, ttl=3600)
+
+async def ais_master_user(user_id: str) -> bool:
+    """Является ли пользователь мастером (кэшируется, в т.ч. отрицательный ответ; запрос в БД — в потоке)"""
+    flag = master_flag_cache.get(user_id)
+    if flag is None:
+        flag = await aget_master_by_contact(user_id) is not None
+        master_flag_cache.set(user_id, flag)
+    return flag
+
+def invalidate_master(user_id: str):
+    """Сбросить кэши мастера после регистрации или удаления анкеты"""
+    master_cache.pop(user_id)
+    master_flag_cache.pop(user_id)
+    invalidate_master_views(user_id)
+    invalidate_stats()
+
+# Готовые экраны кабинета/отзывов/статистики: защита от частых нажатий кнопок
+view_cache = TTLCache(maxsize=2048, ttl=10)
+MASTER_VIEWS = ("cabinet", "reviews", "stats")
+
+def cached_view(view: str):
+    """Кэшировать результат get_master_*_data(user_id) на несколько секунд"""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(user_id: str):
+            key = (user_id, view)
+            result = view_cache.get(key)
+            if result is None:
+                result = await func(user_id)
+                # Ошибки и «не мастер» не кэшируем
+                if result and "error" not in result:
+                    view_cache.set(key, result)
+            return result
+        return wrapper
+    return decorator
+
+def invalidate_master_views(contact):
+    """Сбросить закэшированные экраны мастера (contact — Telegram user_id)"""
+    if not contact:
+        return
+    for view in MASTER_VIEWS:
+        view_cache.pop((str(contact), view))
+
+# Текст /stats: админ может нажимать повторно, агрегаты пересчитываем не чаще раза в 30 с.
+# Новые мастера/заявки/отзывы/подписки сбрасывают кэш сразу.
+stats_cache = TTLCache(maxsize=1, ttl=30)
+
+def invalidate_stats():
+    stats_cache.clear()
+
+async def consume_limit(user_id: int, action: str, limit: int, period: int = 3600) -> tuple:
+    """
+    Проверить и учесть действие пользователя: (разрешено, осталось, секунд до сброса).
+    Если Redis недоступен — используем лимитер в памяти.
+    """
+    if redis_limiter:
+        try:
+            return await redis_limiter.check_and_report(user_id, action, limit, period)
+        except Exception as e:
+            logging.error("[REDIS_LIMITER] %s", e)
+    return rate_limiter.check_and_report(user_id, action, limit, period)
+
+async def limits_snapshot(user_id: int, specs) -> dict:
+    """Остатки по нескольким лимитам сразу"""
+    if redis_limiter:
+        try:
+            return await redis_limiter.snapshot(user_id, specs)
+        except Exception as e:
+            logging.error("[REDIS_LIMITER] %s", e)
+    return rate_limiter.snapshot(user_id, specs)
+
+# Сообщения об исчерпанном лимите: {time} — время до сброса (fmt_wait)
+LIMIT_DENIED_TEXT = {
+    "start_command": "❌ Слишком много запросов. Попробуйте через {time}.",
+    "new_request": "❌ Лимит заявок исчерпан (3 в час). Доступно через: {time}.",
+    "master_registration": "❌ Регистрация мастера возможна 3 раза в сутки. Попробуйте через {time}.",
+    "complaint": "❌ Лимит жалоб исчерпан (5 в сутки). Попробуйте через {time}.",
+    "offer_actions": "❌ Слишком много действий. Подождите немного.",
+}
+WAIT_HOURS_TMPL = "{} ч {} мин".format
+WAIT_MINUTES_TMPL = "{} мин".format
+
+def fmt_wait(seconds: int) -> str:
+    """Время до сброса лимита: «2 ч 15 мин» или «15 мин» (не меньше минуты)"""
+    hours, rest = divmod(seconds, 3600)
+    minutes = rest // 60
+    return WAIT_HOURS_TMPL(hours, minutes) if hours else WAIT_MINUTES_TMPL(max(1, minutes))
+
+def limit_denied_text(action: str, remaining_time: int) -> str:
+    return LIMIT_DENIED_TEXT[action].format(time=fmt_wait(remaining_time))
+
+async def tg_send(chat_id, text: str, **kwargs):
+    """
+    bot.send_message с ожиданием лимита отправки для чата.
+    На 429 (TelegramRetryAfter) ждем указанное Telegram время и повторяем один раз.
+    """
+    try:
+        async with send_limiter.slot(chat_id):
+            return await bot.send_message(chat_id, text, **kwargs)
+    except TelegramRetryAfter as e:
+        logging.warning("[TG_SEND] Flood control for chat %s, retry in %ss", chat_id, e.retry_after)
+        await asyncio.sleep(e.retry_after)
+        async with send_limiter.slot(chat_id):
+            return await bot.send_message(chat_id, text, **kwargs)
+
+async def safe_edit(msg: Message, text: str, reply_markup=None, **kwargs):
+    """
+    edit_text без пустых запросов: если в сообщении уже этот текст и клавиатура
+    (повторное нажатие кнопки), к API не обращаемся. "message is not modified" глушим.
+    """
+    if msg.html_text == text and msg.reply_markup == reply_markup:
+        return None
+    try:
+        async with send_limiter.slot(msg.chat.id):
+            return await msg.edit_text(text, reply_markup=reply_markup, **kwargs)
+    except TelegramBadRequest as e:
+        if "not modified" not in str(e):
+            raise
+        return None
+
+# Роли пользователя приходят в обработчики аргументами is_master / is_admin
+_role_middleware = UserRoleMiddleware(ais_master_user, is_admin)
+dp.message.middleware(_role_middleware)
+# Лимиты по флагу rate_limit обработчика проверяются до его вызова
+# (и до запроса роли: отклоненный апдейт не ходит в БД)
+dp.callback_query.middleware(RateLimitMiddleware(consume_limit, limit_denied_text))
+dp.callback_query.middleware(_role_middleware)
+
+async def gather_logged(*coros, tag: str = "NOTIFY"):
+    """Выполнить независимые отправки параллельно; ошибки только логируются"""
+    results = await asyncio.gather(*coros, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logging.error("[%s_ERROR] %s", tag, result)
+    return results
 
 async def notify_admin(text: str):
     if not ADMIN_CHAT_ID: return
     try:
-        await bot.send_message(ADMIN_CHAT_ID, text)
+        await tg_send(ADMIN_CHAT_ID, text)
     except Exception as e:
-        logging.error(f"[ADMIN_NOTIFY_ERROR] {e}")
+        logging.error("[ADMIN_NOTIFY_ERROR] %s", e)
+
+def clear_expired_documents() -> list:
+    """
+    Обнуляет file_id документов старше 72 часов одной транзакцией.
+    Возвращает строки мастеров (до очистки), чтобы сформировать отчёт.
+    """
+    # Одна граница времени для SELECT и UPDATE — затрагиваются ровно те же строки
+    cutoff = (datetime.utcnow() - timedelta(hours=72)).strftime("%Y-%m-%d %H:%M:%S")
+    with db.write_conn() as conn:
+        rows = conn.execute("""
+            SELECT id, fio, level,
+                   passport_scan_file_id, face_photo_file_id, npd_ip_doc_file_id
+            FROM masters
+            WHERE created_at < ?
+              AND (passport_scan_file_id IS NOT NULL
+                   OR face_photo_file_id IS NOT NULL
+                   OR npd_ip_doc_file_id IS NOT NULL)
+        """, (cutoff,)).fetchall()
+        if rows:
+            conn.execute("""
+                UPDATE masters
+                SET passport_scan_file_id = NULL,
+                    face_photo_file_id = NULL,
+                    npd_ip_doc_file_id = NULL
+                WHERE created_at < ?
+                  AND (passport_scan_file_id IS NOT NULL
+                       OR face_photo_file_id IS NOT NULL
+                       OR npd_ip_doc_file_id IS NOT NULL)
+            """, (cutoff,))
+    return rows
+
+CLEANUP_REPORT_LIMIT = 10
+CLEANUP_REPORT_MAX_CHARS = 3500  # лимит сообщения Telegram — 4096 символов
 
 async def safe_cleanup_documents():
     """
@@ -145,61 +477,41 @@ async def safe_cleanup_documents():
     try:
         logging.info("[CLEANUP] Starting document cleanup...")
         
-        # Находим мастеров, у которых нужно удалить документы (старше 72 часов)
-        masters_to_clean = db.fetch_all("""
-            SELECT id, fio, level, contact, phone,
-                   passport_scan_file_id, face_photo_file_id, npd_ip_doc_file_id,
-                   datetime(created_at) as created_time
-            FROM masters 
-            WHERE created_at < datetime('now', '-72 hours')
-              AND (passport_scan_file_id IS NOT NULL 
-                   OR face_photo_file_id IS NOT NULL 
-                   OR npd_ip_doc_file_id IS NOT NULL)
-        """)
+        # Находим и очищаем документы старше 72 часов (один UPDATE в транзакции)
+        masters_to_clean = await asyncio.to_thread(clear_expired_documents)
         
         if not masters_to_clean:
             logging.info("[CLEANUP] No documents to clean")
             return
         
-        cleaned_count = 0
+        cleaned_count = len(masters_to_clean)
+        # В отчет идут только первые CLEANUP_REPORT_LIMIT строк, остальные лишь считаем
         cleanup_details = []
+        overflow = 0
         
         for master in masters_to_clean:
-            try:
-                master_id = master['id']
-                master_fio = master['fio'] or 'Неизвестно'
-                master_level = master['level'] or 'Кандидат'
-                
-                # Собираем информацию о том, какие файлы будут удалены
-                files_to_remove = []
-                if master['passport_scan_file_id']:
-                    files_to_remove.append("паспорт")
-                if master['face_photo_file_id']:
-                    files_to_remove.append("фото лица")
-                if master['npd_ip_doc_file_id']:
-                    files_to_remove.append("документ НПД/ИП")
-                
-                # Удаляем файлы из БД
-                db.execute("""
-                    UPDATE masters 
-                    SET passport_scan_file_id = NULL,
-                        face_photo_file_id = NULL,
-                        npd_ip_doc_file_id = NULL
-                    WHERE id = ?
-                """, (master_id,))
-                
-                cleaned_count += 1
-                
-                # Добавляем в детали очистки
-                cleanup_details.append(
-                    f"#{master_id} {master_fio} ({master_level}): {', '.join(files_to_remove)}"
-                )
-                
-                logging.info(f"[DOC_CLEANED] Master #{master_id} - removed: {', '.join(files_to_remove)}")
-                
-            except Exception as e:
-                logging.error(f"[DOC_CLEAN_ERROR] Master #{master.get('id', 'unknown')}: {e}")
-                cleanup_details.append(f"#{master.get('id', 'unknown')} - ОШИБКА: {e}")
+            master_id = master['id']
+            master_fio = master['fio'] or 'Неизвестно'
+            master_level = master['level'] or 'Кандидат'
+            
+            # Собираем информацию о том, какие файлы были удалены
+            files_to_remove = []
+            if master['passport_scan_file_id']:
+                files_to_remove.append("паспорт")
+            if master['face_photo_file_id']:
+                files_to_remove.append("фото лица")
+            if master['npd_ip_doc_file_id']:
+                files_to_remove.append("документ НПД/ИП")
+            
+            removed = ', '.join(files_to_remove)
+
+            # Добавляем в детали очистки
+            if len(cleanup_details) < CLEANUP_REPORT_LIMIT:
+                cleanup_details.append(f"#{master_id} {master_fio} ({master_level}): {removed}")
+            else:
+                overflow += 1
+            
+            logging.info("[DOC_CLEANED] Master #%s - removed: %s", master_id, removed)
         
         # Формируем отчет для админа
         if cleaned_count > 0 and ADMIN_CHAT_ID:
@@ -209,10 +521,10 @@ async def safe_cleanup_documents():
                 "",
                 "<b>Детали очистки:</b>"
             ]
-            report_lines.extend(cleanup_details[:10])  # Первые 10 записей
+            report_lines.extend(cleanup_details)
             
-            if len(cleanup_details) > 10:
-                report_lines.append(f"... и еще {len(cleanup_details) - 10} мастеров")
+            if overflow:
+                report_lines.append(f"... и еще {overflow} мастеров")
             
             report_lines.extend([
                 "",
@@ -220,61 +532,136 @@ async def safe_cleanup_documents():
                 "✅ Все документы старше 72 часов удалены"
             ])
             
-            # Разбиваем сообщение если слишком длинное
             report_text = "\n".join(report_lines)
-            if len(report_text) > 4000:
-                report_text = "\n".join(report_lines[:8] + ["...", "💡 Сообщение сокращено из-за длины"])
             
             try:
-                await bot.send_message(ADMIN_CHAT_ID, report_text)
+                # При CLEANUP_REPORT_LIMIT строк деталей длиннее лимита отчет
+                # бывает только при очень длинных ФИО — тогда отправляем файлом целиком
+                if len(report_text) > CLEANUP_REPORT_MAX_CHARS:
+                    async with send_limiter.slot(ADMIN_CHAT_ID):
+                        await bot.send_document(
+                            ADMIN_CHAT_ID,
+                            BufferedInputFile(report_text.encode("utf-8"), filename="cleanup_report.txt"),
+                            caption=f"🧹 Автоочистка документов: {cleaned_count} мастеров"
+                        )
+                else:
+                    await tg_send(ADMIN_CHAT_ID, report_text)
             except Exception as e:
-                logging.error(f"[CLEANUP_REPORT_ERROR] {e}")
+                logging.error("[CLEANUP_REPORT_ERROR] %s", e)
         
-        logging.info(f"[CLEANUP] Documents cleaned for {cleaned_count} masters")
+        logging.info("[CLEANUP] Documents cleaned for %s masters", cleaned_count)
         
     except Exception as e:
-        logging.error(f"[CLEANUP_ERROR] Global error: {e}")
+        logging.error("[CLEANUP_ERROR] Global error: %s", e)
         
         # Уведомляем админа об ошибке
         if ADMIN_CHAT_ID:
             try:
-                await bot.send_message(
+                await tg_send(
                     ADMIN_CHAT_ID,
                     f"❌ <b>Ошибка автоочистки документов</b>\n\n"
                     f"Ошибка: {str(e)[:500]}\n"
                     f"Время: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
                 )
             except Exception as notify_error:
-                logging.error(f"[CLEANUP_NOTIFY_ERROR] {notify_error}")
+                logging.error("[CLEANUP_NOTIFY_ERROR] %s", notify_error)
 
-def calc_skill_tier(master_id: int) -> str:
-    """Рассчитывает уровень мастерства на основе выполненных заказов"""
-    try:
-        master = db.fetch_one("SELECT orders_completed FROM masters WHERE id = ?", (master_id,))
-        if not master:
-            return "Новичок"
-            
-        orders_completed = master['orders_completed'] or 0
-        
-        if orders_completed < 20:
-            return "Новичок"
-        elif orders_completed < 50:
-            return "Мастер"
-        else:
-            return "Профессионал"
-    except Exception as e:
-        logging.error(f"[CALC_SKILL_TIER_ERROR] {e}")
-        return "Новичок"
+# Уровень мастерства по новому значению orders_completed + 1:
+# меньше 20 — Новичок, меньше 50 — Мастер, дальше — Профессионал
+SKILL_TIER_AFTER_COMPLETE_SQL = """
+    CASE WHEN orders_completed + 1 < 20 THEN 'Новичок'
+         WHEN orders_completed + 1 < 50 THEN 'Мастер'
+         ELSE 'Профессионал' END
+"""
+
+def complete_request_tx(request_id: int):
+    """
+    Одной транзакцией (BEGIN IMMEDIATE): закрыть заявку и увеличить счетчик мастера
+    с пересчетом skill_tier прямо в SQL. Проверка статуса и смена — один UPDATE,
+    поэтому повторный вызов (двойное нажатие) не засчитает заказ дважды.
+    Возвращает строку заявки или None, если заявки нет или она уже завершена.
+    """
+    with db.write_conn() as conn:
+        request = conn.execute("""
+            UPDATE requests
+            SET status = 'completed', completed_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status != 'completed'
+            RETURNING id, master_id, contact, client_user_id,
+                      (SELECT contact FROM masters WHERE id = requests.master_id) AS master_contact
+        """, (request_id,)).fetchone()
+        if not request:
+            return None
+
+        conn.execute(f"""
+            UPDATE masters
+            SET orders_completed = orders_completed + 1,
+                skill_tier = {SKILL_TIER_AFTER_COMPLETE_SQL}
+            WHERE id = ?
+        """, (request['master_id'],))
+    return request
+
+def take_request_tx(request_id: int, master_id: int, use_free_order: bool):
+    """
+    Одной транзакцией: закрепить заявку за мастером (только из статуса 'new'),
+    списать бесплатный заказ и отметить оффер взятым.
+    Возвращает строку заявки или None, если ее уже взял другой мастер.
+    """
+    with db.write_conn() as conn:
+        request = conn.execute("""
+            UPDATE requests SET status = 'assigned', master_id = ?
+            WHERE id = ? AND status = 'new'
+            RETURNING name, contact, description, when_text, district, client_user_id
+        """, (master_id, request_id)).fetchone()
+        if not request:
+            return None
+
+        if use_free_order:
+            conn.execute("UPDATE masters SET free_orders_left=free_orders_left-1 WHERE id=?", (master_id,))
+        conn.execute("UPDATE offers SET status='taken' WHERE request_id=? AND master_id=?", (request_id, master_id))
+    return request
+
+def complete_requests_tx(request_ids: list) -> list:
+    """
+    Пакетный вариант complete_request_tx: один UPDATE ... WHERE id IN (...)
+    и счетчики мастеров в той же транзакции (один коммит на всю пачку).
+    Возвращает строки реально завершенных заявок.
+    """
+    if not request_ids:
+        return []
+    placeholders = ",".join("?" * len(request_ids))
+    with db.write_conn() as conn:
+        requests = conn.execute(f"""
+            UPDATE requests
+            SET status = 'completed', completed_at = CURRENT_TIMESTAMP
+            WHERE id IN ({placeholders}) AND status != 'completed'
+            RETURNING id, master_id, contact, client_user_id,
+                      (SELECT contact FROM masters WHERE id = requests.master_id) AS master_contact
+        """, request_ids).fetchall()
+        # По строке на заявку: у мастера может быть несколько заказов в пачке
+        conn.executemany(f"""
+            UPDATE masters
+            SET orders_completed = orders_completed + 1,
+                skill_tier = {SKILL_TIER_AFTER_COMPLETE_SQL}
+            WHERE id = ?
+        """, [(r['master_id'],) for r in requests])
+    return requests
+
+EXP_BUCKET_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="до 1 года", callback_data="exp:<=1")],
+    [InlineKeyboardButton(text="1–3 года", callback_data="exp:1-3")],
+    [InlineKeyboardButton(text="3–5 лет", callback_data="exp:3-5")],
+    [InlineKeyboardButton(text="5–10 лет", callback_data="exp:5-10")],
+    [InlineKeyboardButton(text="более 10 лет", callback_data="exp:>10")],
+    [InlineKeyboardButton(text="❌ Отмена", callback_data="master:cancel")]
+])
 
 def exp_bucket_kb():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="до 1 года", callback_data="exp:<=1")],
-        [InlineKeyboardButton(text="1–3 года", callback_data="exp:1-3")],
-        [InlineKeyboardButton(text="3–5 лет", callback_data="exp:3-5")],
-        [InlineKeyboardButton(text="5–10 лет", callback_data="exp:5-10")],
-        [InlineKeyboardButton(text="более 10 лет", callback_data="exp:>10")],
-        [InlineKeyboardButton(text="❌ Отмена", callback_data="master:cancel")]
-    ])
+    return EXP_BUCKET_KB
+
+# Код кнопки опыта -> подпись в анкете
+EXP_BUCKET_LABELS = {"<=1":"до 1 года","1-3":"1–3 года","3-5":"3–5 лет","5-10":"5–10 лет",">10":"более 10 лет"}
+
+YES_NO = {True: "Да", False: "Нет"}
 
 def admin_master_card(mid: int) -> str:
     row = db.fetch_one("""
@@ -285,41 +672,37 @@ def admin_master_card(mid: int) -> str:
     if not row:
         return f"Мастер #{mid} — запись не найдена"
     
-    # Используем доступ по ключам (row_factory = sqlite3.Row)
-    fio = row['fio'] or '—'
-    contact = row['contact'] or '—'
-    phone = row['phone'] or '—'
-    level = row['level'] or '—'
-    verified = row['verified']
-    has_npd_ip = row['has_npd_ip']
-    cats_auto = row['categories_auto'] or '—'
-    exp_bucket = row['exp_bucket'] or '—'
-    exp_text = row['exp_text'] or '—'
-    portfolio = row['portfolio'] or '—'
-    inn = row['inn'] or '—'
-
-    verified_txt = "Да" if verified == 1 else "Нет"
-    npd_txt = "Да" if has_npd_ip == 1 else "Нет"
-    return (
-        f"🧾 Анкета мастера #{mid}\n"
-        f"👤 {fio or '—'}\n"
-        f"🆔 uid: {contact or '—'}\n"
-        f"📞 {phone or '—'}\n"
-        f"🏷 Статус: {level or '—'}\n"
-        f"✅ Проверенный: {verified_txt} | НПД/ИП: {npd_txt}\n"
-        f"📂 Категория(ии): {cats_auto or '—'}\n"
-        f"🛠 Опыт: {exp_bucket or '—'}\n"
-        f"📝 Навыки: {exp_text or '—'}\n"
-        f"📚 Портфолио: {portfolio or '—'}\n"
-        f"🧾 ИНН: {inn or '—'}"
-    )
+    # Порядок колонок в SELECT совпадает с параметрами format_master_card
+    return format_master_card(mid, *row)
+
+def format_master_card(mid, fio, contact, phone, level, verified, has_npd_ip, cats_auto,
+                       exp_bucket, exp_text, portfolio, inn) -> str:
+    """Текст анкеты для админа (при регистрации собирается из данных формы, без SELECT)"""
+    return "\n".join((
+        f"🧾 Анкета мастера #{mid}",
+        f"👤 {fio or '—'}",
+        f"🆔 uid: {contact or '—'}",
+        f"📞 {phone or '—'}",
+        f"🏷 Статус: {level or '—'}",
+        f"✅ Проверенный: {YES_NO[verified == 1]} | НПД/ИП: {YES_NO[has_npd_ip == 1]}",
+        f"📂 Категория(ии): {cats_auto or '—'}",
+        f"🛠 Опыт: {exp_bucket or '—'}",
+        f"📝 Навыки: {exp_text or '—'}",
+        f"📚 Портфолио: {portfolio or '—'}",
+        f"🧾 ИНН: {inn or '—'}",
+    ))
 
 MASTER_CATS = ["Ремонт", "Уборка", "Переезд", "Красота", "Персонал", "Другое"]
 
 def build_cats_kb(selected: list[str]) -> InlineKeyboardMarkup:
     """
     Рисуем клавиатуру с чекбоксами (✓) и кнопкой Готово (активна при 1–2 выбранных).
+    Вариантов выбора немного, поэтому готовые клавиатуры кэшируются.
     """
+    return _build_cats_kb(tuple(t for t in MASTER_CATS if t in selected))
+
+@lru_cache(maxsize=64)
+def _build_cats_kb(selected: tuple) -> InlineKeyboardMarkup:
     rows = []
     for title in MASTER_CATS:
         mark = "✓ " if title in selected else ""
@@ -337,100 +720,42 @@ def build_cats_kb(selected: list[str]) -> InlineKeyboardMarkup:
 async def request_review(request_id: int, master_id: int, client_id: str):
     """Запрос отзыва у клиента после выполнения заказа"""
     try:
-        # Проверяем флаг review_requested
-        request_data = db.fetch_one(
-            "SELECT review_requested FROM requests WHERE id = ?", 
-            (request_id,)
-        )
-        if request_data and request_data['review_requested']:
-            logging.info(f"[REVIEW] Review already requested for request #{request_id}")
+        # Атомарно помечаем, что отзыв запрошен: только если ещё не запрашивали
+        # и отзыва нет (защита от повторного запроса при гонке завершений)
+        result = await db.aexecute("""
+            UPDATE requests SET review_requested = 1
+            WHERE id = :rid
+              AND COALESCE(review_requested, 0) = 0
+              AND NOT EXISTS (SELECT 1 FROM reviews WHERE request_id = :rid)
+        """, {"rid": request_id})
+        
+        if not result or result.rowcount != 1:
+            logging.info("[REVIEW] Review already requested or exists for request #%s", request_id)
             return
         
-        # Проверяем, не существует ли уже отзыв
-        existing_review = db.fetch_one(
-            "SELECT id FROM reviews WHERE request_id = ?", 
-            (request_id,)
-        )
-        
-        if existing_review:
-            logging.info(f"[REVIEW] Review already exists for request #{request_id}")
-            return
-        
-        # Помечаем, что отзыв запрошен
-        db.execute(
-            "UPDATE requests SET review_requested = 1 WHERE id = ?", 
-            (request_id,)
-        )
-        
         # Создаем клавиатуру для оценки
-        kb = InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(text="⭐ 1", callback_data=f"review:{request_id}:1"),
-                InlineKeyboardButton(text="⭐ 2", callback_data=f"review:{request_id}:2"), 
-                InlineKeyboardButton(text="⭐ 3", callback_data=f"review:{request_id}:3"),
-                InlineKeyboardButton(text="⭐ 4", callback_data=f"review:{request_id}:4"),
-                InlineKeyboardButton(text="⭐ 5", callback_data=f"review:{request_id}:5")
-            ],
-            [
-                InlineKeyboardButton(text="📝 Написать отзыв", callback_data=f"review_text:{request_id}"),
-                InlineKeyboardButton(text="🚫 Пропустить", callback_data=f"review_skip:{request_id}")
-            ]
-        ])
+        kb = rate_request_kb(request_id)
         
         # Получаем информацию о мастере для персонализации
-        master_info = db.fetch_one(
+        master_info = await db.afetch_one(
             "SELECT fio FROM masters WHERE id = ?", 
             (master_id,)
         )
         master_name = master_info['fio'] if master_info else "мастер"
         
-        await bot.send_message(
+        await tg_send(
             client_id,
             f"📝 <b>Оцените работу {master_name}</b>\n\n"
             f"Заявка #{request_id} завершена. Пожалуйста, оцените качество услуги:",
             reply_markup=kb
         )
         
-        logging.info(f"[REVIEW] Review requested for request #{request_id}")
-        
-    except Exception as e:
-        logging.error(f"[REVIEW_REQUEST_ERROR] {e}")
-
-async def update_master_stats(master_id: int):
-    """Обновление статистики мастера на основе отзывов"""
-    try:
-        # Получаем средний рейтинг и количество отзывов
-        stats = db.fetch_one("""
-            SELECT 
-                AVG(rating) as avg_rating,
-                COUNT(*) as reviews_count,
-                COUNT(CASE WHEN rating = 5 THEN 1 END) as five_stars,
-                COUNT(CASE WHEN rating = 4 THEN 1 END) as four_stars, 
-                COUNT(CASE WHEN rating = 3 THEN 1 END) as three_stars,
-                COUNT(CASE WHEN rating = 2 THEN 1 END) as two_stars,
-                COUNT(CASE WHEN rating = 1 THEN 1 END) as one_stars
-            FROM reviews 
-            WHERE master_id = ?
-        """, (master_id,))
-        
-        if stats and stats['reviews_count'] > 0:
-            avg_rating = round(stats['avg_rating'], 1)
-            reviews_count = stats['reviews_count']
-            
-            # Обновляем рейтинг мастера
-            db.execute("""
-                UPDATE masters 
-                SET avg_rating = ?, reviews_count = ?
-                WHERE id = ?
-            """, (avg_rating, reviews_count, master_id))
-            
-            logging.info(f"[MASTER_STATS] Updated master #{master_id}: rating={avg_rating}, reviews={reviews_count}")
+        logging.info("[REVIEW] Review requested for request #%s", request_id)
         
     except Exception as e:
-        logging.error(f"[MASTER_STATS_ERROR] {e}")
+        logging.error("[REVIEW_REQUEST_ERROR] %s", e)
 
-def get_rating_stars(rating: float) -> str:
-    """Генерирует строку со звездами для рейтинга"""
+def _build_rating_stars(rating: float) -> str:
     full_stars = int(rating)
     half_star = rating - full_stars >= 0.5
     empty_stars = 5 - full_stars - (1 if half_star else 0)
@@ -442,63 +767,70 @@ def get_rating_stars(rating: float) -> str:
     
     return stars
 
+# Целые оценки 0–5 встречаются постоянно — строки считаем один раз (индекс = оценка)
+RATING_STARS = tuple(_build_rating_stars(i) for i in range(6))
+
+def get_rating_stars(rating: float) -> str:
+    """Генерирует строку со звездами для рейтинга"""
+    # Оценки из БД — int 1..5 (CHECK в reviews): берем из таблицы по индексу
+    if type(rating) is int and 0 <= rating <= 5:
+        return RATING_STARS[rating]
+    return _build_rating_stars(rating)
+
 async def mark_request_completed(request_id: int):
-    """Пометить заявку как выполненную и запросить отзыв"""
+    """
+    Пометить заявку как выполненную и запросить отзыв.
+    Возвращает строку заявки (с master_contact) или None.
+    """
     try:
-        # Получаем информацию о заявке
-        request = db.fetch_one("""
-            SELECT id, master_id, contact, client_user_id, status 
-            FROM requests 
-            WHERE id = ?
-        """, (request_id,))
+        # Помечаем как выполненную и обновляем счетчик мастера (одна транзакция)
+        request = await asyncio.to_thread(complete_request_tx, request_id)
         
         if not request:
-            logging.error(f"[COMPLETE_REQUEST] Request #{request_id} not found")
-            return False
-        
-        # Помечаем как выполненную
-        db.execute("""
-            UPDATE requests 
-            SET status = 'completed', completed_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        """, (request_id,))
-        
-        # Определяем client_id для отправки отзыва
-        client_id = request['client_user_id'] if request['client_user_id'] else request['contact']
+            logging.warning("[COMPLETE_REQUEST] Request #%s not found or already completed", request_id)
+            return None
         
-        # Запрашиваем отзыв у клиента
-        await request_review(
-            request_id=request_id,
-            master_id=request['master_id'],
-            client_id=client_id
-        )
+        await after_request_completed(request)
         
-        # Обновляем счетчик выполненных заказов у мастера
-        db.execute("""
-            UPDATE masters 
-            SET orders_completed = orders_completed + 1,
-                skill_tier = ?
-            WHERE id = ?
-        """, (calc_skill_tier(request['master_id']), request['master_id']))
-        
-        logging.info(f"[COMPLETE_REQUEST] Request #{request_id} marked as completed")
-        return True
+        logging.info("[COMPLETE_REQUEST] Request #%s marked as completed", request_id)
+        return request
         
     except Exception as e:
-        logging.error(f"[COMPLETE_REQUEST_ERROR] {e}")
-        return False
+        logging.error("[COMPLETE_REQUEST_ERROR] %s", e)
+        return None
 
-# ----------------- UI ------------------
-def main_menu_kb(user_id: str = None):
-    """Главное меню (адаптивное для мастеров)"""
-    docs_url = "https://disk.yandex.ru/d/1mlvS2VtcJTiXg"
+async def after_request_completed(request):
+    """Сбросить экраны мастера и запросить отзыв у клиента по завершенной заявке"""
+    invalidate_master_views(request['master_contact'])
     
-    # Проверяем является ли пользователь мастером
-    is_master = False
-    if user_id:
-        master = db.fetch_one("SELECT id FROM masters WHERE contact = ?", (user_id,))
-        is_master = master is not None
+    # Определяем client_id для отправки отзыва
+    client_id = request['client_user_id'] if request['client_user_id'] else request['contact']
     
+    # Запрашиваем отзыв у клиента
+    await request_review(
+        request_id=request['id'],
+        master_id=request['master_id'],
+        client_id=client_id
+    )
+
+# ----------------- UI ------------------
+ERR_GENERIC = "❌ Ошибка"
+
+async def main_menu_kb(user_id: str = None):
+    """
+    Главное меню (адаптивное для мастеров).
+    Флаг мастера — из кэша, при промахе запрос в БД уходит в поток.
+    Если флаг уже известен (регистрация, удаление анкеты) — _main_menu_kb(флаг) без запроса.
+    """
+    is_master = await ais_master_user(user_id) if user_id else False
+
+    return _main_menu_kb(is_master)
+
+@lru_cache(maxsize=2)
+def _main_menu_kb(is_master: bool) -> InlineKeyboardMarkup:
+    """Сборка меню: всего два варианта, строим один раз"""
+    docs_url = "https://disk.yandex.ru/d/1mlvS2VtcJTiXg"
+
     buttons = []
     
     # Первая строка: Заявка + (Стать мастером ИЛИ Личный кабинет)
@@ -529,11 +861,82 @@ def main_menu_kb(user_id: str = None):
     
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+HELP_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [
+        InlineKeyboardButton(text="❔ Частые вопросы", callback_data="help:faq"),
+        InlineKeyboardButton(text="📞 Поддержка", callback_data="help:support")
+    ],
+    [InlineKeyboardButton(text="🏠 Главное меню", callback_data="go:menu")]
+])
+
+BECOME_MASTER_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="👨‍🔧 Стать мастером", callback_data="go:master")],
+    [InlineKeyboardButton(text="🏠 Главное меню", callback_data="go:menu")]
+])
+
+NO_REQUESTS_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📝 Оставить заявку", callback_data="go:req")],
+    [InlineKeyboardButton(text="🏠 Главное меню", callback_data="go:menu")]
+])
+
+MY_REQUESTS_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📝 Новая заявка", callback_data="go:req")],
+    [InlineKeyboardButton(text="🏠 Главное меню", callback_data="go:menu")]
+])
+
+# Клавиатуры с номером заявки: повторные нажатия по той же заявке берутся из кэша
+@lru_cache(maxsize=256)
+def rate_request_kb(request_id: int) -> InlineKeyboardMarkup:
+    """Оценка 1–5, текстовый отзыв или пропуск"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"⭐ {i}", callback_data=f"review:{request_id}:{i}") for i in range(1, 6)],
+        [
+            InlineKeyboardButton(text="📝 Написать отзыв", callback_data=f"review_text:{request_id}"),
+            InlineKeyboardButton(text="🚫 Пропустить", callback_data=f"review_skip:{request_id}")
+        ]
+    ])
+
+@lru_cache(maxsize=256)
+def review_text_kb(request_id: int) -> InlineKeyboardMarkup:
+    """Добавить текст к оценке или завершить"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📝 Написать отзыв", callback_data=f"review_text:{request_id}")],
+        [InlineKeyboardButton(text="✅ Готово", callback_data=f"review_done:{request_id}")]
+    ])
+
+@lru_cache(maxsize=256)
+def confirm_done_kb(request_id: int) -> InlineKeyboardMarkup:
+    """Клиент подтверждает выполнение заказа"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Да, всё отлично", callback_data=f"confirm:{request_id}:yes")],
+        [InlineKeyboardButton(text="❌ Есть проблемы", callback_data=f"confirm:{request_id}:no")]
+    ])
+
 # ----------------- MASTER COMMON FUNCTIONS --------
+# Эмодзи статусов
+MASTER_LEVEL_EMOJI = {
+    "Кандидат": "🟡",
+    "Проверенный": "🟢",
+    "Верифицированный": "💎"
+}
+
+MASTER_CABINET_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [
+        InlineKeyboardButton(text="📋 Мои заказы", callback_data="master:orders"),
+        InlineKeyboardButton(text="⭐ Отзывы", callback_data="master:reviews")
+    ],
+    [
+        InlineKeyboardButton(text="📊 Статистика", callback_data="master:stats"),
+        InlineKeyboardButton(text="💳 Подписка", callback_data="go:billing")
+    ],
+    [InlineKeyboardButton(text="🏠 Главное меню", callback_data="go:menu")]
+])
+
+@cached_view("cabinet")
 async def get_master_cabinet_data(user_id: str):
     """Общая функция для получения данных личного кабинета мастера"""
     # Проверяем, является ли пользователь мастером
-    master = db.fetch_one("""
+    master = await db.afetch_one("""
         SELECT id, fio, phone, level, categories_auto,
                avg_rating, reviews_count, orders_completed, skill_tier,
                free_orders_left, sub_until, priority_until, pin_until
@@ -544,35 +947,18 @@ async def get_master_cabinet_data(user_id: str):
     if not master:
         return None
 
-    # Эмодзи статусов
-    status_emoji = {
-        "Кандидат": "🟡",
-        "Проверенный": "🟢",
-        "Верифицированный": "💎"
-    }
-
     # Проверяем подписки
     sub_active = is_active(master['sub_until'])
     priority_active = is_active(master['priority_until'])
     pin_active = is_active(master['pin_until'])
 
-    # Форматируем даты
-    def format_date(date_str):
-        if not date_str:
-            return "—"
-        try:
-            dt = datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S")
-            return dt.strftime("%d.%m.%Y")
-        except:
-            return "—"
-
-    sub_status = f"✅ до {format_date(master['sub_until'])}" if sub_active else "❌ не активна"
-    priority_status = f"⚡ до {format_date(master['priority_until'])}" if priority_active else "❌ не активен"
-    pin_status = f"📌 до {format_date(master['pin_until'])}" if pin_active else "❌ не активен"
+    sub_status = f"✅ до {fmt_db_date(master['sub_until'])}" if sub_active else "❌ не активна"
+    priority_status = f"⚡ до {fmt_db_date(master['priority_until'])}" if priority_active else "❌ не активен"
+    pin_status = f"📌 до {fmt_db_date(master['pin_until'])}" if pin_active else "❌ не активен"
 
     # Формируем сообщение
     text = (
-        f"{status_emoji.get(master['level'], '⚪')} <b>Личный кабинет мастера</b>\n\n"
+        f"{MASTER_LEVEL_EMOJI.get(master['level'], '⚪')} <b>Личный кабинет мастера</b>\n\n"
         f"👤 <b>{master['fio']}</b>\n"
         f"📞 {master['phone'] or 'не указан'}\n"
         f"📂 {master['categories_auto'] or 'не указаны'}\n"
@@ -589,26 +975,14 @@ async def get_master_cabinet_data(user_id: str):
         f"📌 Закреп: {pin_status}"
     )
 
-    # Создаём клавиатуру
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="📋 Мои заказы", callback_data="master:orders"),
-            InlineKeyboardButton(text="⭐ Отзывы", callback_data="master:reviews")
-        ],
-        [
-            InlineKeyboardButton(text="📊 Статистика", callback_data="master:stats"),
-            InlineKeyboardButton(text="💳 Подписка", callback_data="go:billing")
-        ],
-        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="go:menu")]
-    ])
-
-    return {"text": text, "keyboard": kb}
+    return {"text": text, "keyboard": MASTER_CABINET_KB}
 
+@cached_view("reviews")
 async def get_master_reviews_data(user_id: str):
     """Общая функция для получения отзывов мастера"""
     try:
         # Получаем данные мастера
-        master = db.fetch_one("SELECT id, fio FROM masters WHERE contact = ?", (user_id,))
+        master = await aget_master_by_contact(user_id)
 
         if not master:
             return None
@@ -617,7 +991,7 @@ async def get_master_reviews_data(user_id: str):
         master_fio = master['fio']
 
         # Получаем статистику
-        stats = db.fetch_one("""
+        stats = await db.afetch_one("""
             SELECT
                 COUNT(*) as reviews_count,
                 AVG(rating) as avg_rating,
@@ -634,8 +1008,8 @@ async def get_master_reviews_data(user_id: str):
             return {"text": "📝 У вас пока нет отзывов", "keyboard": None}
 
         # Получаем последние отзывы
-        reviews = db.fetch_all("""
-            SELECT r.rating, r.comment, r.created_at, r.request_id
+        reviews = await db.afetch_all("""
+            SELECT r.rating, substr(r.comment, 1, 151) AS comment, r.created_at, r.request_id
             FROM reviews r
             WHERE r.master_id = ?
             ORDER BY r.created_at DESC
@@ -645,33 +1019,32 @@ async def get_master_reviews_data(user_id: str):
         # Формируем сообщение
         text_lines = [f"⭐ <b>Отзывы на {master_fio}</b>\n"]
 
+        # Распаковываем статистику один раз (порядок — как в SELECT)
+        total, avg_rating, five_stars, four_stars, three_stars, two_stars, one_stars = stats
+
         # Общая статистика
-        text_lines.append(f"📊 <b>Общая оценка: {stats['avg_rating']:.1f}/5.0</b> ({stats['reviews_count']} отзывов)\n")
+        text_lines.append(f"📊 <b>Общая оценка: {avg_rating:.1f}/5.0</b> ({total} отзывов)\n")
 
         # Разбивка по звёздам
         text_lines.append("<b>Распределение оценок:</b>")
-        total = stats['reviews_count']
-        text_lines.append(f"⭐⭐⭐⭐⭐ {stats['five_stars']} ({stats['five_stars']/total*100:.0f}%)")
-        text_lines.append(f"⭐⭐⭐⭐ {stats['four_stars']} ({stats['four_stars']/total*100:.0f}%)")
-        text_lines.append(f"⭐⭐⭐ {stats['three_stars']} ({stats['three_stars']/total*100:.0f}%)")
-        if stats['two_stars'] > 0:
-            text_lines.append(f"⭐⭐ {stats['two_stars']} ({stats['two_stars']/total*100:.0f}%)")
-        if stats['one_stars'] > 0:
-            text_lines.append(f"⭐ {stats['one_stars']} ({stats['one_stars']/total*100:.0f}%)")
+        text_lines.append(f"⭐⭐⭐⭐⭐ {five_stars} ({five_stars/total*100:.0f}%)")
+        text_lines.append(f"⭐⭐⭐⭐ {four_stars} ({four_stars/total*100:.0f}%)")
+        text_lines.append(f"⭐⭐⭐ {three_stars} ({three_stars/total*100:.0f}%)")
+        if two_stars > 0:
+            text_lines.append(f"⭐⭐ {two_stars} ({two_stars/total*100:.0f}%)")
+        if one_stars > 0:
+            text_lines.append(f"⭐ {one_stars} ({one_stars/total*100:.0f}%)")
 
         # Последние отзывы
         text_lines.append(f"\n<b>Последние отзывы:</b>")
 
-        for i, review in enumerate(reviews[:5], 1):
-            stars = get_rating_stars(review['rating'])
-            date = datetime.fromisoformat(review['created_at']).strftime('%d.%m.%Y')
+        for i, (rating, comment, created_at, _request_id) in enumerate(reviews[:5], 1):
+            stars = get_rating_stars(rating)
+            date = fmt_db_date(created_at)
 
             text_lines.append(f"\n{i}. {stars} <i>({date})</i>")
-            if review['comment']:
-                comment = review['comment']
-                if len(comment) > 150:
-                    comment = comment[:150] + "..."
-                text_lines.append(f"   💬 «{comment}»")
+            if comment:
+                text_lines.append(f"   💬 «{truncate(comment, 150)}»")
 
         if len(reviews) > 5:
             text_lines.append(f"\n... и ещё {len(reviews) - 5} отзывов")
@@ -679,14 +1052,15 @@ async def get_master_reviews_data(user_id: str):
         return {"text": "\n".join(text_lines), "keyboard": None}
 
     except Exception as e:
-        logging.error(f"[GET_MASTER_REVIEWS_ERROR] {e}")
+        logging.error("[GET_MASTER_REVIEWS_ERROR] %s", e)
         return {"error": "❌ Ошибка при получении отзывов"}
 
+@cached_view("stats")
 async def get_master_stats_data(user_id: str):
     """Общая функция для получения статистики мастера"""
     try:
         # Получаем данные мастера
-        master = db.fetch_one("""
+        master = await db.afetch_one("""
             SELECT id, fio, created_at, orders_completed, avg_rating, reviews_count, skill_tier
             FROM masters
             WHERE contact = ?
@@ -697,29 +1071,19 @@ async def get_master_stats_data(user_id: str):
 
         master_id = master['id']
 
-        # Считаем активные заказы
-        active_orders = db.fetch_one("""
-            SELECT COUNT(*) as count
-            FROM requests
-            WHERE master_id = ? AND status = 'assigned'
-        """, (master_id,))['count']
-
-        # Считаем пропущенные заказы
-        skipped_orders = db.fetch_one("""
-            SELECT COUNT(*) as count
-            FROM offers
-            WHERE master_id = ? AND status = 'skipped'
-        """, (master_id,))['count']
-
-        # Считаем принятые предложения
-        accepted_offers = db.fetch_one("""
-            SELECT COUNT(*) as count
-            FROM offers
-            WHERE master_id = ? AND status = 'accepted'
-        """, (master_id,))['count']
+        # Счётчики заказов одним запросом (индексы по master_id, status)
+        counters = await db.afetch_one("""
+            SELECT
+                (SELECT COUNT(*) FROM requests WHERE master_id = :mid AND status = 'assigned') AS active_orders,
+                (SELECT COUNT(*) FROM offers WHERE master_id = :mid AND status = 'skipped') AS skipped_orders,
+                (SELECT COUNT(*) FROM offers WHERE master_id = :mid AND status = 'accepted') AS accepted_offers
+        """, {"mid": master_id})
+        active_orders = counters['active_orders']
+        skipped_orders = counters['skipped_orders']
+        accepted_offers = counters['accepted_offers']
 
         # Дата регистрации
-        reg_date = datetime.fromisoformat(master['created_at']).strftime('%d.%m.%Y')
+        reg_date = fmt_db_date(master['created_at'])
 
         # Формируем сообщение
         text_lines = [
@@ -747,47 +1111,66 @@ async def get_master_stats_data(user_id: str):
         return {"text": "\n".join(text_lines), "keyboard": None}
 
     except Exception as e:
-        logging.error(f"[GET_MASTER_STATS_ERROR] {e}")
+        logging.error("[GET_MASTER_STATS_ERROR] %s", e)
         return {"error": "❌ Ошибка при получении статистики"}
 
 async def get_master_orders_data(user_id: str):
     """Общая функция для получения заказов мастера"""
     try:
         # Получаем ID мастера
-        master = db.fetch_one("SELECT id, fio FROM masters WHERE contact = ?", (user_id,))
+        master = await aget_master_by_contact(user_id)
 
         if not master:
             return None
 
         master_id = master['id']
 
-        # Активные заказы
-        active = db.fetch_all("""
-            SELECT id, category, district, when_text, status
-            FROM requests
-            WHERE master_id = ? AND status IN ('assigned', 'pending_confirmation')
-            ORDER BY created_at DESC
-        """, (master_id,))
-
-        # Завершённые заказы
-        completed = db.fetch_all("""
-            SELECT r.id, r.category, r.completed_at, rev.rating
-            FROM requests r
-            LEFT JOIN reviews rev ON r.id = rev.request_id
-            WHERE r.master_id = ? AND r.status = 'completed'
-            ORDER BY r.completed_at DESC
-            LIMIT 10
-        """, (master_id,))
+        # Активные, последние завершённые (5) и пропущенные (3) заказы одним запросом
+        rows = await db.afetch_all("""
+            SELECT * FROM (
+                SELECT 'active' AS kind, id, category, district, when_text, status,
+                       NULL AS completed_at, NULL AS rating, NULL AS skipped_at
+                FROM requests
+                WHERE master_id = :mid AND status IN ('assigned', 'pending_confirmation')
+                ORDER BY created_at DESC
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT 'completed', r.id, r.category, NULL, NULL, NULL,
+                       r.completed_at, rev.rating, NULL
+                FROM requests r
+                LEFT JOIN reviews rev ON r.id = rev.request_id
+                WHERE r.master_id = :mid AND r.status = 'completed'
+                ORDER BY r.completed_at DESC
+                LIMIT 5
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT 'skipped', req.id, req.category, NULL, NULL, NULL,
+                       NULL, NULL, o.created_at
+                FROM offers o
+                JOIN requests req ON o.request_id = req.id
+                WHERE o.master_id = :mid AND o.status = 'skipped'
+                ORDER BY o.created_at DESC
+                LIMIT 3
+            )
+        """, {"mid": master_id})
 
-        # Пропущенные заказы
-        skipped = db.fetch_all("""
-            SELECT req.id, req.category, o.created_at
-            FROM offers o
-            JOIN requests req ON o.request_id = req.id
-            WHERE o.master_id = ? AND o.status = 'skipped'
-            ORDER BY o.created_at DESC
-            LIMIT 5
-        """, (master_id,))
+        # Полные количества для заголовков и строки "... и ещё N"
+        totals = await db.afetch_one("""
+            SELECT
+                (SELECT COUNT(*) FROM requests
+                 WHERE master_id = :mid AND status = 'completed') AS completed,
+                (SELECT COUNT(*) FROM offers
+                 WHERE master_id = :mid AND status = 'skipped') AS skipped
+        """, {"mid": master_id})
+
+        active, completed, skipped = [], [], []
+        by_kind = {"active": active, "completed": completed, "skipped": skipped}
+        for row in rows:
+            by_kind[row['kind']].append(row)
+        total_completed = totals['completed'] if totals else len(completed)
+        total_skipped = totals['skipped'] if totals else len(skipped)
 
         # Формируем сообщение
         text_lines = [f"📋 <b>Мои заказы</b>\n"]
@@ -808,32 +1191,32 @@ async def get_master_orders_data(user_id: str):
 
         # Завершённые
         if completed:
-            text_lines.append(f"✅ <b>ЗАВЕРШЁННЫЕ ({len(completed)}):</b>")
-            for order in completed[:5]:
-                date = datetime.fromisoformat(order['completed_at']).strftime('%d.%m.%Y')
+            text_lines.append(f"✅ <b>ЗАВЕРШЁННЫЕ ({total_completed}):</b>")
+            for order in completed:
+                date = fmt_db_date(order['completed_at'])
                 rating_text = f"⭐ {order['rating']}" if order['rating'] else "без отзыва"
                 text_lines.append(f"  #{order['id']} | {order['category']} | {date} | {rating_text}")
 
-            if len(completed) > 5:
-                text_lines.append(f"  ... и ещё {len(completed) - 5} заказов")
+            if total_completed > len(completed):
+                text_lines.append(f"  ... и ещё {total_completed - len(completed)} заказов")
             text_lines.append("")
         else:
             text_lines.append("✅ <b>ЗАВЕРШЁННЫЕ:</b> нет\n")
 
         # Пропущенные
         if skipped:
-            text_lines.append(f"⏭ <b>ПРОПУЩЕННЫЕ ({len(skipped)}):</b>")
-            for order in skipped[:3]:
-                date = datetime.fromisoformat(order['created_at']).strftime('%d.%m.%Y')
+            text_lines.append(f"⏭ <b>ПРОПУЩЕННЫЕ ({total_skipped}):</b>")
+            for order in skipped:
+                date = fmt_db_date(order['skipped_at'])
                 text_lines.append(f"  #{order['id']} | {order['category']} | {date}")
 
-            if len(skipped) > 3:
-                text_lines.append(f"  ... и ещё {len(skipped) - 3} заказов")
+            if total_skipped > len(skipped):
+                text_lines.append(f"  ... и ещё {total_skipped - len(skipped)} заказов")
 
         return {"text": "\n".join(text_lines), "keyboard": None}
 
     except Exception as e:
-        logging.error(f"[GET_MASTER_ORDERS_ERROR] {e}")
+        logging.error("[GET_MASTER_ORDERS_ERROR] %s", e)
         return {"error": "❌ Ошибка при получении заказов"}
 
 # ----------------- START / MENU --------
@@ -842,15 +1225,11 @@ async def start(m: Message):
     user_id = m.from_user.id
     
     # Лимит: 10 запусков бота в час
-    if not rate_limiter.check_limit(user_id, "start_command", 10, 3600):
-        remaining_time = rate_limiter.get_time_until_reset(user_id, "start_command", 3600)
-        hours = remaining_time // 3600
-        minutes = (remaining_time % 3600) // 60
-        
-        time_msg = f"{minutes} минут" if hours == 0 else f"{hours} час {minutes} минут"
+    allowed, _, remaining_time = await consume_limit(user_id, "start_command", 10, 3600)
+    if not allowed:
         await m.answer(
-            f"❌ Слишком много запросов. Попробуйте через {time_msg}.",
-            reply_markup=main_menu_kb(str(c.from_user.id))
+            limit_denied_text("start_command", remaining_time),
+            reply_markup=await main_menu_kb(str(user_id))
         )
         return
     
@@ -860,7 +1239,7 @@ async def start(m: Message):
         "• Найти проверенного мастера\n"
         "• Стать мастером и получать заказы\n\n"
         "📄 Ознакомьтесь с <a href='https://disk.yandex.ru/d/1mlvS2VtcJTiXg'>документами</a> перед использованием.",
-        reply_markup=main_menu_kb(str(user_id)),
+        reply_markup=await main_menu_kb(str(user_id)),
         disable_web_page_preview=True
     )
 
@@ -871,24 +1250,14 @@ async def menu(m: Message):
 @dp.callback_query(F.data.startswith("go:"))
 async def go_router(c: CallbackQuery, state: FSMContext):
     await state.clear()
-    action = c.data.split(":")[1]
+    action = c.data.partition(":")[2]
     user_id = c.from_user.id
     
     if action == "req":
         # Лимит: 3 новые заявки в час
-        if not rate_limiter.check_limit(user_id, "new_request", 3, 3600):
-            remaining = rate_limiter.get_remaining(user_id, "new_request", 3, 3600)
-            remaining_time = rate_limiter.get_time_until_reset(user_id, "new_request", 3600)
-            
-            if remaining_time > 0:
-                minutes = (remaining_time % 3600) // 60
-                await c.answer(
-                    f"❌ Лимит заявок исчерпан. Доступно через: {minutes} минут.\n"
-                    f"💡 Можно создать: {remaining} заявок после сброса лимита",
-                    show_alert=True
-                )
-            else:
-                await c.answer(f"❌ Лимит заявок исчерпан. Можно создать: {remaining} заявок", show_alert=True)
+        allowed, _, remaining_time = await consume_limit(user_id, "new_request", 3, 3600)
+        if not allowed:
+            await c.answer(limit_denied_text("new_request", remaining_time), show_alert=True)
             return
         
         await c.message.answer("Как вас зовут?")
@@ -896,14 +1265,9 @@ async def go_router(c: CallbackQuery, state: FSMContext):
         
     elif action == "master":
         # Лимит: 3 попытки регистрации мастера за 24 часа
-        if not rate_limiter.check_limit(user_id, "master_registration", 3, 86400):
-            remaining_time = rate_limiter.get_time_until_reset(user_id, "master_registration", 86400)
-            hours = remaining_time // 10800
-            
-            await c.answer(
-                f"❌ Регистрация мастера возможна 3 раза в сутки. Попробуйте через {hours} часов.",
-                show_alert=True
-            )
+        allowed, _, remaining_time = await consume_limit(user_id, "master_registration", 3, 86400)
+        if not allowed:
+            await c.answer(limit_denied_text("master_registration", remaining_time), show_alert=True)
             return
         
         await c.message.answer("Анкета мастера. Укажите ваши ФИО:")
@@ -911,48 +1275,20 @@ async def go_router(c: CallbackQuery, state: FSMContext):
         
     elif action == "complaint":
         # Лимит: 5 жалоб в сутки
-        if not rate_limiter.check_limit(user_id, "complaint", 5, 86400):
-            remaining = rate_limiter.get_remaining(user_id, "complaint", 5, 86400)
-            remaining_time = rate_limiter.get_time_until_reset(user_id, "complaint", 86400)
-            
-            # Форматируем время до сброса
-            hours = remaining_time // 3600
-            minutes = (remaining_time % 3600) // 60
-            
-            if hours > 0:
-                time_msg = f"{hours} часов {minutes} минут"
-            else:
-                time_msg = f"{minutes} минут"
-            
-            await c.answer(
-                f"❌ Лимит жалоб исчерпан.\n"
-                f"💡 Можно отправить: {remaining} жалоб через {time_msg}",
-                show_alert=True
-            )
+        allowed, _, remaining_time = await consume_limit(user_id, "complaint", 5, 86400)
+        if not allowed:
+            await c.answer(limit_denied_text("complaint", remaining_time), show_alert=True)
             return
         
         await c.message.answer("Жалоба. Кто вы? (клиент/мастер/другое)")
         await state.set_state(Complaint.who)
         
     elif action == "billing":
-        await c.message.answer(
-            "<b>Подписка и услуги для мастеров</b>\n\n"
-            "🔹 Новым мастерам: 3 заказа бесплатно\n"
-            "🔹 Далее подписка: 990 ₽/мес (безлимит)\n\n"
-            "Доп.услуги:\n"
-            "⚡ Приоритет заказов — 490 ₽/мес\n"
-            "📌 Закреп анкеты — 190 ₽/нед\n",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="💳 Подписка 990 ₽", callback_data="pay:sub")],
-                [InlineKeyboardButton(text="⚡ Приоритет 490 ₽", callback_data="pay:priority")],
-                [InlineKeyboardButton(text="📌 Закреп 190 ₽", callback_data="pay:pin")],
-                [InlineKeyboardButton(text="🏠 Меню", callback_data="go:menu")]
-            ])
-        )
+        await c.message.answer(BILLING_TEXT, reply_markup=BILLING_KB)
     elif action == "menu":
-        await c.message.edit_text(
+        await safe_edit(c.message,
             "Главное меню:", 
-            reply_markup=main_menu_kb(str(c.from_user.id))
+            reply_markup=await main_menu_kb(str(c.from_user.id))
         )
     
     await c.answer()
@@ -960,19 +1296,20 @@ async def go_router(c: CallbackQuery, state: FSMContext):
 @dp.callback_query(F.data == "master:cancel")
 async def master_cancel(c: CallbackQuery, state: FSMContext):
     await state.clear()
-    await c.message.edit_text("❌ Заполнение анкеты мастера отменено.", reply_markup=main_menu_kb(str(c.from_user.id)))
+    await safe_edit(c.message, "❌ Заполнение анкеты мастера отменено.", reply_markup=await main_menu_kb(str(c.from_user.id)))
     await c.answer()
 
 @dp.callback_query(F.data.startswith("review:"))
 async def process_rating(c: CallbackQuery, state: FSMContext):
     """Обработка оценки от клиента"""
     try:
-        _, request_id, rating = c.data.split(":")
-        request_id, rating = int(request_id), int(rating)
+        match = CB_REVIEW.match(c.data)
+        request_id, rating = int(match[1]), int(match[2])
         
         # Получаем информацию о заявке
-        request = db.fetch_one("""
-            SELECT master_id, contact 
+        request = await db.afetch_one("""
+            SELECT master_id, contact,
+                   (SELECT contact FROM masters WHERE id = requests.master_id) AS master_contact
             FROM requests 
             WHERE id = ?
         """, (request_id,))
@@ -983,23 +1320,21 @@ async def process_rating(c: CallbackQuery, state: FSMContext):
         
         master_id = request['master_id']
         
-        # Сохраняем оценку
-        db.execute("""
+        # Сохраняем оценку; рейтинг и число отзывов мастера обновит триггер reviews_ai
+        result = await db.aexecute("""
             INSERT INTO reviews (request_id, master_id, client_id, rating)
             VALUES (?, ?, ?, ?)
         """, (request_id, master_id, str(c.from_user.id), rating))
-        db.commit()
-
-        # Обновляем статистику мастера
-        await update_master_stats(master_id)
+        if result is None:
+            await c.answer("❌ Ошибка при обработке оценки")
+            return
+        invalidate_master_views(request['master_contact'])
+        invalidate_stats()
         
         # Предлагаем написать текстовый отзыв
-        kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="📝 Написать отзыв", callback_data=f"review_text:{request_id}")],
-            [InlineKeyboardButton(text="✅ Готово", callback_data=f"review_done:{request_id}")]
-        ])
+        kb = review_text_kb(request_id)
         
-        await c.message.edit_text(
+        await safe_edit(c.message,
             f"✅ Спасибо за вашу оценку: {rating} {get_rating_stars(rating)}\n\n"
             "Хотите добавить текстовый отзыв?",
             reply_markup=kb
@@ -1008,20 +1343,20 @@ async def process_rating(c: CallbackQuery, state: FSMContext):
         await c.answer()
         
     except Exception as e:
-        logging.error(f"[RATING_PROCESS_ERROR] {e}")
+        logging.error("[RATING_PROCESS_ERROR] %s", e)
         await c.answer("❌ Ошибка при обработке оценки")
 
 @dp.callback_query(F.data.startswith("review_text:"))
 async def request_review_text(c: CallbackQuery, state: FSMContext):
     """Запрос текстового отзыва"""
     try:
-        request_id = int(c.data.split(":")[1])
+        request_id = int(c.data.partition(":")[2])
         
         # Сохраняем request_id в состоянии
         await state.update_data(review_request_id=request_id)
         await state.set_state(Complaint.text)  # Используем существующее состояние для текста
         
-        await c.message.edit_text(
+        await safe_edit(c.message,
             "📝 Напишите ваш отзыв о работе мастера:\n\n"
             "• Что понравилось?\n"
             "• Что можно улучшить?\n"
@@ -1032,222 +1367,225 @@ async def request_review_text(c: CallbackQuery, state: FSMContext):
         await c.answer()
         
     except Exception as e:
-        logging.error(f"[REVIEW_TEXT_ERROR] {e}")
-        await c.answer("❌ Ошибка")
+        logging.error("[REVIEW_TEXT_ERROR] %s", e)
+        await c.answer(ERR_GENERIC)
 
 @dp.callback_query(F.data.startswith("review_done:"))
 async def finish_review(c: CallbackQuery, state: FSMContext):
     """Завершение процесса отзыва"""
     try:
-        request_id = int(c.data.split(":")[1])
+        request_id = int(c.data.partition(":")[2])
         
-        await c.message.edit_text(
+        await safe_edit(c.message,
             "✅ Спасибо за ваш отзыв! Он поможет другим пользователям выбрать надежного мастера."
         )
         
         await c.answer()
         
     except Exception as e:
-        logging.error(f"[REVIEW_DONE_ERROR] {e}")
-        await c.answer("❌ Ошибка")
+        logging.error("[REVIEW_DONE_ERROR] %s", e)
+        await c.answer(ERR_GENERIC)
 
 @dp.callback_query(F.data.startswith("review_skip:"))
 async def skip_review(c: CallbackQuery, state: FSMContext):
     """Пропуск отзыва"""
     try:
-        request_id = int(c.data.split(":")[1])
+        request_id = int(c.data.partition(":")[2])
         
-        await c.message.edit_text(
+        await safe_edit(c.message,
             "👌 Хорошо! Если передумаете - всегда можете написать отзыв позже."
         )
         
         await c.answer()
         
     except Exception as e:
-        logging.error(f"[REVIEW_SKIP_ERROR] {e}")
-        await c.answer("❌ Ошибка")
+        logging.error("[REVIEW_SKIP_ERROR] %s", e)
+        await c.answer(ERR_GENERIC)
 
 @dp.callback_query(F.data.startswith("complete:"))
 async def complete_order(c: CallbackQuery):
     """Мастер отмечает заказ как выполненный (ждём подтверждения клиента)"""
     try:
-        _, request_id = c.data.split(":")
-        request_id = int(request_id)
+        request_id = int(c.data.partition(":")[2])
         
         user_id = str(c.from_user.id)
         
-        # Проверяем, что заказ принадлежит этому мастеру
-        request = db.fetch_one("""
-            SELECT id, master_id, status, client_user_id 
-            FROM requests 
-            WHERE id = ? AND master_id = (SELECT id FROM masters WHERE contact = ?)
+        # Меняем статус на "ожидает подтверждения", если заказ принадлежит этому мастеру,
+        # и сразу получаем данные для уведомления клиента
+        rows = await db.aexecute_returning("""
+            UPDATE requests SET status = 'pending_confirmation'
+            WHERE id = ?
+              AND status NOT IN ('completed', 'pending_confirmation')
+              AND master_id = (SELECT id FROM masters WHERE contact = ?)
+            RETURNING client_user_id,
+                      (SELECT fio FROM masters WHERE id = requests.master_id) AS master_fio
         """, (request_id, user_id))
         
-        if not request:
-            await c.answer("❌ Заказ не найден или у вас нет прав", show_alert=True)
-            return
-        
-        if request['status'] == 'completed':
-            await c.answer("❌ Этот заказ уже завершен", show_alert=True)
-            return
-        
-        if request['status'] == 'pending_confirmation':
-            await c.answer("⏳ Ожидаем подтверждения от клиента", show_alert=True)
+        if not rows:
+            # Разбираемся, почему не обновили (редкий путь)
+            request = await db.afetch_one("""
+                SELECT r.status
+                FROM requests r
+                JOIN masters m ON m.id = r.master_id
+                WHERE r.id = ? AND m.contact = ?
+            """, (request_id, user_id))
+            if not request:
+                await c.answer("❌ Заказ не найден или у вас нет прав", show_alert=True)
+            elif request['status'] == 'completed':
+                await c.answer("❌ Этот заказ уже завершен", show_alert=True)
+            else:
+                await c.answer("⏳ Ожидаем подтверждения от клиента", show_alert=True)
             return
-        
-        # Меняем статус на "ожидает подтверждения"
-        db.execute(
-            "UPDATE requests SET status = 'pending_confirmation' WHERE id = ?", 
-            (request_id,)
-        )
+        request = rows[0]
         
         # Уведомляем мастера
-        await c.message.edit_text(
+        sends = [safe_edit(c.message,
             "⏳ Вы отметили заказ как выполненный.\n"
             "Ожидаем подтверждения от клиента."
-        )
+        )]
         
         # Запрашиваем подтверждение у клиента
         if request['client_user_id']:
-            master_info = db.fetch_one("SELECT fio FROM masters WHERE id = ?", (request['master_id'],))
-            master_name = master_info['fio'] if master_info else "Мастер"
-            
-            kb = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="✅ Да, всё отлично", callback_data=f"confirm:{request_id}:yes")],
-                [InlineKeyboardButton(text="❌ Есть проблемы", callback_data=f"confirm:{request_id}:no")]
-            ])
-            
-            try:
-                await bot.send_message(
-                    int(request['client_user_id']),
-                    f"👨‍🔧 <b>{master_name}</b> отметил заказ #{request_id} как выполненный.\n\n"
-                    f"Работа действительно выполнена качественно?",
-                    reply_markup=kb
-                )
-            except Exception as e:
-                logging.error(f"[CLIENT_CONFIRM_ERROR] {e}")
-        
+            master_name = request['master_fio'] or "Мастер"
+            sends.append(tg_send(
+                int(request['client_user_id']),
+                f"👨‍🔧 <b>{master_name}</b> отметил заказ #{request_id} как выполненный.\n\n"
+                f"Работа действительно выполнена качественно?",
+                reply_markup=confirm_done_kb(request_id)
+            ))
+        
+        # Сообщение мастеру и запрос клиенту независимы — отправляем параллельно
+        await gather_logged(*sends, tag="CLIENT_CONFIRM")
         await c.answer()
         
     except Exception as e:
-        logging.error(f"[COMPLETE_ORDER_ERROR] {e}")
-        await c.answer("❌ Ошибка")
+        logging.error("[COMPLETE_ORDER_ERROR] %s", e)
+        await c.answer(ERR_GENERIC)
+
+async def answer_confirmation_missed(c: CallbackQuery, request_id: int):
+    """Ответ, когда статус заявки не сменился (редкий путь: уже обработана или удалена)"""
+    row = await db.afetch_one("SELECT status FROM requests WHERE id = ?", (request_id,))
+    if not row:
+        await c.answer("❌ Заказ не найден", show_alert=True)
+    elif row['status'] == 'completed':
+        await c.answer("✅ Заказ уже завершён", show_alert=True)
+    else:
+        await c.answer("ℹ️ Ответ по этому заказу уже получен", show_alert=True)
 
 @dp.callback_query(F.data.startswith("confirm:"))
 async def client_confirmation(c: CallbackQuery):
     """Клиент подтверждает или отклоняет завершение заказа"""
     try:
-        _, request_id, answer = c.data.split(":")
-        request_id = int(request_id)
-        
-        # Получаем информацию о заказе
-        request = db.fetch_one("""
-            SELECT id, master_id, status, name
-            FROM requests 
-            WHERE id = ?
-        """, (request_id,))
-        
-        if not request:
-            await c.answer("❌ Заказ не найден", show_alert=True)
-            return
-        
-        if request['status'] == 'completed':
-            await c.answer("✅ Заказ уже завершён", show_alert=True)
-            return
+        match = CB_CONFIRM.match(c.data)
+        request_id, answer = int(match[1]), match[2]
         
+        # Статус меняется только вместе с проверкой (один UPDATE), без чтения заранее:
+        # при повторном нажатии второй запрос просто не найдет подходящую строку
         if answer == "yes":
             # Клиент подтвердил — завершаем заказ
-            success = await mark_request_completed(request_id)
+            request = await mark_request_completed(request_id)
+            if not request:
+                await answer_confirmation_missed(c, request_id)
+                return
             
-            if success:
-                await c.message.edit_text(
-                    "✅ Спасибо за подтверждение!\n"
-                    "Пожалуйста, оцените работу мастера 👇"
-                )
-                
-                # Уведомляем мастера
-                master = db.fetch_one("SELECT contact FROM masters WHERE id = ?", (request['master_id'],))
-                if master:
-                    try:
-                        await bot.send_message(
-                            int(master['contact']),
-                            f"✅ Клиент подтвердил выполнение заказа #{request_id}.\n"
-                            f"Заказ завершён успешно! 🎉"
-                        )
-                    except Exception as e:
-                        logging.error(f"[MASTER_NOTIFY_ERROR] {e}")
-            else:
-                await c.message.edit_text("❌ Ошибка при завершении заказа")
+            sends = [safe_edit(c.message,
+                "✅ Спасибо за подтверждение!\n"
+                "Пожалуйста, оцените работу мастера 👇"
+            )]
+            
+            # Уведомляем мастера
+            if request['master_contact']:
+                sends.append(tg_send(
+                    int(request['master_contact']),
+                    f"✅ Клиент подтвердил выполнение заказа #{request_id}.\n"
+                    f"Заказ завершён успешно! 🎉"
+                ))
+            
+            await gather_logged(*sends, tag="MASTER_NOTIFY")
         
         elif answer == "no":
-            # Клиент жалуется
-            await c.message.edit_text(
-                "😔 Нам очень жаль, что возникли проблемы.\n\n"
-                "Администратор свяжется с вами для решения вопроса.\n"
-                "Вы также можете написать жалобу через главное меню.",
-                reply_markup=main_menu_kb(str(c.from_user.id))
-            )
-            
-            # Возвращаем статус "assigned"
-            db.execute("UPDATE requests SET status = 'assigned' WHERE id = ?", (request_id,))
+            # Возвращаем статус "assigned" и сразу получаем данные для уведомлений
+            rows = await db.aexecute_returning("""
+                UPDATE requests SET status = 'assigned'
+                WHERE id = ? AND status = 'pending_confirmation'
+                RETURNING name,
+                          (SELECT contact FROM masters WHERE id = requests.master_id) AS master_contact
+            """, (request_id,))
+            if not rows:
+                await answer_confirmation_missed(c, request_id)
+                return
+            request = rows[0]
             
-            # Уведомляем админа
-            await notify_admin(
-                f"⚠️ <b>Проблема с заказом #{request_id}</b>\n\n"
-                f"Клиент: {request['name']}\n"
-                f"Не подтвердил выполнение работ.\n\n"
-                f"Требуется разбирательство."
-            )
+            # Клиент жалуется; уведомляем админа
+            sends = [
+                safe_edit(c.message,
+                    "😔 Нам очень жаль, что возникли проблемы.\n\n"
+                    "Администратор свяжется с вами для решения вопроса.\n"
+                    "Вы также можете написать жалобу через главное меню.",
+                    reply_markup=await main_menu_kb(str(c.from_user.id))
+                ),
+                notify_admin(
+                    f"⚠️ <b>Проблема с заказом #{request_id}</b>\n\n"
+                    f"Клиент: {request['name']}\n"
+                    f"Не подтвердил выполнение работ.\n\n"
+                    f"Требуется разбирательство."
+                )
+            ]
             
             # Уведомляем мастера
-            master = db.fetch_one("SELECT contact FROM masters WHERE id = ?", (request['master_id'],))
-            if master:
-                try:
-                    await bot.send_message(
-                        int(master['contact']),
-                        f"⚠️ Клиент сообщил о проблемах с заказом #{request_id}.\n"
-                        f"Администратор свяжется с вами."
-                    )
-                except Exception as e:
-                    logging.error(f"[MASTER_NOTIFY_ERROR] {e}")
+            if request['master_contact']:
+                sends.append(tg_send(
+                    int(request['master_contact']),
+                    f"⚠️ Клиент сообщил о проблемах с заказом #{request_id}.\n"
+                    f"Администратор свяжется с вами."
+                ))
+            
+            await gather_logged(*sends, tag="MASTER_NOTIFY")
         
         await c.answer()
         
     except Exception as e:
-        logging.error(f"[CLIENT_CONFIRMATION_ERROR] {e}")
-        await c.answer("❌ Ошибка")
+        logging.error("[CLIENT_CONFIRMATION_ERROR] %s", e)
+        await c.answer(ERR_GENERIC)
+
+def delete_user_data_tx(user_id: str):
+    """Удалить все данные пользователя одной транзакцией (ошибки пробрасываются)"""
+    with db.transaction() as cur:
+        # Удаляем данные мастера
+        cur.execute("DELETE FROM masters WHERE contact = ?", (user_id,))
+        
+        # Удаляем заявки клиента (и по старому contact, и по новому client_user_id)
+        cur.execute("""
+            DELETE FROM requests 
+            WHERE contact = ? OR client_user_id = ?
+        """, (user_id, user_id))
+        
+        # Удаляем жалобы, где пользователь указан как отправитель или мастер
+        cur.execute("DELETE FROM complaints WHERE who = ? OR master_id = ?", (user_id, user_id))
 
 @dp.message(Command("delete_profile"))
 async def delete_profile(m: Message):
     user_id = str(m.from_user.id)
     
-    # Удаляем данные мастера
-    db.execute("DELETE FROM masters WHERE contact = ?", (user_id,))
-    
-    # Удаляем заявки клиента (и по старому contact, и по новому client_user_id)
-    db.execute("""
-        DELETE FROM requests 
-        WHERE contact = ? OR client_user_id = ?
-    """, (user_id, user_id))
-    
-    # Удаляем жалобы, где пользователь указан как отправитель или мастер
-    db.execute("DELETE FROM complaints WHERE who = ? OR master_id = ?", (user_id, user_id))
+    try:
+        await asyncio.to_thread(delete_user_data_tx, user_id)
+    except Exception as e:
+        logging.error("[DELETE_PROFILE_ERROR] %s", e)
+        await m.answer("❌ Ошибка при удалении данных. Попробуйте позже.")
+        return
+    finally:
+        invalidate_master(user_id)
     
     await m.answer(
         "✅ Ваши данные удалены из сервиса в соответствии с Политикой конфиденциальности.\n"
         "Если вы захотите вернуться — просто начните заново.",
-        reply_markup=main_menu_kb(str(m.from_user.id))
+        reply_markup=_main_menu_kb(False)  # анкета удалена — не мастер, без запроса в БД
     )
 
-@dp.message(Command("help"))
-async def cmd_help(m: Message):
-    """Помощь с использованием бота"""
-    user_id = str(m.from_user.id)
-    
-    # Проверяем является ли пользователь мастером
-    is_master = db.fetch_one("SELECT id FROM masters WHERE contact = ?", (user_id,))
-    
-    help_text = [
+@lru_cache(maxsize=4)
+def help_text(is_master: bool, is_admin: bool) -> str:
+    """Текст /help: всего четыре варианта, собираем каждый один раз"""
+    lines = [
         "❓ <b>ПОМОЩЬ</b>\n",
         "🤖 <b>Основные функции бота:</b>",
         "",
@@ -1270,7 +1608,7 @@ async def cmd_help(m: Message):
     
     # Команды для мастеров
     if is_master:
-        help_text.extend([
+        lines.extend([
             "",
             "👨‍🔧 <b>Команды для мастеров:</b>",
             "• /master — личный кабинет",
@@ -1280,8 +1618,8 @@ async def cmd_help(m: Message):
         ])
     
     # Команды для админа
-    if is_admin(m.from_user.id):
-        help_text.extend([
+    if is_admin:
+        lines.extend([
             "",
             "👑 <b>Команды администратора:</b>",
             "• /stats — статистика сервиса",
@@ -1290,7 +1628,7 @@ async def cmd_help(m: Message):
             "• /reviews <id> — отзывы на мастера"
         ])
     
-    help_text.extend([
+    lines.extend([
         "",
         "🔒 <b>Конфиденциальность:</b>",
         "• /delete_profile — удалить все данные",
@@ -1298,16 +1636,13 @@ async def cmd_help(m: Message):
         "💬 Если остались вопросы — /support"
     ])
 
-    # Клавиатура с быстрыми действиями
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="❔ Частые вопросы", callback_data="help:faq"),
-            InlineKeyboardButton(text="📞 Поддержка", callback_data="help:support")
-        ],
-        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="go:menu")]
-    ])
+    return "\n".join(lines)
 
-    await m.answer("\n".join(help_text), reply_markup=kb)
+@dp.message(Command("help"))
+async def cmd_help(m: Message, is_master: bool = False, is_admin: bool = False):
+    """Помощь с использованием бота"""
+    # Клавиатура с быстрыми действиями
+    await m.answer(help_text(is_master, is_admin), reply_markup=HELP_KB)
 
 @dp.message(Command("faq"))
 async def cmd_faq(m: Message):
@@ -1320,71 +1655,71 @@ async def callback_faq(c: CallbackQuery):
     await show_faq(c.message.chat.id)
     await c.answer()
 
+FAQ_TEXT = "\n".join([
+    "❔ <b>ЧАСТЫЕ ВОПРОСЫ</b>\n",
+    
+    "<b>🙋‍♂️ Для клиентов:</b>\n",
+    
+    "❓ <b>Как заказать услугу?</b>",
+    "• Нажмите «Оставить заявку»",
+    "• Заполните форму с описанием задачи",
+    "• Мы подберём 3-5 мастеров",
+    "• Мастер свяжется с вами напрямую",
+    "",
+    
+    "❓ <b>Сколько это стоит?</b>",
+    "• Подбор мастеров — БЕСПЛАТНО",
+    "• Цену обсуждаете напрямую с мастером",
+    "",
+    
+    "❓ <b>Как выбрать мастера?</b>",
+    "• Смотрите на рейтинг (⭐)",
+    "• Читайте отзывы других клиентов",
+    "• Все мастера проходят проверку",
+    "",
+    
+    "❓ <b>Что если работа выполнена плохо?</b>",
+    "• Не подтверждайте выполнение",
+    "• Нажмите «Есть проблемы»",
+    "• Администрация разберётся в ситуации",
+    "",
+    
+    "<b>👨‍🔧 Для мастеров:</b>\n",
+    
+    "❓ <b>Как стать мастером?</b>",
+    "• Нажмите «Стать мастером»",
+    "• Заполните анкету",
+    "• Пройдите проверку (по желанию)",
+    "",
+    
+    "❓ <b>Сколько стоит?</b>",
+    "• Первые 3 заказа — БЕСПЛАТНО",
+    "• Далее: 990 ₽/мес (безлимит заказов)",
+    "",
+    
+    "❓ <b>Как получать больше заказов?</b>",
+    "• Поддерживайте высокий рейтинг (4.5+)",
+    "• Быстро отвечайте на заявки",
+    "• Оформите приоритет (490 ₽/мес)",
+    "",
+    
+    "❓ <b>Что дают статусы?</b>",
+    "• 🟡 Кандидат — базовый уровень",
+    "• 🟢 Проверенный — прошли проверку документов",
+    "• 💎 Верифицированный — НПД/ИП подтверждён",
+    "",
+    
+    "💬 Не нашли ответ? — /support"
+])
+
+FAQ_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📞 Связаться с поддержкой", callback_data="help:support")],
+    [InlineKeyboardButton(text="🏠 Главное меню", callback_data="go:menu")]
+])
+
 async def show_faq(chat_id: int):
     """Показать FAQ"""
-    faq_text = [
-        "❔ <b>ЧАСТЫЕ ВОПРОСЫ</b>\n",
-        
-        "<b>🙋‍♂️ Для клиентов:</b>\n",
-        
-        "❓ <b>Как заказать услугу?</b>",
-        "• Нажмите «Оставить заявку»",
-        "• Заполните форму с описанием задачи",
-        "• Мы подберём 3-5 мастеров",
-        "• Мастер свяжется с вами напрямую",
-        "",
-        
-        "❓ <b>Сколько это стоит?</b>",
-        "• Подбор мастеров — БЕСПЛАТНО",
-        "• Цену обсуждаете напрямую с мастером",
-        "",
-        
-        "❓ <b>Как выбрать мастера?</b>",
-        "• Смотрите на рейтинг (⭐)",
-        "• Читайте отзывы других клиентов",
-        "• Все мастера проходят проверку",
-        "",
-        
-        "❓ <b>Что если работа выполнена плохо?</b>",
-        "• Не подтверждайте выполнение",
-        "• Нажмите «Есть проблемы»",
-        "• Администрация разберётся в ситуации",
-        "",
-        
-        "<b>👨‍🔧 Для мастеров:</b>\n",
-        
-        "❓ <b>Как стать мастером?</b>",
-        "• Нажмите «Стать мастером»",
-        "• Заполните анкету",
-        "• Пройдите проверку (по желанию)",
-        "",
-        
-        "❓ <b>Сколько стоит?</b>",
-        "• Первые 3 заказа — БЕСПЛАТНО",
-        "• Далее: 990 ₽/мес (безлимит заказов)",
-        "",
-        
-        "❓ <b>Как получать больше заказов?</b>",
-        "• Поддерживайте высокий рейтинг (4.5+)",
-        "• Быстро отвечайте на заявки",
-        "• Оформите приоритет (490 ₽/мес)",
-        "",
-        
-        "❓ <b>Что дают статусы?</b>",
-        "• 🟡 Кандидат — базовый уровень",
-        "• 🟢 Проверенный — прошли проверку документов",
-        "• 💎 Верифицированный — НПД/ИП подтверждён",
-        "",
-        
-        "💬 Не нашли ответ? — /support"
-    ]
-    
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📞 Связаться с поддержкой", callback_data="help:support")],
-        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="go:menu")]
-    ])
-    
-    await bot.send_message(chat_id, "\n".join(faq_text), reply_markup=kb)
+    await tg_send(chat_id, FAQ_TEXT, reply_markup=FAQ_KB)
 
 @dp.message(Command("support"))
 async def cmd_support(m: Message):
@@ -1397,35 +1732,35 @@ async def callback_support(c: CallbackQuery):
     await show_support(c.message.chat.id)
     await c.answer()
 
-async def show_support(chat_id: int):
-    """Показать контакты поддержки"""
-    support_text = [
-        "📞 <b>ПОДДЕРЖКА</b>\n",
-        "Мы всегда готовы помочь!\n",
-        
-        "<b>Способы связи:</b>",
-        "• 📱 Telegram: @am_burkov",
-        "• 📧 Email: aburkov2017@yandex.ru",
-        "• ⏰ Время работы: Пн-Пт 10:00-19:00",
-        "",
-        
-        "<b>📝 Или оставьте жалобу:</b>",
-        "Нажмите кнопку ниже, опишите проблему — мы свяжемся с вами в течение 24 часов.",
-        "",
-        
-        "💡 <b>Перед обращением:</b>",
-        "• Проверьте /faq — может ответ уже есть",
-        "• Укажите номер заказа (если есть)",
-        "• Опишите проблему подробно"
-    ]
+SUPPORT_TEXT = "\n".join([
+    "📞 <b>ПОДДЕРЖКА</b>\n",
+    "Мы всегда готовы помочь!\n",
     
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🚨 Оставить жалобу", callback_data="go:complaint")],
-        [InlineKeyboardButton(text="❔ Частые вопросы", callback_data="help:faq")],
-        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="go:menu")]
-    ])
+    "<b>Способы связи:</b>",
+    "• 📱 Telegram: @am_burkov",
+    "• 📧 Email: aburkov2017@yandex.ru",
+    "• ⏰ Время работы: Пн-Пт 10:00-19:00",
+    "",
     
-    await bot.send_message(chat_id, "\n".join(support_text), reply_markup=kb)
+    "<b>📝 Или оставьте жалобу:</b>",
+    "Нажмите кнопку ниже, опишите проблему — мы свяжемся с вами в течение 24 часов.",
+    "",
+    
+    "💡 <b>Перед обращением:</b>",
+    "• Проверьте /faq — может ответ уже есть",
+    "• Укажите номер заказа (если есть)",
+    "• Опишите проблему подробно"
+])
+
+SUPPORT_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🚨 Оставить жалобу", callback_data="go:complaint")],
+    [InlineKeyboardButton(text="❔ Частые вопросы", callback_data="help:faq")],
+    [InlineKeyboardButton(text="🏠 Главное меню", callback_data="go:menu")]
+])
+
+async def show_support(chat_id: int):
+    """Показать контакты поддержки"""
+    await tg_send(chat_id, SUPPORT_TEXT, reply_markup=SUPPORT_KB)
 
 @dp.callback_query(F.data == "master:cabinet")
 async def callback_master_cabinet(c: CallbackQuery):
@@ -1455,10 +1790,7 @@ async def cmd_master_cabinet(m: Message):
         await m.answer(
             "❌ Вы не зарегистрированы как мастер.\n"
             "Хотите зарегистрироваться?",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="👨‍🔧 Стать мастером", callback_data="go:master")],
-                [InlineKeyboardButton(text="🏠 Главное меню", callback_data="go:menu")]
-            ])
+            reply_markup=BECOME_MASTER_KB
         )
         return
 
@@ -1469,14 +1801,23 @@ async def cmd_limits(m: Message):
     """Показать текущие лимиты пользователя"""
     user_id = m.from_user.id
     
+    left = await limits_snapshot(user_id, [
+        ("start_command", 10, 3600),
+        ("new_request", 3, 3600),
+        ("master_registration", 3, 86400),
+        ("complaint", 5, 86400),
+        ("offer_actions", 10, 3600),
+        ("any_message", 20, 60),
+    ])
+    
     limits_info = [
         "📊 <b>Ваши текущие лимиты:</b>\n",
-        f"🚀 Запуски бота: {rate_limiter.get_remaining(user_id, 'start_command', 10, 3600)}/10 (в час)",
-        f"📝 Новые заявки: {rate_limiter.get_remaining(user_id, 'new_request', 3, 3600)}/3 (в час)",
-        f"👨‍🔧 Регистрация мастера: {rate_limiter.get_remaining(user_id, 'master_registration', 1, 86400)}/1 (в сутки)",
-        f"🚨 Жалобы: {rate_limiter.get_remaining(user_id, 'complaint', 5, 86400)}/5 (в сутки)",
-        f"⚡ Действия с заказами: {rate_limiter.get_remaining(user_id, 'offer_actions', 10, 3600)}/10 (в час)",
-        f"💬 Сообщения: {rate_limiter.get_remaining(user_id, 'any_message', 20, 60)}/20 (в минуту)",
+        f"🚀 Запуски бота: {left['start_command']}/10 (в час)",
+        f"📝 Новые заявки: {left['new_request']}/3 (в час)",
+        f"👨‍🔧 Регистрация мастера: {left['master_registration']}/3 (в сутки)",
+        f"🚨 Жалобы: {left['complaint']}/5 (в сутки)",
+        f"⚡ Действия с заказами: {left['offer_actions']}/10 (в час)",
+        f"💬 Сообщения: {left['any_message']}/20 (в минуту)",
         "",
         "💡 <i>Лимиты сбрасываются автоматически</i>"
     ]
@@ -1484,9 +1825,9 @@ async def cmd_limits(m: Message):
     await m.answer("\n".join(limits_info))
 
 @dp.message(Command("cleanup_now"))
-async def cmd_cleanup_now(m: Message):
+async def cmd_cleanup_now(m: Message, is_admin: bool = False):
     """Принудительная очистка документов (только для админа)"""
-    if not is_admin(m.from_user.id):
+    if not is_admin:
         await m.answer("❌ Эта команда доступна только администратору")
         return
     
@@ -1494,14 +1835,15 @@ async def cmd_cleanup_now(m: Message):
     
     try:
         # Проверяем сколько документов будет очищено
-        pending_count = db.fetch_one("""
+        row = await db.afetch_one("""
             SELECT COUNT(*) as count 
             FROM masters 
             WHERE created_at < datetime('now', '-72 hours')
               AND (passport_scan_file_id IS NOT NULL 
                    OR face_photo_file_id IS NOT NULL 
                    OR npd_ip_doc_file_id IS NOT NULL)
-        """)['count']
+        """)
+        pending_count = row['count'] if row else 0
         
         if pending_count == 0:
             await m.answer("✅ Нет документов для очистки (все моложе 72 часов)")
@@ -1515,19 +1857,19 @@ async def cmd_cleanup_now(m: Message):
         await m.answer("✅ Принудительная очистка завершена")
         
     except Exception as e:
-        logging.error(f"[MANUAL_CLEANUP_ERROR] {e}")
+        logging.error("[MANUAL_CLEANUP_ERROR] %s", e)
         await m.answer(f"❌ Ошибка при очистке: {str(e)[:500]}")
 
 @dp.message(Command("cleanup_status"))
-async def cmd_cleanup_status(m: Message):
+async def cmd_cleanup_status(m: Message, is_admin: bool = False):
     """Показать статус документов для очистки (только для админа)"""
-    if not is_admin(m.from_user.id):
+    if not is_admin:
         await m.answer("❌ Эта команда доступна только администратору")
         return
     
     try:
         # Статистика по документам
-        stats = db.fetch_one("""
+        stats = await db.afetch_one("""
             SELECT 
                 COUNT(*) as total_masters,
                 COUNT(CASE WHEN passport_scan_file_id IS NOT NULL THEN 1 END) as with_passport,
@@ -1541,8 +1883,9 @@ async def cmd_cleanup_status(m: Message):
         """)
         
         # Детали по мастерам с документами старше 72 часов
-        pending_masters = db.fetch_all("""
-            SELECT id, fio, level, datetime(created_at) as created_time
+        pending_masters = await db.afetch_all("""
+            SELECT id, fio, level,
+                   CAST(julianday('now') - julianday(created_at) AS INTEGER) AS days_ago
             FROM masters 
             WHERE created_at < datetime('now', '-72 hours')
               AND (passport_scan_file_id IS NOT NULL 
@@ -1566,10 +1909,9 @@ async def cmd_cleanup_status(m: Message):
         
         if pending_masters:
             for master in pending_masters:
-                time_ago = (datetime.now() - datetime.fromisoformat(master['created_time'])).days
                 report_lines.append(
                     f"#{master['id']} {master['fio'] or 'Неизвестно'} "
-                    f"({master['level']}) - {time_ago} дн. назад"
+                    f"({master['level']}) - {master['days_ago']} дн. назад"
                 )
         else:
             report_lines.append("✅ Нет документов для очистки")
@@ -1583,7 +1925,7 @@ async def cmd_cleanup_status(m: Message):
         await m.answer("\n".join(report_lines))
         
     except Exception as e:
-        logging.error(f"[CLEANUP_STATUS_ERROR] {e}")
+        logging.error("[CLEANUP_STATUS_ERROR] %s", e)
         await m.answer(f"❌ Ошибка получения статуса: {str(e)[:500]}")
 
 @dp.message(Command("my_reviews"))
@@ -1638,88 +1980,99 @@ async def cmd_my_stats(m: Message):
 
     await m.answer(data["text"])
 
+# Статусы заявки для клиента
+CLIENT_STATUS_EMOJI = {
+    'new': '🆕',
+    'assigned': '👨‍🔧',
+    'pending_confirmation': '⏳'
+}
+CLIENT_STATUS_TEXT = {
+    'new': 'Ищем мастера',
+    'assigned': 'Мастер работает',
+    'pending_confirmation': 'Ждём подтверждения'
+}
+
 @dp.message(Command("my_requests"))
 async def cmd_my_requests(m: Message):
     """Мои заявки (для клиентов)"""
     user_id = str(m.from_user.id)
     
     try:
-        # Получаем заявки клиента
-        requests = db.fetch_all("""
-            SELECT id, category, district, status, created_at, master_id
-            FROM requests 
+        # Количества по группам (для заголовков и "... и ещё N")
+        totals = await db.afetch_one("""
+            SELECT COUNT(*) AS total,
+                   COALESCE(SUM(status IN ('new', 'assigned', 'pending_confirmation')), 0) AS active,
+                   COALESCE(SUM(status = 'completed'), 0) AS completed
+            FROM requests
             WHERE client_user_id = ?
-            ORDER BY created_at DESC
-            LIMIT 20
         """, (user_id,))
         
-        if not requests:
+        if not totals or not totals['total']:
             await m.answer(
                 "📝 У вас пока нет заявок.\n\n"
                 "Хотите оставить заявку?",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="📝 Оставить заявку", callback_data="go:req")],
-                    [InlineKeyboardButton(text="🏠 Главное меню", callback_data="go:menu")]
-                ])
+                reply_markup=NO_REQUESTS_KB
             )
             return
         
-        # Группируем по статусам
-        active = [r for r in requests if r['status'] in ('new', 'assigned', 'pending_confirmation')]
-        completed = [r for r in requests if r['status'] == 'completed']
+        # По 5 последних активных и завершённых заявок одним запросом
+        rows = await db.afetch_all("""
+            SELECT * FROM (
+                SELECT 'active' AS kind, id, category, district, status,
+                       strftime('%d.%m.%Y', created_at) AS created_date
+                FROM requests
+                WHERE client_user_id = :uid AND status IN ('new', 'assigned', 'pending_confirmation')
+                ORDER BY created_at DESC
+                LIMIT 5
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT 'completed', id, category, district, status,
+                       strftime('%d.%m.%Y', created_at)
+                FROM requests
+                WHERE client_user_id = :uid AND status = 'completed'
+                ORDER BY created_at DESC
+                LIMIT 5
+            )
+        """, {"uid": user_id})
+        
+        active, completed = [], []
+        by_kind = {"active": active, "completed": completed}
+        for row in rows:
+            by_kind[row['kind']].append(row)
         
         text_lines = ["📝 <b>Мои заявки</b>\n"]
         
         # Активные
         if active:
-            text_lines.append(f"🟢 <b>АКТИВНЫЕ ({len(active)}):</b>")
-            for req in active[:5]:
-                date = datetime.fromisoformat(req['created_at']).strftime('%d.%m.%Y')
-                
-                status_emoji = {
-                    'new': '🆕',
-                    'assigned': '👨‍🔧',
-                    'pending_confirmation': '⏳'
-                }
-                
-                status_text = {
-                    'new': 'Ищем мастера',
-                    'assigned': 'Мастер работает',
-                    'pending_confirmation': 'Ждём подтверждения'
-                }
-                
-                emoji = status_emoji.get(req['status'], '❓')
-                status = status_text.get(req['status'], req['status'])
-                
-                text_lines.append(
-                    f"  {emoji} #{req['id']} | {req['category']} | {date}\n"
-                    f"  📍 {req['district']}\n"
-                    f"  📊 Статус: {status}"
-                )
+            text_lines.append(f"🟢 <b>АКТИВНЫЕ ({totals['active']}):</b>")
+            text_lines.extend(
+                f"  {CLIENT_STATUS_EMOJI.get(req['status'], '❓')} #{req['id']} | {req['category']} | "
+                f"{req['created_date'] or '—'}\n"
+                f"  📍 {req['district']}\n"
+                f"  📊 Статус: {CLIENT_STATUS_TEXT.get(req['status'], req['status'])}"
+                for req in active
+            )
             
-            if len(active) > 5:
-                text_lines.append(f"  ... и ещё {len(active) - 5} активных")
+            if totals['active'] > len(active):
+                text_lines.append(f"  ... и ещё {totals['active'] - len(active)} активных")
             text_lines.append("")
         
         # Завершённые
         if completed:
-            text_lines.append(f"✅ <b>ЗАВЕРШЁННЫЕ ({len(completed)}):</b>")
-            for req in completed[:5]:
-                date = datetime.fromisoformat(req['created_at']).strftime('%d.%m.%Y')
-                text_lines.append(f"  ✅ #{req['id']} | {req['category']} | {date}")
+            text_lines.append(f"✅ <b>ЗАВЕРШЁННЫЕ ({totals['completed']}):</b>")
+            text_lines.extend(
+                f"  ✅ #{req['id']} | {req['category']} | {req['created_date'] or '—'}"
+                for req in completed
+            )
             
-            if len(completed) > 5:
-                text_lines.append(f"  ... и ещё {len(completed) - 5} завершённых")
-        
-        kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="📝 Новая заявка", callback_data="go:req")],
-            [InlineKeyboardButton(text="🏠 Главное меню", callback_data="go:menu")]
-        ])
+            if totals['completed'] > len(completed):
+                text_lines.append(f"  ... и ещё {totals['completed'] - len(completed)} завершённых")
         
-        await m.answer("\n".join(text_lines), reply_markup=kb)
+        await m.answer("\n".join(text_lines), reply_markup=MY_REQUESTS_KB)
         
     except Exception as e:
-        logging.error(f"[MY_REQUESTS_ERROR] {e}")
+        logging.error("[MY_REQUESTS_ERROR] %s", e)
         await m.answer("❌ Ошибка при получении заявок")
 
 @dp.callback_query(F.data == "master:stats")
@@ -1776,9 +2129,9 @@ async def callback_master_orders(c: CallbackQuery):
     await c.answer()
 
 @dp.message(Command("reviews"))
-async def cmd_reviews(m: Message):
+async def cmd_reviews(m: Message, is_admin: bool = False):
     """Показать отзывы на мастера по ID (для админа)"""
-    if not is_admin(m.from_user.id):
+    if not is_admin:
         await m.answer("❌ Эта команда доступна только администратору")
         return
     
@@ -1792,14 +2145,15 @@ async def cmd_reviews(m: Message):
         master_id = int(args[1])
         
         # Получаем информацию о мастере
-        master = db.fetch_one("SELECT fio FROM masters WHERE id = ?", (master_id,))
+        master = await db.afetch_one("SELECT fio FROM masters WHERE id = ?", (master_id,))
         if not master:
             await m.answer("❌ Мастер не найден")
             return
         
         # Получаем отзывы
-        reviews = db.fetch_all("""
-            SELECT r.rating, r.comment, r.created_at, req.id as request_id
+        reviews = await db.afetch_all("""
+            SELECT r.rating, substr(r.comment, 1, 101) AS comment,
+                   strftime('%d.%m.%Y', r.created_at) AS created_date, req.id as request_id
             FROM reviews r
             JOIN requests req ON r.request_id = req.id
             WHERE r.master_id = ?
@@ -1811,44 +2165,52 @@ async def cmd_reviews(m: Message):
             await m.answer(f"📝 У мастера #{master_id} пока нет отзывов")
             return
         
-        review_lines = [f"⭐ <b>Отзывы на {master['fio']} (#{master_id})</b>\n"]
-        
-        for i, review in enumerate(reviews, 1):
-            stars = get_rating_stars(review['rating'])
-            date = datetime.fromisoformat(review['created_at']).strftime('%d.%m.%Y')
-            
-            review_lines.append(f"\n{i}. {stars} <i>({date})</i> - Заявка #{review['request_id']}")
-            if review['comment']:
-                review_lines.append(f"   💬 {review['comment'][:100]}{'...' if len(review['comment']) > 100 else ''}")
-        
-        await m.answer("\n".join(review_lines))
+        # Заголовок и по блоку на отзыв собираются одним join без промежуточного списка
+        await m.answer(f"⭐ <b>Отзывы на {master['fio']} (#{master_id})</b>\n" + "".join(
+            f"\n\n{i}. {get_rating_stars(review['rating'])} <i>({review['created_date'] or '—'})</i>"
+            f" - Заявка #{review['request_id']}"
+            + (f"\n   💬 {truncate(review['comment'], 100)}" if review['comment'] else "")
+            for i, review in enumerate(reviews, 1)
+        ))
         
     except Exception as e:
-        logging.error(f"[REVIEWS_ERROR] {e}")
+        logging.error("[REVIEWS_ERROR] %s", e)
         await m.answer("❌ Ошибка при получении отзывов")
 
 @dp.message(Command("stats"))
-async def cmd_stats(m: Message):
+async def cmd_stats(m: Message, is_admin: bool = False):
     """Статистика сервиса (только для админа)"""
-    if not is_admin(m.from_user.id):
+    if not is_admin:
         await m.answer("❌ Доступно только администратору")
         return
     
     try:
-        stats = db.fetch_one("""
-            SELECT 
-                (SELECT COUNT(*) FROM masters) as total_masters,
-                (SELECT COUNT(*) FROM masters WHERE level = 'Верифицированный') as verified_masters,
-                (SELECT COUNT(*) FROM masters WHERE level = 'Проверенный') as checked_masters,
-                (SELECT COUNT(*) FROM masters WHERE level = 'Кандидат') as candidate_masters,
-                (SELECT COUNT(*) FROM requests) as total_requests,
-                (SELECT COUNT(*) FROM requests WHERE status = 'completed') as completed_requests,
-                (SELECT COUNT(*) FROM requests WHERE status = 'new') as new_requests,
-                (SELECT COUNT(*) FROM reviews) as total_reviews,
-                (SELECT COUNT(*) FROM masters WHERE sub_until > datetime('now')) as active_subscriptions
-        """)
+        text = stats_cache.get("stats")
+        if text is not None:
+            await m.answer(text)
+            return
         
-        await m.answer(f"""
+        # Один проход по каждой таблице: условные суммы вместо отдельных COUNT(*)
+        stats = await db.afetch_one("""
+            SELECT m.*, r.*, rv.*
+            FROM (
+                SELECT COUNT(*) AS total_masters,
+                       COALESCE(SUM(level = 'Верифицированный'), 0) AS verified_masters,
+                       COALESCE(SUM(level = 'Проверенный'), 0) AS checked_masters,
+                       COALESCE(SUM(level = 'Кандидат'), 0) AS candidate_masters,
+                       COALESCE(SUM(sub_until > :now), 0) AS active_subscriptions
+                FROM masters
+            ) m, (
+                SELECT COUNT(*) AS total_requests,
+                       COALESCE(SUM(status = 'completed'), 0) AS completed_requests,
+                       COALESCE(SUM(status = 'new'), 0) AS new_requests
+                FROM requests
+            ) r, (
+                SELECT COUNT(*) AS total_reviews FROM reviews
+            ) rv
+        """, {"now": now_ts()})
+        
+        text = f"""
 📊 <b>Статистика сервиса</b>
 
 👨‍🔧 <b>Мастера:</b>
@@ -1865,32 +2227,23 @@ async def cmd_stats(m: Message):
 
 ⭐ <b>Отзывы:</b>
 • Всего: {stats['total_reviews']}
-        """)
+        """
+        stats_cache.set("stats", text)
+        await m.answer(text)
         
     except Exception as e:
-        logging.error(f"[STATS_ERROR] {e}")
+        logging.error("[STATS_ERROR] %s", e)
         await m.answer("❌ Ошибка получения статистики")
 
 # ----------------- REQUEST FLOW --------
+INSERT_REQUEST_SQL = (
+    "INSERT INTO requests(name,contact,category,district,description,when_text,status,client_user_id) "
+    "VALUES(?,?,?,?,?,?,?,?)"
+)
+
 @dp.message(Req.name)
 async def req_name(m: Message, state: FSMContext):
-    user_id = m.from_user.id
-    
-    # Лимит: 3 новые заявки в час
-    if not rate_limiter.check_limit(user_id, "new_request", 3, 3600):
-        remaining = rate_limiter.get_remaining(user_id, "new_request", 3, 3600)
-        remaining_time = rate_limiter.get_time_until_reset(user_id, "new_request", 3600)
-        
-        if remaining_time > 0:
-            minutes = (remaining_time % 3600) // 60
-            await m.answer(
-                f"❌ Лимит заявок исчерпан. Доступно через: {minutes} минут.\n"
-                f"💡 Можно создать: {remaining} заявок после сброса лимита"
-            )
-        else:
-            await m.answer(f"❌ Лимит заявок исчерпан. Можно создать: {remaining} заявок")
-        return
-    
+    # Лимит "new_request" уже учтен при входе в форму (go:req) — второй раз не списываем
     await state.update_data(name=m.text.strip())
     await m.answer("Оставьте контакт для связи (телефон или @username):", reply_markup=share_phone_kb())
     await state.set_state(Req.contact)
@@ -1918,8 +2271,8 @@ async def req_contact_text(m: Message, state: FSMContext):
 
 @dp.callback_query(Req.category, F.data.startswith("cat:"))
 async def req_category(c: CallbackQuery, state: FSMContext):
-    code = c.data.split(":")[1]
-    title = next((t for t, cc in CATS if cc == code), code)
+    code = c.data.partition(":")[2]
+    title = CATS_BY_CODE.get(code, code)
     await state.update_data(category=title)
     await c.message.answer(
         "📍 Укажите адрес выполнения работ:\n"
@@ -1952,8 +2305,8 @@ async def req_desc(m: Message, state: FSMContext):
 
 @dp.message(Req.when)
 async def req_when(m: Message, state: FSMContext):
-    await state.update_data(when_text=m.text.strip())
-    d = await state.get_data()
+    # update_data возвращает обновленные данные — отдельный get_data не нужен
+    d = await state.update_data(when_text=m.text.strip())
     preview = (
         "<b>Проверьте заявку:</b>\n"
         f"👤 {d['name']}\n"
@@ -1964,11 +2317,7 @@ async def req_when(m: Message, state: FSMContext):
         f"🗓 {d['when_text']}\n\n"
         "Отправить?"
     )
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Отправить", callback_data="req:submit"),
-         InlineKeyboardButton(text="✏️ Исправить", callback_data="go:req")]
-    ])
-    await m.answer(preview, reply_markup=kb)
+    await m.answer(preview, reply_markup=PREVIEW_SUBMIT_KB)
     await state.set_state(Req.preview)
 
 @dp.callback_query(Req.preview, F.data=="req:submit")
@@ -1976,54 +2325,57 @@ async def req_submit(c: CallbackQuery, state: FSMContext):
     d = await state.get_data()
     client_user_id = str(c.from_user.id)
     
-    result = db.execute(
-        "INSERT INTO requests(name,contact,category,district,description,when_text,status,client_user_id) "
-        "VALUES(?,?,?,?,?,?,?,?)",
-        (d["name"], d["contact"], d["category"], d["district"], d["description"], d["when_text"], "new", client_user_id)
-    )
-    rid = result.lastrowid if result else None
-    db.commit()
-
-    # уведомление админу
-    await notify_admin(
-        f"🆕 <b>Заявка #{rid}</b>\n"
-        f"👤 {d['name']} | {d['contact']}\n"
-        f"📂 {d['category']}\n"
-        f"📍 Адрес: {d['district']}\n"
-        f"📝 {d['description']}\n"
-        f"🗓 {d['when_text']}"
+    # Заявка, подбор мастеров и их офферы — одна транзакция
+    try:
+        rid, masters = await asyncio.to_thread(
+            create_request_tx,
+            (d["name"], d["contact"], d["category"], d["district"], d["description"], d["when_text"], "new", client_user_id),
+            d["category"]
+        )
+    except Exception as e:
+        logging.error("[REQ_SUBMIT_ERROR] %s", e)
+        await c.answer(ERR_GENERIC)
+        return
+    invalidate_stats()
+
+    # уведомление админу и рассылка мастерам независимы — выполняем параллельно
+    await gather_logged(
+        notify_admin(
+            f"🆕 <b>Заявка #{rid}</b>\n"
+            f"👤 {d['name']} | {d['contact']}\n"
+            f"📂 {d['category']}\n"
+            f"📍 Адрес: {d['district']}\n"
+            f"📝 {d['description']}\n"
+            f"🗓 {d['when_text']}"
+        ),
+        send_to_masters(rid, d["category"], d["district"], d["description"], d["when_text"], masters),
+        tag="REQ_SUBMIT"
     )
 
-    # рассылка мастерам
-    await send_to_masters(rid, d["category"], d["district"])
-
-    await c.message.edit_text(
+    await safe_edit(c.message,
         "✅ Заявка отправлена. Мы подберём 1–3 мастеров и свяжемся с вами.", 
-        reply_markup=main_menu_kb(str(c.from_user.id))
+        reply_markup=await main_menu_kb(str(c.from_user.id))
     )
     await state.clear()
     await c.answer()
 
 # ----------------- ANKETA MASTER -------
-@dp.callback_query(F.data=="go:master")
-async def go_master(c: CallbackQuery, state: FSMContext):
-    user_id = c.from_user.id
-    
-    # Лимит: 3 попытки регистрации мастера за 24 часа
-    if not rate_limiter.check_limit(user_id, "master_registration", 3, 86400):
-        remaining_time = rate_limiter.get_time_until_reset(user_id, "master_registration", 86400)
-        hours = remaining_time // 10800
-        
-        await c.answer(
-            f"❌ Регистрация мастера возможна 3 раза в сутки. Попробуйте через {hours} часов.",
-            show_alert=True
-        )
-        return
-    
-    await state.clear()
-    await c.message.answer("Анкета мастера. Укажите ваши ФИО:")
-    await state.set_state(MasterForm.fio)
-    await c.answer()
+# Анкета без документов (Кандидат)
+INSERT_MASTER_SQL = """
+    INSERT INTO masters(fio,contact,phone,exp_bucket,exp_text,portfolio,`references`,
+                        level,verified,has_npd_ip,categories_auto,orders_completed,skill_tier,
+                        free_orders_left,is_active)
+    VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,1)
+"""
+# Анкета с паспортом и фото (Проверенный)
+INSERT_VERIFIED_MASTER_SQL = """
+    INSERT INTO masters(fio, contact, phone, exp_bucket, exp_text, portfolio, `references`,
+                        level, verified, has_npd_ip, passport_scan_file_id, face_photo_file_id,
+                        categories_auto, orders_completed, skill_tier, free_orders_left, is_active)
+    VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,1)
+"""
+
+MASTER_SAVE_FAILED_TEXT = "❌ Не удалось сохранить анкету. Попробуйте ещё раз чуть позже."
 
 async def cancel_master_registration(m: Message, state: FSMContext):
     """Универсальная отмена регистрации мастера"""
@@ -2033,7 +2385,7 @@ async def cancel_master_registration(m: Message, state: FSMContext):
         "Вы можете начать заново в любое время.",
         reply_markup=ReplyKeyboardRemove()
     )
-    await m.answer("Главное меню:", reply_markup=main_menu_kb(str(m.from_user.id)))
+    await m.answer("Главное меню:", reply_markup=await main_menu_kb(str(m.from_user.id)))
 
 @dp.message(MasterForm.fio)
 async def mf_fio(m: Message, state: FSMContext):
@@ -2044,30 +2396,28 @@ async def mf_fio(m: Message, state: FSMContext):
     await state.update_data(fio=m.text.strip(), uid=str(m.from_user.id))
     await m.answer(
         "Оставьте номер телефона (кнопкой ниже):",
-        reply_markup=ReplyKeyboardMarkup(
-            keyboard=[
-                [KeyboardButton(text="📱 Отправить номер", request_contact=True)],
-                [KeyboardButton(text="❌ Отмена")]
-            ],
-            resize_keyboard=True, 
-            one_time_keyboard=True
-        )
+        reply_markup=SHARE_PHONE_CANCEL_KB
     )
     await state.set_state(MasterForm.phone)
 
+# (первая цифра, длина) -> сколько цифр отрезать перед добавлением +7
+PHONE_PREFIX_CUT = {
+    ("7", 11): 1,  # +7XXXXXXXXXX → уже норм
+    ("8", 11): 1,  # 8XXXXXXXXXX → конвертируем
+    ("9", 10): 0,  # 9XXXXXXXXX → добавим +7
+}
+
 def normalize_phone(raw: str) -> str | None:
     """
     Приводим номер к формату +7XXXXXXXXXX
     Принимаем только валидные российские номера: +7 9... или 8 9...
     """
-    digits = re.sub(r"\D", "", raw)  # убираем всё, кроме цифр
-    if digits.startswith("7") and len(digits) == 11:  # +7XXXXXXXXXX → уже норм
-        return "+7" + digits[1:]
-    elif digits.startswith("8") and len(digits) == 11:  # 8XXXXXXXXXX → конвертируем
-        return "+7" + digits[1:]
-    elif digits.startswith("9") and len(digits) == 10:  # 9XXXXXXXXX → добавим +7
-        return "+7" + digits
-    return None
+    # Убираем всё, кроме цифр: один проход filter на C, без regex (то же множество, что \d)
+    digits = "".join(filter(str.isdecimal, raw))
+    cut = PHONE_PREFIX_CUT.get((digits[:1], len(digits)))
+    if cut is None:
+        return None
+    return "+7" + digits[cut:]
 
 @dp.message(MasterForm.phone, F.contact)
 async def mf_phone_contact(m: Message, state: FSMContext):
@@ -2146,7 +2496,7 @@ async def mcat_done(c: CallbackQuery, state: FSMContext):
     # сохраняем выбранное в categories_auto (строкой вида "Ремонт, Уборка")
     cats_str = ", ".join(sel)
     await state.update_data(categories_auto=cats_str)
-    await c.message.edit_text(
+    await safe_edit(c.message,
         f"Категории: {cats_str}\nТеперь укажите ваш опыт по годам:",
         reply_markup=exp_bucket_kb()
     )
@@ -2155,9 +2505,8 @@ async def mcat_done(c: CallbackQuery, state: FSMContext):
 
 @dp.callback_query(MasterForm.exp_bucket, F.data.startswith("exp:"))
 async def mf_exp_bucket(c: CallbackQuery, state: FSMContext):
-    bucket = c.data.split(":")[1]
-    mapping = {"<=1":"до 1 года","1-3":"1–3 года","3-5":"3–5 лет","5-10":"5–10 лет",">10":"более 10 лет"}
-    await state.update_data(exp_bucket=mapping.get(bucket, bucket))
+    bucket = c.data.partition(":")[2]
+    await state.update_data(exp_bucket=EXP_BUCKET_LABELS.get(bucket, bucket))
     await c.message.answer("Опишите кратко опыт и навыки (1–3 предложения):")
     await state.set_state(MasterForm.exp_text)
     await c.answer()
@@ -2171,11 +2520,7 @@ async def mf_exp_text(m: Message, state: FSMContext):
     await state.update_data(exp_text=m.text.strip())
     await m.answer(
         "Портфолио: пришлите фото/ссылки на ваши работы или напишите «нет»:",
-        reply_markup=ReplyKeyboardMarkup(
-            keyboard=[[KeyboardButton(text="❌ Отмена")]],
-            resize_keyboard=True,
-            one_time_keyboard=False
-        )
+        reply_markup=CANCEL_TEXT_KB
     )
     await state.set_state(MasterForm.portfolio)
 
@@ -2190,11 +2535,7 @@ async def mf_portfolio_photo(m: Message, state: FSMContext):
 
     await m.answer(
         "Укажите контакты 2–3 клиентов для рекомендаций (или напишите «нет»):",
-        reply_markup=ReplyKeyboardMarkup(
-            keyboard=[[KeyboardButton(text="❌ Отмена")]],
-            resize_keyboard=True,
-            one_time_keyboard=False
-        )
+        reply_markup=CANCEL_TEXT_KB
     )
     await state.set_state(MasterForm.references)
 
@@ -2208,11 +2549,7 @@ async def mf_portfolio(m: Message, state: FSMContext):
 
     await m.answer(
         "Укажите контакты 2–3 клиентов для рекомендаций (или напишите «нет»):",
-        reply_markup=ReplyKeyboardMarkup(
-            keyboard=[[KeyboardButton(text="❌ Отмена")]],
-            resize_keyboard=True,
-            one_time_keyboard=False
-        )
+        reply_markup=CANCEL_TEXT_KB
     )
     await state.set_state(MasterForm.references)
 
@@ -2222,26 +2559,17 @@ async def mf_references(m: Message, state: FSMContext):
         await cancel_master_registration(m, state)
         return
 
-    await state.update_data(references=m.text.strip())
-
-    d = await state.get_data()
+    # Ответ и базовый статус сохраняем одной записью в хранилище FSM
+    d = await state.update_data(references=m.text.strip(), level="Кандидат", verified=0, has_npd_ip=0)
     # НЕ авто-категоризируем — оставляем выбранные пользователем
     cats_selected = d.get("categories_auto", "")  # сюда мы сохранили строку "Ремонт, Уборка" в mcat_done
-    await state.update_data(categories_auto=cats_selected)
-
-    # Присваиваем базовый статус
-    await state.update_data(level="Кандидат", verified=0, has_npd_ip=0)
 
     # Предложение пройти проверку
-    kb = InlineKeyboardMarkup(inline_keyboard=[[
-        InlineKeyboardButton(text="Да, пройти проверку", callback_data="mf:verify:yes"),
-        InlineKeyboardButton(text="Нет, оставить Кандидатом", callback_data="mf:verify:no")
-    ]])
     await m.answer(
         f"Категория/Категории: {cats_selected or '—'}\n"
         "Сейчас ваш статус: <b>Кандидат</b>.\n"
         "Хотите пройти дополнительную проверку документов и получить статус <b>Проверенный</b>?",
-        reply_markup=kb
+        reply_markup=VERIFY_OFFER_KB
     )
     await state.set_state(MasterForm.verify_offer)
 
@@ -2250,27 +2578,33 @@ async def mf_verify_no(c: CallbackQuery, state: FSMContext):
     d = await state.get_data()
     cats_auto = d.get("categories_auto","")
     skill_tier = "Новичок"  # 0 выполненных заказов
-    result = db.execute("""
-        INSERT INTO masters(fio,contact,phone,exp_bucket,exp_text,portfolio,`references`,
-                            level,verified,has_npd_ip,categories_auto,orders_completed,skill_tier,
-                            free_orders_left,is_active)
-        VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,1)
-    """, (d["fio"], d["uid"], d.get("phone",""), d.get("exp_bucket",""), d.get("exp_text",""),
-            d.get("portfolio",""), d.get("references",""), "Кандидат", 0, 0, cats_auto, 0, skill_tier, FREE_ORDERS_START))
-    mid = result.lastrowid if result else None
-    db.commit()
-
-    await notify_admin(admin_master_card(mid))
-
-    await c.message.edit_text(
-        "✅ Анкета сохранена. Статус: Кандидат.", 
-        reply_markup=main_menu_kb(str(c.from_user.id))
-    )
-    
-    # ✅ УБИРАЕМ REPLY-КЛАВИАТУРУ:
-    await c.message.answer(
-        "🎉 Поздравляем! Теперь вы можете получать заказы!",
-        reply_markup=ReplyKeyboardRemove()
+    result = await db.aexecute(INSERT_MASTER_SQL, (
+        d["fio"], d["uid"], d.get("phone",""), d.get("exp_bucket",""), d.get("exp_text",""),
+        d.get("portfolio",""), d.get("references",""), "Кандидат", 0, 0, cats_auto, 0, skill_tier, FREE_ORDERS_START
+    ))
+    if not result:
+        # Анкета не сохранена: состояние не сбрасываем, кнопку можно нажать ещё раз
+        await c.answer(MASTER_SAVE_FAILED_TEXT, show_alert=True)
+        return
+    mid = result.lastrowid
+    invalidate_master(d["uid"])  # пользователь стал мастером
+
+    # Правка сообщения (inline-меню) и новое сообщение, убирающее reply-клавиатуру,
+    # в одно не объединить — отправляем их и уведомление админу параллельно
+    await gather_logged(
+        notify_admin(format_master_card(
+            mid, d["fio"], d["uid"], d.get("phone",""), "Кандидат", 0, 0, cats_auto,
+            d.get("exp_bucket",""), d.get("exp_text",""), d.get("portfolio",""), None
+        )),
+        safe_edit(c.message,
+            "✅ Анкета сохранена. Статус: Кандидат.", 
+            reply_markup=_main_menu_kb(True)  # только что зарегистрирован
+        ),
+        c.message.answer(
+            "🎉 Поздравляем! Теперь вы можете получать заказы!",
+            reply_markup=ReplyKeyboardRemove()
+        ),
+        tag="MASTER_REGISTERED"
     )
     
     await state.clear()
@@ -2297,16 +2631,13 @@ async def mf_verify_yes(c: CallbackQuery, state: FSMContext):
         "• Предоставляю данные добровольно;\n"
         "• Понимаю условия временного предоставления документов.\n\n"
     )
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Я согласен", callback_data="consent:given")]
-    ])
-    await c.message.edit_text(statement, reply_markup=kb, disable_web_page_preview=True)
+    await safe_edit(c.message, statement, reply_markup=CONSENT_KB, disable_web_page_preview=True)
     await state.set_state(MasterForm.consent)
     await c.answer()
 
 @dp.callback_query(MasterForm.consent, F.data == "consent:given")
 async def consent_given(c: CallbackQuery, state: FSMContext):
-    await c.message.edit_text(
+    await safe_edit(c.message,
         "Отлично! Теперь введите паспортные данные в одной строке:\n"
         "«серия и номер; кем выдан; дата выдачи; дата рождения»."
     )
@@ -2322,11 +2653,7 @@ async def mf_passport_info(m: Message, state: FSMContext):
     # Текст паспорта НЕ сохраняем — только для визуальной сверки админом
     await m.answer(
         "Прикрепите <b>скан паспорта</b> (фото документа):",
-        reply_markup=ReplyKeyboardMarkup(
-            keyboard=[[KeyboardButton(text="❌ Отмена")]],
-            resize_keyboard=True,
-            one_time_keyboard=False
-        )
+        reply_markup=CANCEL_TEXT_KB
     )
     await state.set_state(MasterForm.passport_scan)
 
@@ -2335,11 +2662,7 @@ async def mf_passport_scan(m: Message, state: FSMContext):
     await state.update_data(passport_scan_file_id=m.photo[-1].file_id)
     await m.answer(
         "Прикрепите <b>ваше фото</b> (используем для карточки мастера):",
-        reply_markup=ReplyKeyboardMarkup(
-            keyboard=[[KeyboardButton(text="❌ Отмена")]],
-            resize_keyboard=True,
-            one_time_keyboard=False
-        )
+        reply_markup=CANCEL_TEXT_KB
     )
     await state.set_state(MasterForm.face_photo)
 
@@ -2354,27 +2677,28 @@ async def mf_passport_scan_invalid(m: Message, state: FSMContext):
 
 @dp.message(MasterForm.face_photo, F.photo)
 async def mf_face_photo(m: Message, state: FSMContext):
-    await state.update_data(face_photo_file_id=m.photo[-1].file_id)
+    d = await state.update_data(face_photo_file_id=m.photo[-1].file_id)
 
     # теперь мастер — Проверенный
-    d = await state.get_data()
     cats_auto = d.get("categories_auto","")
-    skill_tier = calc_skill_tier(0)
-    result = db.execute("""
-      INSERT INTO masters(fio, contact, phone, exp_bucket, exp_text, portfolio, `references`,
-                          level, verified, has_npd_ip, passport_scan_file_id, face_photo_file_id,
-                          categories_auto, orders_completed, skill_tier, free_orders_left, is_active)
-      VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,1)
-    """, (
+    skill_tier = "Новичок"  # 0 выполненных заказов (без запроса к БД из event loop)
+    result = await db.aexecute(INSERT_VERIFIED_MASTER_SQL, (
         d["fio"], d["uid"], d.get("phone",""), d.get("exp_bucket",""), d.get("exp_text",""),
         d.get("portfolio",""), d.get("references",""), "Проверенный", 1, 0,
         d.get("passport_scan_file_id",""), d.get("face_photo_file_id",""),
         cats_auto, 0, skill_tier, FREE_ORDERS_START
     ))
-    mid = result.lastrowid if result else None
-    db.commit()
+    if not result:
+        # Анкета не сохранена: остаемся на шаге фото, его можно отправить ещё раз
+        await m.answer(MASTER_SAVE_FAILED_TEXT)
+        return
+    mid = result.lastrowid
+    invalidate_master(d["uid"])  # пользователь стал мастером
 
-    await notify_admin(admin_master_card(mid))
+    await notify_admin(format_master_card(
+        mid, d["fio"], d["uid"], d.get("phone",""), "Проверенный", 1, 0, cats_auto,
+        d.get("exp_bucket",""), d.get("exp_text",""), d.get("portfolio",""), None
+    ))
 
     # предложим апгрейд до Верифицированного (НПД/ИП)
     kb = InlineKeyboardMarkup(inline_keyboard=[[
@@ -2410,16 +2734,18 @@ async def mf_npd_offer(c: CallbackQuery, state: FSMContext):
     mid = int(mid)
     
     if ans == "no":
-        await notify_admin(admin_master_card(mid))
-        
-        await c.message.edit_text(
-            "✅ Анкета сохранена. Статус: Проверенный.", 
-            reply_markup=main_menu_kb(str(c.from_user.id))
-        )
-        
-        await c.message.answer(
-            "🎉 Поздравляем! Теперь вы можете получать заказы!",
-            reply_markup=ReplyKeyboardRemove()
+        card = await asyncio.to_thread(admin_master_card, mid)
+        await gather_logged(
+            notify_admin(card),
+            safe_edit(c.message,
+                "✅ Анкета сохранена. Статус: Проверенный.", 
+                reply_markup=_main_menu_kb(True)
+            ),
+            c.message.answer(
+                "🎉 Поздравляем! Теперь вы можете получать заказы!",
+                reply_markup=ReplyKeyboardRemove()
+            ),
+            tag="MASTER_REGISTERED"
         )
         
         await state.clear()
@@ -2428,7 +2754,7 @@ async def mf_npd_offer(c: CallbackQuery, state: FSMContext):
 
     # “yes” — продолжаем к ИНН
     await state.update_data(current_mid=mid)
-    await c.message.edit_text("Введите ваш ИНН (10 или 12 цифр):")
+    await safe_edit(c.message, "Введите ваш ИНН (10 или 12 цифр):")
     await state.set_state(MasterForm.inn_cert)
     await c.answer()
 
@@ -2442,22 +2768,14 @@ async def mf_inn_cert(m: Message, state: FSMContext):
     if not inn.isdigit() or len(inn) not in (10, 12):
         await m.answer(
             "❌ ИНН некорректный. Введите 10 или 12 цифр:",
-            reply_markup=ReplyKeyboardMarkup(
-                keyboard=[[KeyboardButton(text="❌ Отмена")]],
-                resize_keyboard=True,
-                one_time_keyboard=False
-            )
+            reply_markup=CANCEL_TEXT_KB
         )
         return
     
     await state.update_data(inn_cert=inn)
     await m.answer(
         "Прикрепите документ, подтверждающий самозанятость/ИП (фото/скан):",
-        reply_markup=ReplyKeyboardMarkup(
-            keyboard=[[KeyboardButton(text="❌ Отмена")]],
-            resize_keyboard=True,
-            one_time_keyboard=False
-        )
+        reply_markup=CANCEL_TEXT_KB
     )
     await state.set_state(MasterForm.npd_doc)
 
@@ -2468,7 +2786,7 @@ async def mf_npd_doc(m: Message, state: FSMContext):
     file_id = m.photo[-1].file_id
     inn = d.get("inn_cert","")
     
-    db.execute("""
+    await db.aexecute("""
         UPDATE masters
         SET has_npd_ip=1,
             level='Верифицированный',
@@ -2477,11 +2795,11 @@ async def mf_npd_doc(m: Message, state: FSMContext):
         WHERE id=?
     """, (file_id, inn, mid))
 
-    await notify_admin(admin_master_card(mid))
+    await notify_admin(await asyncio.to_thread(admin_master_card, mid))
 
     await m.answer(
         "✅ Анкета сохранена. Статус: Верифицированный.", 
-        reply_markup=main_menu_kb(str(m.from_user.id))
+        reply_markup=_main_menu_kb(True)
     )
     
     await m.answer(
@@ -2556,131 +2874,137 @@ async def checkout(pre: PreCheckoutQuery):
 async def payment_done(m: Message):
     payload = m.successful_payment.invoice_payload
     uid = str(m.from_user.id)
+    invalidate_master_views(uid)
+    invalidate_stats()
     if payload == "sub_30d":
         until = (datetime.utcnow() + timedelta(days=SUB_DURATION_DAYS)).strftime("%Y-%m-%d %H:%M:%S")
-        db.execute("UPDATE masters SET sub_until=? WHERE contact=?", (until, uid))
+        await db.aexecute("UPDATE masters SET sub_until=? WHERE contact=?", (until, uid))
         await m.answer("✅ Подписка активна на 30 дней.")
     elif payload == "priority_30d":
         until = (datetime.utcnow() + timedelta(days=PRIORITY_DURATION_DAYS)).strftime("%Y-%m-%d %H:%M:%S")
-        db.execute("UPDATE masters SET priority_until=? WHERE contact=?", (until, uid))
+        await db.aexecute("UPDATE masters SET priority_until=? WHERE contact=?", (until, uid))
         await m.answer("✅ Приоритет включён на 30 дней.")
     elif payload == "pin_7d":
         until = (datetime.utcnow() + timedelta(days=PIN_DURATION_DAYS)).strftime("%Y-%m-%d %H:%M:%S")
-        db.execute("UPDATE masters SET pin_until=? WHERE contact=?", (until, uid))
+        await db.aexecute("UPDATE masters SET pin_until=? WHERE contact=?", (until, uid))
         await m.answer("✅ Анкета закреплена на 7 дней.")
 
 # ----------------- MATCHING ------------
-async def send_to_masters(request_id: int, category: str, district: str):
-    # выбираем активных мастеров, у кого авто-категории подходят
-    rows = db.fetch_all("""
-      SELECT id, fio, contact, level, priority_until, sub_until, categories_auto
-      FROM masters
-      WHERE is_active=1
-    """)
-
-    # отфильтруем по категории заявки (простое вхождение)
-    def cat_match(cats_auto: str, request_category: str) -> bool:
-        if not cats_auto:
-            return False  # Мастер без категорий НЕ получает заказы
-        
-        # Нормализуем категорию заявки (убираем эмодзи и лишнее)
-        clean_request = re.sub(r"[^а-яА-Я]", "", request_category).strip().lower()
-        
-        # Нормализуем категории мастера
-        master_cats = []
-        for cat in cats_auto.split(","):
-            # Убираем подкатегории (например "Ремонт/электрика" -> "ремонт")
-            main_cat = cat.split("/")[0].strip()
-            clean_cat = re.sub(r"[^а-яА-Я]", "", main_cat).strip().lower()
-            if clean_cat:
-                master_cats.append(clean_cat)
-        
-        # Проверяем вхождение (гибкое совпадение)
-        return any(clean_request in mc or mc in clean_request for mc in master_cats)
-
-    rows = [r for r in rows if cat_match(r[6], category)]
-
-    # сортировка: приоритет -> подписка -> уровень
-    def sort_key(r):
-        _id, _fio, _contact, _level, pr_until, sub_until, _cats = r
-        pr = 1 if is_active(pr_until) else 0
-        sub = 1 if is_active(sub_until) else 0
-        lvl_rank = {"ТОП":3, "Верифицированный":2, "Проверенный":1, "Кандидат":0}.get(_level,0)
-        return (-pr, -sub, -lvl_rank)
-
-    rows = sorted(rows, key=sort_key)[:5]
-
-    # Получаем полную информацию о заявке
-    request_data = db.fetch_one("""
-        SELECT name, description, when_text 
-        FROM requests 
-        WHERE id = ?
-    """, (request_id,))
-
-    if request_data:
-        text = (
-            f"🆕 <b>Новая заявка #{request_id}</b>\n\n"
-            f"📂 Категория: {category}\n"
-            f"📍 Адрес: {district}\n"
-            f"📝 Описание: {request_data['description']}\n"
-            f"🗓 Когда: {request_data['when_text']}\n\n"
-            f"❗️ Контакты клиента будут отправлены после согласия."
+# Ранг уровня мастера при рассылке заявки (выше — раньше)
+LEVEL_RANK = {"ТОП": 3, "Верифицированный": 2, "Проверенный": 1, "Кандидат": 0}
+
+@lru_cache(maxsize=8192)
+def cat_match(cats_auto: str | None, clean_request: str) -> int:
+    """
+    SQL-функция cat_match(categories_auto, нормализованная категория заявки):
+    гибкое вхождение в любую сторону. Мастер без категорий НЕ получает заказы.
+    Категорий заявки немного, а у мастеров строки categories_auto повторяются,
+    поэтому ответ кэшируется по паре строк — для строки таблицы это поиск в dict.
+    """
+    if not cats_auto:
+        return 0
+    return int(any(clean_request in mc or mc in clean_request for mc in normalize_master_cats(cats_auto)))
+
+db.create_function("cat_match", 2, cat_match)
+
+# Фильтр по категории, сортировка (приоритет -> подписка -> уровень) и топ-5 — в одном запросе
+MATCH_MASTERS_SQL = f"""
+  SELECT id, fio, contact, level
+  FROM masters
+  WHERE is_active=1 AND cat_match(categories_auto, :cat)
+  ORDER BY COALESCE(priority_until > :now, 0) DESC,
+           COALESCE(sub_until > :now, 0) DESC,
+           CASE level {" ".join(f"WHEN '{lvl}' THEN {rank}" for lvl, rank in LEVEL_RANK.items())} ELSE 0 END DESC,
+           id
+  LIMIT 5
+"""
+
+def create_request_tx(values: tuple, category: str):
+    """
+    Одной транзакцией: создать заявку (values — параметры INSERT_REQUEST_SQL),
+    подобрать мастеров и записать им офферы. Возвращает (id заявки, строки мастеров).
+    Ошибки пробрасываются — при исключении не остается ни заявки, ни офферов.
+    """
+    # Нормализуем категорию заявки один раз (убираем эмодзи и лишнее)
+    clean_request = CYR_NONLETTER_RE.sub("", category.lower())
+    with db.write_conn() as conn:
+        request_id = conn.execute(INSERT_REQUEST_SQL, values).lastrowid
+        # выбираем активных мастеров, у кого авто-категории подходят
+        masters = conn.execute(MATCH_MASTERS_SQL, {"cat": clean_request, "now": now_ts()}).fetchall()
+        conn.executemany(
+            "INSERT INTO offers(request_id, master_id, status) VALUES(?,?, 'sent')",
+            [(request_id, m['id']) for m in masters]
         )
-    else:
-        text = (f"🆕 Заявка #{request_id}\n"
-                f"Категория: {category}\n"
-                f"Адрес: {district}")
+    return request_id, masters
 
-    for mid, fio, contact, level, _, _, _ in rows:
+async def send_to_masters(request_id: int, category: str, district: str,
+                          description: str, when_text: str, masters):
+    """Разослать заявку подобранным мастерам (офферы уже записаны в create_request_tx)"""
+    text = (
+        f"🆕 <b>Новая заявка #{request_id}</b>\n\n"
+        f"📂 Категория: {category}\n"
+        f"📍 Адрес: {district}\n"
+        f"📝 Описание: {description}\n"
+        f"🗓 Когда: {when_text}\n\n"
+        f"❗️ Контакты клиента будут отправлены после согласия."
+    )
+
+    async def offer_to_master(mid, contact):
         kb = InlineKeyboardMarkup(inline_keyboard=[
             [
                 InlineKeyboardButton(text="✅ Беру", callback_data=f"offer:take:{request_id}:{mid}"),
                 InlineKeyboardButton(text="⏭ Пропустить", callback_data=f"offer:skip:{request_id}:{mid}")
             ]
         ])
-        db.execute("INSERT INTO offers(request_id, master_id, status) VALUES(?,?, 'sent')", (request_id, mid))
-        db.commit()
         try:
             chat_id = int(contact)  # в анкете мы сохранили user_id мастера в contact
         except:
             chat_id = ADMIN_CHAT_ID  # на всякий случай
         try:
-            await bot.send_message(chat_id, text, reply_markup=kb)
+            await tg_send(chat_id, text, reply_markup=kb)
+        except TelegramForbiddenError:
+            # 403: мастер заблокировал бота или удалил аккаунт — деактивируем
+            await db.aexecute("UPDATE masters SET is_active = 0 WHERE id = ?", (mid,))
+            logging.info("[MASTER_DEACTIVATED] Master #%s blocked the bot", mid)
         except Exception as e:
-            error_msg = str(e).lower()
-            if "blocked" in error_msg or "bot was blocked" in error_msg or "user is deactivated" in error_msg:
-                # Деактивируем мастера, если он заблокировал бота
-                db.execute("UPDATE masters SET is_active = 0 WHERE id = ?", (mid,))
-                logging.info(f"[MASTER_DEACTIVATED] Master #{mid} blocked the bot")
-            else:
-                logging.warning(f"[MASTER_NOTIFY_ERROR] Master #{mid}: {e}")
+            logging.warning("[MASTER_NOTIFY_ERROR] Master #%s: %s", mid, e)
+
+    # Рассылка параллельно: задержки HTTP перекрываются, общий темп держит send_limiter
+    await gather_logged(
+        *(offer_to_master(mid, contact) for mid, _fio, contact, *_ in masters),
+        tag="MASTER_OFFER"
+    )
 
 # ----------------- TAKE ORDER ----------
-@dp.callback_query(F.data.startswith("offer:"))
+# Лимит: 10 действий с заказами в час (взять/пропустить) — проверяет RateLimitMiddleware
+@dp.callback_query(F.data.startswith("offer:"), flags={"rate_limit": ("offer_actions", 10, 3600)})
 async def offer_actions(c: CallbackQuery):
     user_id = c.from_user.id
     
-    # Лимит: 10 действий с заказами в час (взять/пропустить)
-    if not rate_limiter.check_limit(user_id, "offer_actions", 10, 3600):
-        await c.answer("❌ Слишком много действий. Подождите немного.", show_alert=True)
-        return
-    
     _, action, req_id, master_id = c.data.split(":")
     req_id, master_id = int(req_id), int(master_id)
-    row = db.fetch_one("SELECT status, name, contact FROM requests WHERE id=?", (req_id,))
+    # Взять/пропустить меняет счетчики в кабинете и статистике
+    invalidate_master_views(user_id)
+    # Заявка и мастер, нажавший кнопку, — одним запросом
+    row = await db.afetch_one("""
+        SELECT r.status, r.name, r.contact,
+               m.id AS master_row_id, m.sub_until, m.free_orders_left, m.fio, m.phone
+        FROM requests r
+        LEFT JOIN masters m ON m.contact = ?
+        WHERE r.id = ?
+    """, (str(user_id), req_id))
     if not row:
         await c.answer("Заказ не найден", show_alert=True)
         return
     status, client_name, client_contact = row['status'], row['name'], row['contact']
 
     if action == "skip":
-        db.execute("UPDATE offers SET status='skipped' WHERE request_id=? AND master_id=?", (req_id, master_id))
+        await db.aexecute("UPDATE offers SET status='skipped' WHERE request_id=? AND master_id=?", (req_id, master_id))
         await c.answer("Пропущено"); return
 
     if action == "take":
         # Проверяем, что callback нажал именно тот мастер, которому пришло уведомление
-        current_master = db.fetch_one("SELECT id FROM masters WHERE contact = ?", (str(c.from_user.id),))
-        if not current_master or current_master['id'] != master_id:
+        if row['master_row_id'] != master_id:
             await c.answer("❌ Ошибка авторизации", show_alert=True)
             return
         
@@ -2688,61 +3012,27 @@ async def offer_actions(c: CallbackQuery):
             await c.answer("Заказ уже взят другим мастером", show_alert=True)
             return
 
-        m = db.fetch_one("SELECT sub_until, free_orders_left FROM masters WHERE id=?", (master_id,))
-        if not m:
-            await c.answer("Мастер не найден", show_alert=True)
-            return
-        sub_until, free_left = m['sub_until'], m['free_orders_left']
-
-        allowed = False
-        if is_active(sub_until):
-            allowed = True
-        elif (free_left or 0) > 0:
-            allowed = True
-            db.execute("UPDATE masters SET free_orders_left=free_orders_left-1 WHERE id=?", (master_id,))
-        else:
-            kb = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="💳 Оформить подписку (990 ₽/мес)", callback_data="pay:sub")]
-            ])
-            await c.message.reply("❌ У вас закончились 3 бесплатных заказа. Оформите подписку, чтобы брать заказы без ограничений.", reply_markup=kb)
-            await c.answer(); return
-
-        db.execute("UPDATE requests SET status='assigned', master_id=? WHERE id=?", (master_id, req_id))
+        use_free_order = False
+        if not is_active(row['sub_until']):
+            if (row['free_orders_left'] or 0) <= 0:
+                await c.message.reply("❌ У вас закончились 3 бесплатных заказа. Оформите подписку, чтобы брать заказы без ограничений.", reply_markup=SUBSCRIBE_KB)
+                await c.answer(); return
+            use_free_order = True
 
-        # Редактируем исходное сообщение
-        await c.message.edit_text("✅ Заказ закреплён за вами!")
+        # Все изменения в БД — до обращений к Telegram, одной транзакцией
+        request_full = await asyncio.to_thread(take_request_tx, req_id, master_id, use_free_order)
+        if not request_full:
+            await c.answer("Заказ уже взят другим мастером", show_alert=True)
+            return
 
-        # Получаем полную информацию о заявке для отправки мастеру
-        request_full = db.fetch_one("""
-            SELECT name, contact, description, when_text, district, client_user_id 
-            FROM requests 
-            WHERE id = ?
-        """, (req_id,))
-
-        if request_full:
-            # Уведомляем клиента
-            if request_full['client_user_id']:
-                master_info = db.fetch_one("SELECT fio, phone FROM masters WHERE id = ?", (master_id,))
-                if master_info:
-                    master_name = master_info['fio'] or "Мастер"
-                    master_phone = master_info['phone'] or "не указан"
-                    try:
-                        await bot.send_message(
-                            int(request_full['client_user_id']),
-                            f"✅ <b>Ваш заказ #{req_id} взят в работу!</b>\n\n"
-                            f"👨‍🔧 Мастер: {master_name}\n"
-                            f"📞 Телефон: {master_phone}\n\n"
-                            f"Мастер свяжется с вами в ближайшее время."
-                        )
-                    except Exception as e:
-                        logging.warning(f"[CLIENT_NOTIFY_ERROR] {e}")
-            
-            # Отправляем детали заказа мастеру
-            kb = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="✅ Завершить заказ", callback_data=f"complete:{req_id}")]
-            ])
-            
-            await bot.send_message(
+        # Отправляем детали заказа мастеру
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="✅ Завершить заказ", callback_data=f"complete:{req_id}")]
+        ])
+        sends = [
+            # Редактируем исходное сообщение
+            safe_edit(c.message, "✅ Заказ закреплён за вами!"),
+            tg_send(
                 c.from_user.id,
                 f"📋 <b>Детали заказа #{req_id}</b>\n\n"
                 f"👤 Клиент: {request_full['name']}\n"
@@ -2753,10 +3043,20 @@ async def offer_actions(c: CallbackQuery):
                 f"💬 Свяжитесь с клиентом для уточнения деталей.\n"
                 f"После выполнения работ нажмите кнопку ниже:",
                 reply_markup=kb
-            )
-
-        db.execute("UPDATE offers SET status='taken' WHERE request_id=? AND master_id=?", (req_id, master_id))
-        await notify_admin(f"🔗 Заказ #{req_id} взят мастером #{master_id}. Клиент: {client_name} | {client_contact}")
+            ),
+            notify_admin(f"🔗 Заказ #{req_id} взят мастером #{master_id}. Клиент: {client_name} | {client_contact}"),
+        ]
+        # Уведомляем клиента
+        if request_full['client_user_id']:
+            sends.append(tg_send(
+                int(request_full['client_user_id']),
+                f"✅ <b>Ваш заказ #{req_id} взят в работу!</b>\n\n"
+                f"👨‍🔧 Мастер: {row['fio'] or 'Мастер'}\n"
+                f"📞 Телефон: {row['phone'] or 'не указан'}\n\n"
+                f"Мастер свяжется с вами в ближайшее время."
+            ))
+        # Независимые запросы к Telegram — параллельно
+        await gather_logged(*sends, tag="TAKE_NOTIFY")
         await c.answer()
 
 # ----------------- COMPLAINT FLOW ------
@@ -2788,143 +3088,150 @@ async def comp_text(m: Message, state: FSMContext):
         if not request_id:
             # Это не отзыв, а обычная жалоба - обрабатываем как раньше
             d = await state.get_data()
-            db.execute("INSERT INTO complaints(who,order_id,master_id,text) VALUES(?,?,?,?)",
+            await db.aexecute("INSERT INTO complaints(who,order_id,master_id,text) VALUES(?,?,?,?)",
                       (d["who"], d["order_id"], d["master_id"], m.text.strip()))
-            db.commit()
             await notify_admin(f"🚨 Жалоба: {json.dumps(d, ensure_ascii=False)}")
-            await m.answer("✅ Жалоба отправлена. Мы свяжемся с вами.", reply_markup=main_menu_kb(str(c.from_user.id)))
+            await m.answer("✅ Жалоба отправлена. Мы свяжемся с вами.", reply_markup=await main_menu_kb(str(m.from_user.id)))
             await state.clear()
             return
         
         # Это текстовый отзыв - сохраняем
-        request = db.fetch_one("SELECT master_id FROM requests WHERE id = ?", (request_id,))
+        request = await db.afetch_one("""
+            SELECT master_id,
+                   (SELECT contact FROM masters WHERE id = requests.master_id) AS master_contact
+            FROM requests WHERE id = ?
+        """, (request_id,))
         if not request:
             await m.answer("❌ Заявка не найдена")
             await state.clear()
             return
         
         # Обновляем отзыв текстом
-        db.execute("""
+        await db.aexecute("""
             UPDATE reviews 
             SET comment = ?
             WHERE request_id = ?
         """, (m.text.strip(), request_id))
+        invalidate_master_views(request['master_contact'])
         
         await m.answer(
             "✅ Спасибо за развернутый отзыв! Он очень важен для нашего сообщества.",
-            reply_markup=main_menu_kb(str(c.from_user.id))
+            reply_markup=await main_menu_kb(str(m.from_user.id))
         )
         
         await state.clear()
         
     except Exception as e:
-        logging.error(f"[REVIEW_TEXT_PROCESS_ERROR] {e}")
+        logging.error("[REVIEW_TEXT_PROCESS_ERROR] %s", e)
         await m.answer("❌ Ошибка при сохранении отзыва")
         await state.clear()
 
 # ----------------- BILLING MENU --------
 @dp.callback_query(F.data=="go:billing")
 async def go_billing(c: CallbackQuery, state: FSMContext):
-    await c.message.answer(
-        "<b>Подписка и услуги для мастеров</b>\n\n"
-        "🔹 Новым мастерам: 3 заказа бесплатно\n"
-        "🔹 Далее подписка: 990 ₽/мес (безлимит)\n\n"
-        "Доп.услуги:\n"
-        "⚡ Приоритет заказов — 490 ₽/мес\n"
-        "📌 Закреп анкеты — 190 ₽/нед\n",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="💳 Подписка 990 ₽", callback_data="pay:sub")],
-            [InlineKeyboardButton(text="⚡ Приоритет 490 ₽", callback_data="pay:priority")],
-            [InlineKeyboardButton(text="📌 Закреп 190 ₽", callback_data="pay:pin")],
-            [InlineKeyboardButton(text="🏠 Меню", callback_data="go:menu")]
-        ])
-    )
+    await c.message.answer(BILLING_TEXT, reply_markup=BILLING_KB)
     await c.answer()
 
 # ----------------- MAIN ----------------
 async def periodic_cleanup():
     """
-    Запускает очистку документов по расписанию:
-    - Каждые 24 часа - полная очистка
-    - Каждые 6 часов - быстрая проверка
+    Раз в 24 часа: автозавершение заказов, очистка документов, проверка остатка
+    и чистка лимитеров. Расписание считается по loop.time() от начала прохода,
+    поэтому время самой работы не сдвигает следующий запуск.
     """
     logging.info("[PERIODIC_CLEANUP] Started periodic cleanup service")
-    cleanup_counter = 0  # Счетчик для rate limiter
     
     full_cleanup_interval = 24 * 3600  # 24 часа
-    quick_check_interval = 6 * 3600    # 6 часов
+    loop = asyncio.get_running_loop()
     
     while True:
+        started = loop.time()
         try:
             # Автозавершение заказов, висящих в "pending_confirmation" больше 24 часов
             try:
-                pending_requests = db.fetch_all("""
-                    SELECT id, master_id, client_user_id
+                # Граница — параметром и без datetime() вокруг колонки: сравнение строк по индексу
+                cutoff = (datetime.utcnow() - timedelta(hours=24)).strftime(DB_TS_FORMAT)
+                # Нужны только id (строки заказов вернет complete_requests_tx) — обычные кортежи
+                pending_requests = await db.afetch_all("""
+                    SELECT id
                     FROM requests 
                     WHERE status = 'pending_confirmation'
-                      AND datetime(created_at) < datetime('now', '-24 hours')
-                """)
+                      AND created_at < ?
+                """, (cutoff,), row_factory=None)
             
-                for req in pending_requests:
-                    request_id = req['id']
-                
-                    # Завершаем заказ
-                    await mark_request_completed(request_id)
-                
+                # Все заказы пачки завершаем одной транзакцией
+                completed = await asyncio.to_thread(complete_requests_tx, [rid for (rid,) in pending_requests])
+
+                async def finish_auto_completed(req):
+                    await after_request_completed(req)
                     # Уведомляем клиента
                     if req['client_user_id']:
-                        try:
-                            await bot.send_message(
-                                int(req['client_user_id']),
-                                f"⏰ Заказ #{request_id} автоматически завершён через 24 часа.\n"
-                                f"Пожалуйста, оцените работу мастера:"
-                            )
-                        except Exception as e:
-                            logging.error(f"[AUTO_COMPLETE_NOTIFY_ERROR] {e}")
-                
-                    logging.info(f"[AUTO_COMPLETE] Request #{request_id} auto-completed after 24h")
+                        await tg_send(
+                            int(req['client_user_id']),
+                            f"⏰ Заказ #{req['id']} автоматически завершён через 24 часа.\n"
+                            f"Пожалуйста, оцените работу мастера:"
+                        )
+                    logging.info("[AUTO_COMPLETE] Request #%s auto-completed after 24h", req['id'])
+
+                # Уведомления — параллельно, общий темп держит send_limiter
+                await gather_logged(*(finish_auto_completed(req) for req in completed), tag="AUTO_COMPLETE_NOTIFY")
             
-                if pending_requests:
-                    logging.info(f"[AUTO_COMPLETE] Completed {len(pending_requests)} pending requests")
+                if completed:
+                    logging.info("[AUTO_COMPLETE] Completed %s pending requests", len(completed))
                 
             except Exception as e:
-                logging.error(f"[AUTO_COMPLETE_ERROR] {e}")
+                logging.error("[AUTO_COMPLETE_ERROR] %s", e)
 
             # Полная очистка каждые 24 часа
             await safe_cleanup_documents()
-            logging.info(f"[PERIODIC_CLEANUP] Full cleanup completed. Next in {full_cleanup_interval/3600} hours")
+            logging.info("[PERIODIC_CLEANUP] Full cleanup completed. Next in %s hours", full_cleanup_interval/3600)
             
-            # Ждем 24 часа до следующей полной очистки
-            # Но каждые 6 часов делаем быструю проверку и логируем статус
-            for i in range(4):  # 24 / 6 = 4 интервала
-                await asyncio.sleep(quick_check_interval)
-                
-                # Быстрая проверка: просто логируем статус
-                pending_count = db.fetch_one("""
-                    SELECT COUNT(*) as count 
-                    FROM masters 
-                    WHERE created_at < datetime('now', '-72 hours')
-                      AND (passport_scan_file_id IS NOT NULL 
-                           OR face_photo_file_id IS NOT NULL 
-                           OR npd_ip_doc_file_id IS NOT NULL)
-                """)['count']
-                
-                if pending_count > 0:
-                    logging.info(f"[CLEANUP_STATUS] Documents pending cleanup: {pending_count}")
-                else:
-                    logging.info("[CLEANUP_STATUS] No documents pending cleanup")
-                
-                # Каждые 6 часов чистим rate limiter
-                cleanup_counter += 1
-                if cleanup_counter >= 4:  # 4 * 6 часов = 24 часа
-                    rate_limiter.cleanup_old_entries()
-                    cleanup_counter = 0
+            # Проверка остатка: достаточно факта наличия (EXISTS по индексу), без COUNT
+            pending_left = await db.afetch_one("""
+                SELECT 1
+                FROM masters 
+                WHERE created_at < datetime('now', '-72 hours')
+                  AND (passport_scan_file_id IS NOT NULL 
+                       OR face_photo_file_id IS NOT NULL 
+                       OR npd_ip_doc_file_id IS NOT NULL)
+                LIMIT 1
+            """)
+            if pending_left:
+                logging.info("[CLEANUP_STATUS] Documents still pending cleanup")
+            else:
+                logging.info("[CLEANUP_STATUS] No documents pending cleanup")
+            
+            rate_limiter.cleanup_old_entries()
+            await db.aexecute("DELETE FROM rate_limits WHERE window_start + 2 * period <= ?", (time.time(),))
+            send_limiter.cleanup_idle()
+            
+            # Следующий проход — через 24 часа от начала текущего
+            delay = full_cleanup_interval - (loop.time() - started)
                     
         except Exception as e:
-            logging.error(f"[PERIODIC_CLEANUP_ERROR] {e}")
+            logging.error("[PERIODIC_CLEANUP_ERROR] %s", e)
             
             # В случае ошибки ждем 1 час и пробуем снова
-            await asyncio.sleep(3600)
+            delay = 3600
+        
+        await asyncio.sleep(max(0, delay))
+
+# Статистика планировщика SQLite освежается раз в 4 часа (PRAGMA optimize)
+OPTIMIZE_INTERVAL = 4 * 3600
+
+async def periodic_optimize():
+    while True:
+        await asyncio.sleep(OPTIMIZE_INTERVAL)
+        await asyncio.to_thread(db.optimize)
+
+async def periodic_rate_limits_flush():
+    """Сохранение изменившихся окон лимитера одним executemany (одна транзакция на пачку)"""
+    while True:
+        await asyncio.sleep(RATE_LIMITS_FLUSH_INTERVAL)
+        rows = rate_limiter.dirty_rows()
+        if rows and await db.aexecutemany(RATE_LIMITS_UPSERT_SQL, rows) is None:
+            # Запись не удалась (ошибка уже в логе) — повторим в следующий раз
+            rate_limiter.restore_dirty(rows)
 
 async def main():
     # Снимаем вебхук
@@ -2932,17 +3239,19 @@ async def main():
         await bot.delete_webhook(drop_pending_updates=True)
         logging.info("[BOT] Webhook deleted")
     except Exception as e:
-        logging.warning(f"[DEL_WEBHOOK] {e}")
+        logging.warning("[DEL_WEBHOOK] %s", e)
 
     # Уведомление админа
     if ADMIN_CHAT_ID:
         try:
-            await bot.send_message(ADMIN_CHAT_ID, "✅ Бот запущен (v3, с улучшенной безопасностью)")
+            await tg_send(ADMIN_CHAT_ID, "✅ Бот запущен (v3, с улучшенной безопасностью)")
         except Exception as e:
-            logging.error(f"[ADMIN_NOTIFY_ERROR] {e}")
+            logging.error("[ADMIN_NOTIFY_ERROR] %s", e)
 
     # Запускаем фоновую очистку
     asyncio.create_task(periodic_cleanup())
+    asyncio.create_task(periodic_optimize())
+    asyncio.create_task(periodic_rate_limits_flush())
     logging.info("[BOT] Background tasks started")
 
     # Запускаем бота
@@ -2950,10 +3259,22 @@ async def main():
     try:
         await dp.start_polling(bot)
     except Exception as e:
-        logging.error(f"[BOT_ERROR] {e}")
+        logging.error("[BOT_ERROR] %s", e)
     finally:
+        if redis_limiter:
+            await redis_limiter.close()
+        # Несохраненные окна лимитера — перед закрытием БД
+        rows = rate_limiter.dirty_rows()
+        if rows and db.executemany(RATE_LIMITS_UPSERT_SQL, rows) is None:
+            logging.error("[RATE_LIMITER] %s windows were not saved on shutdown", len(rows))
         db.close()
         logging.info("[BOT] Stopped")
 
 if __name__ == "__main__":
+    # uvloop — более быстрый event loop (опционально, только Linux/macOS)
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
     asyncio.run(main())
\ No newline at end of file
@@ -1,7 +1,7 @@
 import sqlite3
 
 conn = sqlite3.connect('vp_masters.sqlite')
-conn.row_factory = sqlite3.Row
+# Строки — обычные кортежи (без sqlite3.Row), читаем курсор потоком, без fetchall
 cur = conn.cursor()
 
 print("=" * 60)
@@ -10,33 +10,32 @@ print("=" * 60)
 
 # Проверяем заявки
 print("\n📝 ЗАЯВКИ:")
-requests = cur.execute("SELECT id, name, contact, client_user_id, status FROM requests").fetchall()
-for r in requests:
-    print(f"  ID: {r['id']}")
-    print(f"  Имя: {r['name']}")
-    print(f"  Контакт: {r['contact']}")
-    print(f"  Client User ID: {r['client_user_id']} ← ВАЖНО!")
-    print(f"  Статус: {r['status']}")
+for rid, name, contact, client_user_id, status in cur.execute(
+    "SELECT id, name, contact, client_user_id, status FROM requests"
+):
+    print(f"  ID: {rid}")
+    print(f"  Имя: {name}")
+    print(f"  Контакт: {contact}")
+    print(f"  Client User ID: {client_user_id} ← ВАЖНО!")
+    print(f"  Статус: {status}")
     print("-" * 40)
 
 # Проверяем мастеров
 print("\n👨‍🔧 МАСТЕРА:")
-masters = cur.execute("SELECT id, fio, contact, phone FROM masters").fetchall()
-for m in masters:
-    print(f"  ID: {m['id']}")
-    print(f"  ФИО: {m['fio']}")
-    print(f"  Контакт (user_id): {m['contact']}")
-    print(f"  Телефон: {m['phone']}")
+for mid, fio, contact, phone in cur.execute("SELECT id, fio, contact, phone FROM masters"):
+    print(f"  ID: {mid}")
+    print(f"  ФИО: {fio}")
+    print(f"  Контакт (user_id): {contact}")
+    print(f"  Телефон: {phone}")
     print("-" * 40)
 
 # Проверяем офферы
 print("\n🤝 ОФФЕРЫ:")
-offers = cur.execute("SELECT id, request_id, master_id, status FROM offers").fetchall()
-for o in offers:
-    print(f"  ID: {o['id']}")
-    print(f"  Request ID: {o['request_id']}")
-    print(f"  Master ID: {o['master_id']}")
-    print(f"  Статус: {o['status']}")
+for oid, request_id, master_id, status in cur.execute("SELECT id, request_id, master_id, status FROM offers"):
+    print(f"  ID: {oid}")
+    print(f"  Request ID: {request_id}")
+    print(f"  Master ID: {master_id}")
+    print(f"  Статус: {status}")
     print("-" * 40)
 
 conn.close()
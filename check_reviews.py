@@ -1,40 +1,38 @@
 import sqlite3
 
 conn = sqlite3.connect('vp_masters.sqlite')
-conn.row_factory = sqlite3.Row
+# Строки — обычные кортежи (без sqlite3.Row), читаем курсор потоком, без fetchall
 cur = conn.cursor()
 
 print("⭐ ОТЗЫВЫ:")
-reviews = cur.execute("""
+has_reviews = False
+for rid, request_id, master_id, rating, comment, created_at in cur.execute("""
     SELECT r.id, r.request_id, r.master_id, r.rating, r.comment, r.created_at
     FROM reviews r
     ORDER BY r.created_at DESC
-""").fetchall()
+"""):
+    has_reviews = True
+    print(f"\n  ID: {rid}")
+    print(f"  Заявка: #{request_id}")
+    print(f"  Мастер: #{master_id}")
+    print(f"  Оценка: {rating} ⭐")
+    print(f"  Комментарий: {comment or 'нет'}")
+    print(f"  Дата: {created_at}")
+    print("-" * 40)
 
-if reviews:
-    for rev in reviews:
-        print(f"\n  ID: {rev['id']}")
-        print(f"  Заявка: #{rev['request_id']}")
-        print(f"  Мастер: #{rev['master_id']}")
-        print(f"  Оценка: {rev['rating']} ⭐")
-        print(f"  Комментарий: {rev['comment'] or 'нет'}")
-        print(f"  Дата: {rev['created_at']}")
-        print("-" * 40)
-else:
+if not has_reviews:
     print("  (Пока нет отзывов)")
 
 # Проверяем статистику мастера
 print("\n📊 СТАТИСТИКА МАСТЕРОВ:")
-masters = cur.execute("""
+for mid, fio, avg_rating, reviews_count, orders_completed in cur.execute("""
     SELECT id, fio, avg_rating, reviews_count, orders_completed
     FROM masters
-""").fetchall()
-
-for m in masters:
-    print(f"\n  #{m['id']} {m['fio']}")
-    print(f"  Средний рейтинг: {m['avg_rating']} ⭐")
-    print(f"  Отзывов: {m['reviews_count']}")
-    print(f"  Выполнено заказов: {m['orders_completed']}")
+"""):
+    print(f"\n  #{mid} {fio}")
+    print(f"  Средний рейтинг: {avg_rating} ⭐")
+    print(f"  Отзывов: {reviews_count}")
+    print(f"  Выполнено заказов: {orders_completed}")
     print("-" * 40)
 
 conn.close()
\ No newline at end of file
@@ -5,22 +5,29 @@ cur = conn.cursor()
 
 print("🗑 Удаление всех данных...")
 
-# Удаляем все записи из всех таблиц
-cur.execute("DELETE FROM requests")
-cur.execute("DELETE FROM offers")
-cur.execute("DELETE FROM reviews")
-cur.execute("DELETE FROM complaints")
-cur.execute("DELETE FROM masters")
+# Удаляем все записи из всех таблиц одной транзакцией
+cur.executescript("""
+    BEGIN;
+    DELETE FROM requests;
+    DELETE FROM offers;
+    DELETE FROM reviews;
+    DELETE FROM complaints;
+    DELETE FROM masters;
+    COMMIT;
+""")
 
-conn.commit()
-
-# Проверяем что удалилось
+# Проверяем что удалилось (все счетчики одним запросом)
+requests_left, masters_left, offers_left, reviews_left, complaints_left = cur.execute("""
+    SELECT (SELECT COUNT(*) FROM requests), (SELECT COUNT(*) FROM masters),
+           (SELECT COUNT(*) FROM offers), (SELECT COUNT(*) FROM reviews),
+           (SELECT COUNT(*) FROM complaints)
+""").fetchone()
 print("\n✅ Удалено:")
-print(f"  Заявок: {cur.execute('SELECT COUNT(*) FROM requests').fetchone()[0]}")
-print(f"  Мастеров: {cur.execute('SELECT COUNT(*) FROM masters').fetchone()[0]}")
-print(f"  Офферов: {cur.execute('SELECT COUNT(*) FROM offers').fetchone()[0]}")
-print(f"  Отзывов: {cur.execute('SELECT COUNT(*) FROM reviews').fetchone()[0]}")
-print(f"  Жалоб: {cur.execute('SELECT COUNT(*) FROM complaints').fetchone()[0]}")
+print(f"  Заявок: {requests_left}")
+print(f"  Мастеров: {masters_left}")
+print(f"  Офферов: {offers_left}")
+print(f"  Отзывов: {reviews_left}")
+print(f"  Жалоб: {complaints_left}")
 
 conn.close()
 
@@ -3,14 +3,14 @@ import sqlite3
 conn = sqlite3.connect('vp_masters.sqlite')
 cur = conn.cursor()
 
-# Удаляем тестовые данные
-cur.execute("DELETE FROM requests")
-cur.execute("DELETE FROM offers")
-cur.execute("DELETE FROM reviews")
-
-# Сбрасываем счётчик бесплатных заказов мастеру
-cur.execute("UPDATE masters SET free_orders_left = 3, orders_completed = 0")
-
-conn.commit()
+# Удаляем тестовые данные и сбрасываем счётчики мастеров одной транзакцией
+cur.executescript("""
+    BEGIN;
+    DELETE FROM requests;
+    DELETE FROM offers;
+    DELETE FROM reviews;
+    UPDATE masters SET free_orders_left = 3, orders_completed = 0;
+    COMMIT;
+""")
 conn.close()
 print("✅ Тестовые данные удалены")
\ No newline at end of file
@@ -2,26 +2,21 @@ import sqlite3
 from datetime import datetime
 
 conn = sqlite3.connect('vp_masters.sqlite')
-conn.row_factory = sqlite3.Row
 cur = conn.cursor()
 
 print(f"📅 Отчёт за {datetime.now().strftime('%d.%m.%Y')}\n")
 
-# Статистика за сегодня
-today_requests = cur.execute("""
-    SELECT COUNT(*) FROM requests 
-    WHERE DATE(created_at) = DATE('now')
-""").fetchone()[0]
-
-today_completed = cur.execute("""
-    SELECT COUNT(*) FROM requests 
-    WHERE DATE(completed_at) = DATE('now')
-""").fetchone()[0]
-
-today_reviews = cur.execute("""
-    SELECT COUNT(*) FROM reviews 
-    WHERE DATE(created_at) = DATE('now')
-""").fetchone()[0]
+# Статистика за сегодня одним запросом
+# (диапазон вместо DATE(колонка), чтобы работал индекс)
+today_requests, today_completed, today_reviews = cur.execute("""
+    SELECT
+        (SELECT COUNT(*) FROM requests
+         WHERE created_at >= DATE('now') AND created_at < DATE('now', '+1 day')),
+        (SELECT COUNT(*) FROM requests
+         WHERE completed_at >= DATE('now') AND completed_at < DATE('now', '+1 day')),
+        (SELECT COUNT(*) FROM reviews
+         WHERE created_at >= DATE('now') AND created_at < DATE('now', '+1 day'))
+""").fetchone()
 
 print(f"📝 Новых заявок сегодня: {today_requests}")
 print(f"✅ Завершено сегодня: {today_completed}")
@@ -35,9 +30,9 @@ top_masters = cur.execute("""
     WHERE reviews_count > 0
     ORDER BY avg_rating DESC, reviews_count DESC
     LIMIT 3
-""").fetchall()
+""")
 
-for i, m in enumerate(top_masters, 1):
-    print(f"{i}. {m['fio']}: {m['avg_rating']}⭐ ({m['reviews_count']} отзывов, {m['orders_completed']} заказов)")
+for i, (fio, avg_rating, reviews_count, orders_completed) in enumerate(top_masters, 1):
+    print(f"{i}. {fio}: {avg_rating}⭐ ({reviews_count} отзывов, {orders_completed} заказов)")
 
 conn.close()
\ No newline at end of file
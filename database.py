@@ -1,106 +1,358 @@
+import asyncio
 import sqlite3
 import logging
+import queue
 import re
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 
+# PRAGMA, применяемые к каждому соединению при открытии.
+# WAL позволяет читателям работать параллельно с писателем, synchronous=NORMAL
+# убирает fsync на каждый коммит, cache_size=-65536 — 64 МБ страничного кэша,
+# mmap_size — чтение страниц через отображение файла в память (256 МБ),
+# analysis_limit ограничивает работу ANALYZE / PRAGMA optimize на больших таблицах.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=30000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA analysis_limit=1000",
+)
+
+# Размер кэша подготовленных выражений на соединение (по умолчанию в sqlite3 — 128).
+# Запросы бота — константные строки, поэтому повторный вызов не парсит SQL заново.
+STATEMENT_CACHE_SIZE = 512
+
+def configure_connection(conn, db_path):
+    """Применение PRAGMA к соединению (для :memory: WAL не поддерживается)"""
+    for pragma in CONNECTION_PRAGMAS:
+        if db_path == ":memory:" and pragma.startswith("PRAGMA journal_mode"):
+            continue
+        conn.execute(pragma)
+
+# Количество соединений-читателей в пуле (WAL: N читателей + 1 писатель)
+READER_POOL_SIZE = 8
+
 class DatabaseManager:
-    def __init__(self, db_path):
+    def __init__(self, db_path, readers: int = READER_POOL_SIZE):
         self.db_path = db_path
-        self.conn = None
+        self.conn = None  # единственное соединение-писатель
+        self._write_lock = threading.RLock()
+        self._readers = queue.SimpleQueue()
+        self._reader_conns = []
+        self._pool_size = readers
+        self._functions = {}  # пользовательские SQL-функции: имя -> (число аргументов, функция)
+        self._tx_thread = None  # поток, открывший транзакцию писателя
         self.connect()
     
+    def _open(self):
+        """Открыть новое соединение с PRAGMA"""
+        # isolation_level=None — autocommit, транзакции открываем явно
+        conn = sqlite3.connect(
+            self.db_path, check_same_thread=False, isolation_level=None,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.row_factory = sqlite3.Row
+        configure_connection(conn, self.db_path)
+        for name, (narg, func) in self._functions.items():
+            conn.create_function(name, narg, func, deterministic=True)
+        return conn
+
+    def create_function(self, name: str, narg: int, func):
+        """
+        Зарегистрировать детерминированную SQL-функцию на всех соединениях.
+        Вызывать при старте, до обращений к БД из потоков.
+        """
+        self._functions[name] = (narg, func)
+        for conn in [self.conn, *self._reader_conns]:
+            if conn is not None:
+                conn.create_function(name, narg, func, deterministic=True)
+
     def connect(self):
         """Установка соединения с БД"""
         try:
-            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            self.conn.row_factory = sqlite3.Row
-            logging.info("[DB] Connection established")
+            self.conn = self._open()
+            # У :memory: каждое соединение — отдельная БД, читаем через писателя
+            if self.db_path != ":memory:":
+                for _ in range(self._pool_size):
+                    reader = self._open()
+                    self._reader_conns.append(reader)
+                    self._readers.put(reader)
+            logging.info("[DB] Connection established (readers: %s)", len(self._reader_conns))
         except Exception as e:
-            logging.error(f"[DB] Connection failed: {e}")
+            logging.error("[DB] Connection failed: %s", e)
+
+    @contextmanager
+    def read_conn(self):
+        """Взять соединение-читатель из пула"""
+        # Внутри своей транзакции читаем через писателя: видны еще не закоммиченные изменения
+        if not self._reader_conns or self._tx_thread == threading.get_ident():
+            with self._write_lock:
+                yield self.conn
+            return
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    @contextmanager
+    def write_conn(self):
+        """Захватить писателя: BEGIN IMMEDIATE ... COMMIT (ROLLBACK при ошибке)"""
+        with self._write_lock:
+            if self.conn.in_transaction:
+                # Вложенный вызов из уже открытой транзакции этого же потока
+                yield self.conn
+                return
+            self.conn.execute("BEGIN IMMEDIATE")
+            self._tx_thread = threading.get_ident()
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.rollback()
+                raise
+            else:
+                self.conn.commit()
+            finally:
+                self._tx_thread = None
+    
+    @contextmanager
+    def transaction(self):
+        """
+        Несколько запросов одной транзакцией (один коммит вместо нескольких):
+            with db.transaction() as cur:
+                cur.execute(...)
+                cur.execute(...)
+        Ошибки не глушатся — при исключении выполняется ROLLBACK.
+        """
+        with self.write_conn() as conn:
+            cur = conn.cursor()
+            try:
+                yield cur
+            finally:
+                cur.close()
     
     def execute(self, query: str, params: tuple = ()):
         """Безопасное выполнение запроса"""
         try:
-            cur = self.conn.cursor()
-            cur.execute(query, params)
-            self.conn.commit()
-            return cur
+            with self.write_conn() as conn:
+                return conn.execute(query, params)
+        except Exception as e:
+            logging.error("[DB] Execute error: %s - Query: %s", e, query)
+            return None
+    
+    def executemany(self, query: str, seq_of_params):
+        """Пакетное выполнение запроса одной транзакцией (один коммит на все строки)"""
+        try:
+            with self.write_conn() as conn:
+                return conn.executemany(query, seq_of_params)
         except Exception as e:
-            logging.error(f"[DB] Execute error: {e} - Query: {query}")
+            logging.error("[DB] Execute error: %s - Query: %s", e, query)
             return None
     
+    def execute_returning(self, query: str, params: tuple = ()):
+        """Изменяющий запрос с RETURNING: строки читаются до коммита"""
+        try:
+            with self.write_conn() as conn:
+                return conn.execute(query, params).fetchall()
+        except Exception as e:
+            logging.error("[DB] Execute error: %s - Query: %s", e, query)
+            return []
+    
     def fetch_one(self, query: str, params: tuple = ()):
         """Получить одну запись"""
-        cur = self.execute(query, params)
-        return cur.fetchone() if cur else None
+        try:
+            with self.read_conn() as conn:
+                cur = conn.execute(query, params)
+                row = cur.fetchone()
+                cur.close()  # сбрасываем statement, чтобы не держать снапшот чтения
+                return row
+        except Exception as e:
+            logging.error("[DB] Fetch error: %s - Query: %s", e, query)
+            return None
     
-    def fetch_all(self, query: str, params: tuple = ()):
-        """Получить все записи"""
-        cur = self.execute(query, params)
-        return cur.fetchall() if cur else []
+    def fetch_all(self, query: str, params: tuple = (), row_factory=sqlite3.Row):
+        """
+        Получить все записи.
+        row_factory=None — обычные кортежи (для распаковки по позиции, без sqlite3.Row на строку)
+        """
+        try:
+            with self.read_conn() as conn:
+                cur = conn.cursor()
+                cur.row_factory = row_factory
+                return cur.execute(query, params).fetchall()
+        except Exception as e:
+            logging.error("[DB] Fetch error: %s - Query: %s", e, query)
+            return []
     
+    # Асинхронные обёртки: запрос уходит в поток, event loop не блокируется
+    async def aexecute(self, query: str, params: tuple = ()):
+        return await asyncio.to_thread(self.execute, query, params)
+
+    async def aexecutemany(self, query: str, seq_of_params):
+        return await asyncio.to_thread(self.executemany, query, list(seq_of_params))
+
+    async def aexecute_returning(self, query: str, params: tuple = ()):
+        return await asyncio.to_thread(self.execute_returning, query, params)
+
+    async def afetch_one(self, query: str, params: tuple = ()):
+        return await asyncio.to_thread(self.fetch_one, query, params)
+
+    async def afetch_all(self, query: str, params: tuple = (), row_factory=sqlite3.Row):
+        return await asyncio.to_thread(self.fetch_all, query, params, row_factory)
+
     def commit(self):
         """Коммит текущей транзакции"""
         if self.conn:
             self.conn.commit()
 
+    def optimize(self):
+        """PRAGMA optimize: ANALYZE только для таблиц, где статистика планировщика устарела"""
+        try:
+            with self._write_lock:
+                self.conn.execute("PRAGMA optimize")
+        except Exception as e:
+            logging.error("[DB] Optimize error: %s", e)
+
     def close(self):
-        """Закрытие соединения"""
+        """Закрытие соединений"""
+        for reader in self._reader_conns:
+            reader.close()
+        self._reader_conns.clear()
         if self.conn:
+            self.optimize()
             self.conn.close()
             logging.info("[DB] Connection closed")
 
-def ensure_column(db, table, name, ddl):
-    """Безопасное добавление колонки в таблицу"""
+# Допустимые имена таблиц/колонок и типы (по префиксу) для ensure_column
+IDENT_RE = re.compile(r'^[a-zA-Z_][a-zA-Z0-9_]*$')
+ALLOWED_COLUMN_TYPES = (
+    'TEXT', 'INTEGER', 'REAL', 'DATETIME', 'BLOB',
+    'INTEGER DEFAULT 0', 'INTEGER DEFAULT 1', 
+    'REAL DEFAULT 0', 'REAL DEFAULT 5.0',
+    'TEXT DEFAULT "Кандидат"', "TEXT DEFAULT 'Кандидат'",
+    'TEXT DEFAULT "Новичок"', "TEXT DEFAULT 'Новичок'",
+    'DATETIME DEFAULT CURRENT_TIMESTAMP'
+)
+
+def ensure_column(db, table, name, ddl, existing: set | None = None):
+    """
+    Безопасное добавление колонки в таблицу.
+    existing — уже прочитанное множество колонок таблицы (PRAGMA table_info
+    не повторяется; после ALTER колонка добавляется в него).
+    Ошибка ALTER пробрасывается: внутри транзакции миграции она откатывает всю миграцию.
+    """
     # Валидация имён таблицы и колонки
-    if not re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*$', table) or not re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*$', name):
-        logging.error(f"[DB] Invalid table or column name: {table}.{name}")
+    if not IDENT_RE.match(table) or not IDENT_RE.match(name):
+        logging.error("[DB] Invalid table or column name: %s.%s", table, name)
         return
     
-    # Белый список допустимых типов данных
-    ALLOWED_TYPES = [
-        'TEXT', 'INTEGER', 'REAL', 'DATETIME', 'BLOB',
-        'INTEGER DEFAULT 0', 'INTEGER DEFAULT 1', 
-        'REAL DEFAULT 0', 'REAL DEFAULT 5.0',
-        'TEXT DEFAULT "Кандидат"', "TEXT DEFAULT 'Кандидат'",
-        'TEXT DEFAULT "Новичок"', "TEXT DEFAULT 'Новичок'",
-        'DATETIME DEFAULT CURRENT_TIMESTAMP'
-    ]
-    
-    # Проверяем что тип разрешён
-    type_valid = False
-    for allowed in ALLOWED_TYPES:
-        if ddl.startswith(allowed) or ddl == allowed:
-            type_valid = True
-            break
-    
-    if not type_valid:
-        logging.error(f"[DB] Invalid column type: {ddl}")
+    # Проверяем что тип разрешён (белый список; str.startswith с кортежем — один вызов)
+    if not ddl.startswith(ALLOWED_COLUMN_TYPES):
+        logging.error("[DB] Invalid column type: %s", ddl)
         return
     
     # Проверяем существование колонки
-    try:
-        existing_columns = db.fetch_all(f"PRAGMA table_info({table})")
-    except Exception as e:
-        logging.error(f"[DB] PRAGMA error for {table}: {e}")
-        return
-        
-    if not existing_columns:
+    if existing is None:
+        existing = table_columns(db, table)
+    if not existing:
         return
     
-    cols = {row['name'] for row in existing_columns}
-    if name not in cols:
-        try:
-            safe_query = f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"
-            db.execute(safe_query)
-            logging.info(f"[DB] ADD {table}.{name}")
-        except Exception as e:
-            logging.error(f"[DB] ALTER fail {table}.{name}: {e}")
+    if name not in existing:
+        with db.write_conn() as conn:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}")
+        existing.add(name)
+        logging.info("[DB] ADD %s.%s", table, name)
+
+def table_columns(db, table) -> set:
+    """Имена колонок таблицы (пустое множество, если таблицы нет или ошибка)"""
+    try:
+        return {row['name'] for row in db.fetch_all(f"PRAGMA table_info({table})")}
+    except Exception as e:
+        logging.error("[DB] PRAGMA error for %s: %s", table, e)
+        return set()
+
+# Рейтинг мастера поддерживается триггерами: сумма и количество оценок меняются
+# на O(1) при каждом INSERT/DELETE в reviews, без пересчета AVG по всем отзывам
+RATING_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS reviews_ai AFTER INSERT ON reviews BEGIN
+        UPDATE masters
+        SET rating_sum = rating_sum + NEW.rating,
+            reviews_count = reviews_count + 1,
+            avg_rating = ROUND((rating_sum + NEW.rating) * 1.0 / (reviews_count + 1), 1)
+        WHERE id = NEW.master_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS reviews_ad AFTER DELETE ON reviews BEGIN
+        UPDATE masters
+        SET rating_sum = rating_sum - OLD.rating,
+            reviews_count = reviews_count - 1,
+            avg_rating = CASE WHEN reviews_count > 1
+                THEN ROUND((rating_sum - OLD.rating) * 1.0 / (reviews_count - 1), 1)
+                ELSE 5.0 END
+        WHERE id = OLD.master_id;
+    END
+    """,
+)
+
+def init_rating_triggers(db):
+    """
+    Создать триггеры рейтинга; при первом создании — заполнить счетчики по reviews.
+    Ошибки пробрасываются: пересчет без триггеров не должен закоммититься.
+    """
+    with db.write_conn() as conn:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'reviews_ai'"
+        ).fetchone()
+        if exists:
+            return
+        # Разовый пересчет: дальше значения поддерживают триггеры
+        conn.execute("""
+            UPDATE masters
+            SET rating_sum = (SELECT COALESCE(SUM(rating), 0) FROM reviews WHERE master_id = masters.id),
+                reviews_count = (SELECT COUNT(*) FROM reviews WHERE master_id = masters.id)
+        """)
+        conn.execute("""
+            UPDATE masters
+            SET avg_rating = ROUND(rating_sum * 1.0 / reviews_count, 1)
+            WHERE reviews_count > 0
+        """)
+        for trigger in RATING_TRIGGERS:
+            conn.execute(trigger)
+    logging.info("[DB] Rating triggers created")
 
 def init_database(db):
     """Инициализация всех таблиц и колонок"""
-    # Базовые таблицы
-    db.execute("""
+    # WAL сохраняется в файле БД, режим выставляется в configure_connection
+    mode = db.fetch_one("PRAGMA journal_mode")
+    logging.info("[DB] journal_mode=%s", mode[0] if mode else 'unknown')
+
+    # Вся миграция — одна транзакция: один коммит вместо десятков и атомарность схемы.
+    # Любая ошибка DDL откатывает миграцию целиком; с недомигрированной схемой не стартуем.
+    try:
+        with db.write_conn():
+            _init_schema(db)
+    except Exception as e:
+        logging.error("[DB] Schema migration failed, rolled back: %s", e)
+        raise
+    
+    # Статистика для планировщика: при первом запуске — полный ANALYZE,
+    # дальше PRAGMA optimize освежает только устаревшее
+    if db.fetch_one("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"):
+        db.optimize()
+    else:
+        db.execute("ANALYZE")
+    
+    logging.info("[DB] Database initialized")
+
+# Базовые таблицы
+SCHEMA_TABLES = (
+    """
     CREATE TABLE IF NOT EXISTS requests(
       id INTEGER PRIMARY KEY AUTOINCREMENT,
       name TEXT, contact TEXT, category TEXT, district TEXT,
@@ -110,9 +362,8 @@ def init_database(db):
       auto_category TEXT,
       score REAL DEFAULT 0,
       created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-    )""")
-    
-    db.execute("""
+    )""",
+    """
     CREATE TABLE IF NOT EXISTS masters(
       id INTEGER PRIMARY KEY AUTOINCREMENT,
       fio TEXT, contact TEXT, inn TEXT,
@@ -130,25 +381,22 @@ def init_database(db):
       photo_file_id TEXT,
       categories_auto TEXT,
       created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-    )""")
-    
-    db.execute("""
+    )""",
+    """
     CREATE TABLE IF NOT EXISTS complaints(
       id INTEGER PRIMARY KEY AUTOINCREMENT,
       who TEXT, order_id TEXT, master_id TEXT, text TEXT,
       created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-    )""")
-    
-    db.execute("""
+    )""",
+    """
     CREATE TABLE IF NOT EXISTS offers(
       id INTEGER PRIMARY KEY AUTOINCREMENT,
       request_id INTEGER,
       master_id INTEGER,
       status TEXT,
       created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-    )""")
-    
-    db.execute("""
+    )""",
+    """
     CREATE TABLE IF NOT EXISTS reviews(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         request_id INTEGER NOT NULL,
@@ -159,42 +407,104 @@ def init_database(db):
         created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY (request_id) REFERENCES requests(id),
         FOREIGN KEY (master_id) REFERENCES masters(id)
-    )""")
-
-    # Индексы
-    db.execute("CREATE INDEX IF NOT EXISTS idx_reviews_master_id ON reviews(master_id)")
-    db.execute("CREATE INDEX IF NOT EXISTS idx_reviews_request_id ON reviews(request_id)")
-    db.execute("CREATE INDEX IF NOT EXISTS idx_masters_contact ON masters(contact)")
-    db.execute("CREATE INDEX IF NOT EXISTS idx_requests_status ON requests(status)")
-    db.execute("CREATE INDEX IF NOT EXISTS idx_offers_request_id ON offers(request_id)")
-    db.execute("CREATE INDEX IF NOT EXISTS idx_offers_master_id ON offers(master_id)")
-    db.execute("CREATE INDEX IF NOT EXISTS idx_masters_active ON masters(is_active, level)")
-    
-    # Мягкие добавления недостающих колонок
-    ensure_column(db, "requests", "completed_at", "DATETIME")
-    ensure_column(db, "requests", "client_rating", "INTEGER")
-    ensure_column(db, "requests", "client_comment", "TEXT")
-    ensure_column(db, "requests", "review_requested", "INTEGER DEFAULT 0")
-    ensure_column(db, "requests", "auto_category", "TEXT")
-    ensure_column(db, "requests", "score", "REAL DEFAULT 0")
-    ensure_column(db, "requests", "client_user_id", "TEXT")
-    
-    ensure_column(db, "masters", "avg_rating", "REAL DEFAULT 5.0")
-    ensure_column(db, "masters", "reviews_count", "INTEGER DEFAULT 0")
-    ensure_column(db, "masters", "free_orders_left", "INTEGER DEFAULT 3")
-    ensure_column(db, "masters", "priority_until", "DATETIME")
-    ensure_column(db, "masters", "pin_until", "DATETIME")
-    ensure_column(db, "masters", "has_npd_ip", "INTEGER DEFAULT 0")
-    ensure_column(db, "masters", "verified", "INTEGER DEFAULT 0")
-    ensure_column(db, "masters", "photo_file_id", "TEXT")
-    ensure_column(db, "masters", "categories_auto", "TEXT")
-    ensure_column(db, "masters", "phone", "TEXT")
-    ensure_column(db, "masters", "exp_bucket", "TEXT")
-    ensure_column(db, "masters", "exp_text", "TEXT")
-    ensure_column(db, "masters", "passport_scan_file_id", "TEXT")
-    ensure_column(db, "masters", "face_photo_file_id", "TEXT")
-    ensure_column(db, "masters", "npd_ip_doc_file_id", "TEXT")
-    ensure_column(db, "masters", "orders_completed", "INTEGER DEFAULT 0")
-    ensure_column(db, "masters", "skill_tier", "TEXT DEFAULT 'Новичок'")
-    
-    logging.info("[DB] Database initialized")
\ No newline at end of file
+    )""",
+    # Окна лимитера действий (RateLimiter), чтобы лимиты переживали рестарт бота
+    """
+    CREATE TABLE IF NOT EXISTS rate_limits(
+        user_id INTEGER NOT NULL,
+        action TEXT NOT NULL,
+        window_start REAL NOT NULL,
+        prev_count INTEGER NOT NULL,
+        curr_count INTEGER NOT NULL,
+        period INTEGER NOT NULL,
+        PRIMARY KEY (user_id, action)
+    ) WITHOUT ROWID""",
+)
+
+# Колонки, добавленные после первых версий схемы: (таблица, колонка, тип)
+SCHEMA_COLUMNS = (
+    ("requests", "completed_at", "DATETIME"),
+    ("requests", "client_rating", "INTEGER"),
+    ("requests", "client_comment", "TEXT"),
+    ("requests", "review_requested", "INTEGER DEFAULT 0"),
+    ("requests", "auto_category", "TEXT"),
+    ("requests", "score", "REAL DEFAULT 0"),
+    ("requests", "client_user_id", "TEXT"),
+
+    ("masters", "avg_rating", "REAL DEFAULT 5.0"),
+    ("masters", "reviews_count", "INTEGER DEFAULT 0"),
+    ("masters", "free_orders_left", "INTEGER DEFAULT 3"),
+    ("masters", "priority_until", "DATETIME"),
+    ("masters", "pin_until", "DATETIME"),
+    ("masters", "has_npd_ip", "INTEGER DEFAULT 0"),
+    ("masters", "verified", "INTEGER DEFAULT 0"),
+    ("masters", "photo_file_id", "TEXT"),
+    ("masters", "categories_auto", "TEXT"),
+    ("masters", "phone", "TEXT"),
+    ("masters", "exp_bucket", "TEXT"),
+    ("masters", "exp_text", "TEXT"),
+    ("masters", "passport_scan_file_id", "TEXT"),
+    ("masters", "face_photo_file_id", "TEXT"),
+    ("masters", "npd_ip_doc_file_id", "TEXT"),
+    ("masters", "orders_completed", "INTEGER DEFAULT 0"),
+    ("masters", "skill_tier", "TEXT DEFAULT 'Новичок'"),
+    ("masters", "rating_sum", "INTEGER DEFAULT 0"),
+)
+
+# Индексы (создаются после добавления недостающих колонок: часть из них — по новым колонкам)
+SCHEMA_INDEXES = (
+    # Отзывы мастера по дате (/reviews, экран отзывов): поиск и сортировка по индексу.
+    # idx_reviews_master_id покрывается его префиксом.
+    "CREATE INDEX IF NOT EXISTS idx_reviews_master_created ON reviews(master_id, created_at DESC)",
+    "DROP INDEX IF EXISTS idx_reviews_master_id",
+    "CREATE INDEX IF NOT EXISTS idx_reviews_request_id ON reviews(request_id)",
+    "CREATE INDEX IF NOT EXISTS idx_masters_contact ON masters(contact)",
+    # Статус + дата (автозавершение в periodic_cleanup); idx_requests_status покрывается префиксом
+    "CREATE INDEX IF NOT EXISTS idx_requests_status_created ON requests(status, created_at)",
+    "DROP INDEX IF EXISTS idx_requests_status",
+    # Поиск оффера мастера по заявке; idx_offers_request_id покрывается префиксом
+    "CREATE INDEX IF NOT EXISTS idx_offers_req_master ON offers(request_id, master_id)",
+    "DROP INDEX IF EXISTS idx_offers_request_id",
+    # Выборки за период (daily_check.py)
+    "CREATE INDEX IF NOT EXISTS idx_requests_created ON requests(created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_requests_completed ON requests(completed_at)",
+    "CREATE INDEX IF NOT EXISTS idx_reviews_created ON reviews(created_at)",
+    # Поиск анкет с документами старше 72 часов (очистка документов)
+    "CREATE INDEX IF NOT EXISTS idx_masters_created ON masters(created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_masters_active ON masters(is_active, level)",
+    # Составные индексы для выборок по мастеру и статусу (счётчики, «Мои заказы»)
+    "CREATE INDEX IF NOT EXISTS idx_requests_master_status ON requests(master_id, status)",
+    "CREATE INDEX IF NOT EXISTS idx_offers_master_status ON offers(master_id, status)",
+    # idx_offers_master_id покрывается префиксом idx_offers_master_status
+    "DROP INDEX IF EXISTS idx_offers_master_id",
+    # Индексы по колонкам клиента
+    "CREATE INDEX IF NOT EXISTS idx_requests_client_status_created ON requests(client_user_id, status, created_at DESC)",
+    # idx_requests_client_user_id покрывается префиксом idx_requests_client_status_created
+    "DROP INDEX IF EXISTS idx_requests_client_user_id",
+    "CREATE INDEX IF NOT EXISTS idx_requests_contact ON requests(contact)",
+    "CREATE INDEX IF NOT EXISTS idx_complaints_who ON complaints(who)",
+    "CREATE INDEX IF NOT EXISTS idx_complaints_master_id ON complaints(master_id)",
+)
+
+def _init_schema(db):
+    """
+    Таблицы, недостающие колонки, триггеры и индексы (вызывается в транзакции).
+    DDL выполняется напрямую на писателе, без обертки execute на каждый оператор:
+    ошибки не глушатся и доходят до write_conn, который откатывает миграцию.
+    conn.executescript здесь не подходит: перед скриптом он делает COMMIT
+    и разорвал бы общую транзакцию миграции.
+    """
+    for ddl in SCHEMA_TABLES:
+        db.conn.execute(ddl)
+    
+    # Мягкие добавления недостающих колонок: состав колонок читаем один раз на таблицу
+    existing = {}
+    for table, name, ddl in SCHEMA_COLUMNS:
+        if table not in existing:
+            existing[table] = table_columns(db, table)
+        ensure_column(db, table, name, ddl, existing[table])
+    
+    init_rating_triggers(db)
+    
+    for ddl in SCHEMA_INDEXES:
+        db.conn.execute(ddl)
@@ -1,14 +1,30 @@
+import os
 import sqlite3
+import sys
 
-conn = sqlite3.connect('vp_masters.sqlite')
-cur = conn.cursor()
+DB_PATH = os.path.join(os.path.dirname(__file__), "vp_masters.sqlite")
 
-# Удаляем заявку #8 и все связанные офферы
-cur.execute("DELETE FROM requests WHERE id = 8")
-cur.execute("DELETE FROM offers WHERE request_id = 8")
+def purge_requests(conn, ids: list[int]):
+    """
+    Удаляет заявки и все связанные офферы одной транзакцией.
+    Любое количество id — два оператора с IN, а не по паре DELETE на каждую заявку
+    (offers.request_id покрыт индексом idx_offers_req_master).
+    """
+    placeholders = ",".join("?" * len(ids))
+    with conn:
+        conn.execute(f"DELETE FROM offers WHERE request_id IN ({placeholders})", ids)
+        conn.execute(f"DELETE FROM requests WHERE id IN ({placeholders})", ids)
 
-conn.commit()
-conn.close()
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or not all(arg.isdigit() for arg in sys.argv[1:]):
+        print("Использование: python delete_old_request.py <id заявки> [<id заявки> ...]")
+        sys.exit(1)
 
-print("✅ Старая заявка #8 удалена")
-print("📝 Теперь создавай новую заявку!")
\ No newline at end of file
+    ids = [int(arg) for arg in sys.argv[1:]]
+
+    conn = sqlite3.connect(DB_PATH)
+    purge_requests(conn, ids)
+    conn.close()
+
+    print(f"✅ Старые заявки удалены: {', '.join(f'#{rid}' for rid in ids)}")
+    print("📝 Теперь создавай новую заявку!")
@@ -0,0 +1,77 @@
+from contextvars import ContextVar
+from datetime import datetime
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery
+
+# Формат отметок времени в БД (CURRENT_TIMESTAMP, UTC)
+DB_TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Текущее время UTC, зафиксированное на входе в обработку апдейта
+_now_ts = ContextVar("now_ts", default=None)
+
+def now_ts() -> str:
+    """
+    Текущее время UTC в формате БД.
+    Внутри обработчика берется значение из NowMiddleware (одно на апдейт),
+    вне обработчиков (фоновые задачи) считается заново.
+    """
+    ts = _now_ts.get()
+    if ts is None:
+        ts = datetime.utcnow().strftime(DB_TS_FORMAT)
+    return ts
+
+class NowMiddleware(BaseMiddleware):
+    """Фиксирует текущее время один раз на апдейт"""
+    async def __call__(self, handler, event, data):
+        token = _now_ts.set(datetime.utcnow().strftime(DB_TS_FORMAT))
+        try:
+            return await handler(event, data)
+        finally:
+            _now_ts.reset(token)
+
+class UserRoleMiddleware(BaseMiddleware):
+    """
+    Добавляет в data обработчика is_master и is_admin для отправителя апдейта.
+    is_master_fn — async-функция (с кэшем), is_admin_fn — обычная функция.
+    """
+    def __init__(self, is_master_fn, is_admin_fn):
+        self.is_master_fn = is_master_fn
+        self.is_admin_fn = is_admin_fn
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user:
+            data["is_master"] = await self.is_master_fn(str(user.id))
+            data["is_admin"] = self.is_admin_fn(user.id)
+        return await handler(event, data)
+
+class RateLimitMiddleware(BaseMiddleware):
+    """
+    Лимит действий по флагу обработчика: flags={"rate_limit": (action, limit, period)}.
+    consume_fn — async (user_id, action, limit, period) -> (разрешено, осталось, секунд до сброса),
+    denied_text_fn — (action, секунд до сброса) -> текст отказа.
+    Отклоненный апдейт до обработчика (и его запросов в БД) не доходит.
+    """
+    def __init__(self, consume_fn, denied_text_fn):
+        self.consume_fn = consume_fn
+        self.denied_text_fn = denied_text_fn
+
+    async def __call__(self, handler, event, data):
+        spec = get_flag(data, "rate_limit")
+        user = data.get("event_from_user")
+        if not spec or not user:
+            return await handler(event, data)
+
+        action, limit, period = spec
+        allowed, _, remaining_time = await self.consume_fn(user.id, action, limit, period)
+        if allowed:
+            return await handler(event, data)
+
+        text = self.denied_text_fn(action, remaining_time)
+        if isinstance(event, CallbackQuery):
+            await event.answer(text, show_alert=True)
+        else:
+            await event.answer(text)
+        return None
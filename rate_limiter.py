@@ -1,10 +1,26 @@
-from collections import defaultdict
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import asyncio
 import logging
+import time
 
 class RateLimiter:
-    def __init__(self):
-        self.user_requests = defaultdict(list)
+    """
+    Лимитер действий пользователей: приближенное скользящее окно.
+    На ключ хранятся только [начало окна, счетчик прошлого окна, счетчик текущего, период],
+    а не отметка времени каждого запроса. Оценка числа запросов за последние period секунд:
+    prev * (1 - доля прошедшего текущего окна) + curr.
+    Число ключей ограничено max_keys: при переполнении вытесняется ключ,
+    к которому дольше всего не обращались (LRU), так что память не растет
+    с количеством уникальных пользователей между вызовами cleanup_old_entries.
+    Время — настенное (time.time), чтобы окна можно было сохранить и восстановить
+    после рестарта: load() / dirty_rows().
+    """
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self.windows = OrderedDict()
+        # Ключи, учтенные после последнего dirty_rows() (их нужно сохранить)
+        self.dirty = set()
     
     def check_limit(self, user_id: int, action: str, limit: int, period: int = 3600) -> bool:
         """
@@ -14,67 +30,210 @@ class RateLimiter:
         limit: максимальное количество запросов
         period: период в секундах (по умолчанию 1 час)
         """
-        now = datetime.now()
-        key = f"{user_id}_{action}"
+        return self.check_and_report(user_id, action, limit, period)[0]
+    
+    def _window(self, key: tuple, now: float, period: int) -> list:
+        """
+        Окно ключа (user_id, action), сдвинутое к текущему моменту.
+        Ключ — кортеж, а не строка: без форматирования f-строки на каждый вызов.
+        """
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = [now, 0, 0, period]
+            if len(self.windows) > self.max_keys:
+                self.windows.popitem(last=False)
+            return window
         
-        # Удаляем старые запросы (старше period секунд)
-        self.user_requests[key] = [
-            req_time for req_time in self.user_requests[key] 
-            if now - req_time < timedelta(seconds=period)
-        ]
+        self.windows.move_to_end(key)
+        passed = int((now - window[0]) // period)
+        if passed >= 1:
+            # Текущее окно стало прошлым; если прошло больше одного окна — оба пустые
+            window[1] = window[2] if passed == 1 else 0
+            window[2] = 0
+            window[0] += passed * period
+        return window
+    
+    @staticmethod
+    def _estimate(window: list, now: float, period: int) -> float:
+        start, prev, curr, _ = window
+        return prev * (1 - (now - start) / period) + curr
+    
+    @staticmethod
+    def _wait(window: list, now: float, period: int, limit: int) -> int:
+        """Секунд до момента, когда оценка опустится ниже limit"""
+        start, prev, curr, _ = window
+        if curr < limit:
+            # Ждем, пока «остынет» прошлое окно
+            if not prev:
+                return 0
+            at = start + period * (1 - (limit - curr) / prev)
+        else:
+            # Текущее окно переполнено: ждем его конца и остывания
+            at = start + period + period * (1 - limit / curr)
+        return max(0, int(at - now + 0.999))
+    
+    def check_and_report(self, user_id: int, action: str, limit: int, period: int = 3600) -> tuple:
+        """
+        Проверка лимита за один проход по ключу.
+        Возвращает (разрешено, осталось запросов, секунд до сброса)
+        """
+        now = time.time()
+        key = (user_id, action)
+        window = self._window(key, now, period)
+        estimate = self._estimate(window, now, period)
         
         # Проверяем не превышен ли лимит
-        if len(self.user_requests[key]) >= limit:
-            return False
+        if estimate >= limit:
+            return False, 0, self._wait(window, now, period, limit)
         
-        # Добавляем текущий запрос
-        self.user_requests[key].append(now)
-        return True
+        # Учитываем текущий запрос
+        window[2] += 1
+        self.dirty.add(key)
+        return True, max(0, limit - int(estimate + 1)), 0
     
     def get_remaining(self, user_id: int, action: str, limit: int, period: int = 3600) -> int:
         """Получить количество оставшихся запросов"""
-        now = datetime.now()
-        key = f"{user_id}_{action}"
-        
-        # Очищаем старые запросы
-        self.user_requests[key] = [
-            req_time for req_time in self.user_requests[key] 
-            if now - req_time < timedelta(seconds=period)
-        ]
-        
-        return max(0, limit - len(self.user_requests[key]))
+        now = time.time()
+        window = self._window((user_id, action), now, period)
+        return max(0, limit - int(self._estimate(window, now, period)))
     
-    def get_time_until_reset(self, user_id: int, action: str, period: int = 3600) -> int:
+    def snapshot(self, user_id: int, specs) -> dict:
+        """
+        Остатки по нескольким действиям сразу.
+        specs: [(action, limit, period), ...] -> {action: осталось}
+        """
+        now = time.time()
+        result = {}
+        for action, limit, period in specs:
+            window = self._window((user_id, action), now, period)
+            result[action] = max(0, limit - int(self._estimate(window, now, period)))
+        return result
+    
+    def get_time_until_reset(self, user_id: int, action: str, period: int = 3600, limit: int = 1) -> int:
         """Получить время до сброса лимита в секундах"""
-        now = datetime.now()
-        key = f"{user_id}_{action}"
-        
-        if not self.user_requests[key]:
+        key = (user_id, action)
+        if key not in self.windows:
             return 0
         
-        # Время самого старого запроса
-        oldest_request = min(self.user_requests[key])
-        reset_time = oldest_request + timedelta(seconds=period)
-        
-        return max(0, int((reset_time - now).total_seconds()))
+        now = time.time()
+        window = self._window(key, now, period)
+        return self._wait(window, now, period, limit)
     
     def cleanup_old_entries(self):
         """Очистка старых записей (запускать периодически)"""
-        now = datetime.now()
-        keys_to_delete = []
+        now = time.time()
         
-        for key, timestamps in self.user_requests.items():
-            # Удаляем записи старше 24 часов
-            self.user_requests[key] = [
-                t for t in timestamps 
-                if now - t < timedelta(hours=24)
-            ]
-            # Если список пуст, помечаем ключ для удаления
-            if not self.user_requests[key]:
-                keys_to_delete.append(key)
+        # Ключ не влияет на лимит, если с начала окна прошло два периода
+        keys_to_delete = [
+            key for key, (start, _, _, period) in self.windows.items()
+            if now - start >= 2 * period
+        ]
         
         # Удаляем пустые ключи
         for key in keys_to_delete:
-            del self.user_requests[key]
+            del self.windows[key]
         
-        logging.info(f"[RATE_LIMITER] Cleaned up {len(keys_to_delete)} old entries")
\ No newline at end of file
+        logging.info("[RATE_LIMITER] Cleaned up %s old entries", len(keys_to_delete))
+    
+    def dirty_rows(self) -> list:
+        """
+        Окна, изменившиеся с прошлого вызова, для сохранения пачкой:
+        [(user_id, action, начало окна, prev, curr, period), ...]
+        """
+        rows = [
+            (*key, *self.windows[key])
+            for key in self.dirty if key in self.windows
+        ]
+        self.dirty.clear()
+        return rows
+    
+    def restore_dirty(self, rows):
+        """Вернуть окна из dirty_rows() в очередь на сохранение (запись не удалась)"""
+        self.dirty.update((user_id, action) for user_id, action, *_ in rows)
+    
+    def load(self, rows):
+        """Восстановить окна из сохраненных строк (формат dirty_rows)"""
+        for user_id, action, start, prev, curr, period in rows:
+            self.windows[(user_id, action)] = [start, prev, curr, period]
+            if len(self.windows) > self.max_keys:
+                self.windows.popitem(last=False)
+
+
+class TokenBucket:
+    """
+    Корзина токенов для исходящих сообщений.
+    rate: пополнение (токенов в секунду)
+    capacity: максимальный всплеск
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Дождаться токена. Спим вне блокировки, чтобы не сериализовать ожидающих"""
+        while True:
+            async with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+
+    def is_idle(self) -> bool:
+        """Корзина полная — её можно удалить без потери состояния"""
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class SendLimiter:
+    """
+    Ограничение отправки сообщений под лимиты Telegram:
+    ~30 сообщений в секунду на бота, ~1 в секунду в личный чат, 20 в минуту в группу.
+    max_in_flight — сколько запросов к Bot API может выполняться одновременно
+    (при параллельной рассылке медленные ответы не копят сотни открытых запросов).
+    """
+    def __init__(self, global_rate: float = 30, private_rate: float = 1, group_rate: float = 20 / 60,
+                 private_burst: float = 3, group_burst: float = 20, max_in_flight: int = 25):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        self.private = (private_rate, private_burst)
+        self.group = (group_rate, group_burst)
+        self.chat_buckets = {}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            # У групп и каналов отрицательный chat_id
+            rate, burst = self.group if int(chat_id) < 0 else self.private
+            bucket = TokenBucket(rate, burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def acquire(self, chat_id: int):
+        """Дождаться разрешения на отправку в чат"""
+        await self._chat_bucket(chat_id).acquire()
+        await self.global_bucket.acquire()
+
+    @asynccontextmanager
+    async def slot(self, chat_id: int):
+        """async with send_limiter.slot(chat_id): await bot.send_...(chat_id, ...)"""
+        await self.acquire(chat_id)
+        # Семафор берем после ожидания лимита чата, чтобы не держать его впустую
+        async with self.in_flight:
+            yield
+
+    def cleanup_idle(self):
+        """Удалить заполненные (неактивные) корзины чатов"""
+        idle = [chat_id for chat_id, bucket in self.chat_buckets.items() if bucket.is_idle()]
+        for chat_id in idle:
+            del self.chat_buckets[chat_id]
+        logging.info("[SEND_LIMITER] Cleaned up %s idle buckets", len(idle))
@@ -0,0 +1,63 @@
+import logging
+import secrets
+import time
+
+# Скользящее окно на sorted set: очистка старых, подсчет и добавление — атомарно в Lua
+# KEYS[1] — ключ, ARGV: now_ms, window_ms, limit, уникальный суффикс члена
+CHECK_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, now - window)
+local n = redis.call('ZCARD', KEYS[1])
+if n < limit then
+    redis.call('ZADD', KEYS[1], now, now .. ':' .. ARGV[4])
+    redis.call('PEXPIRE', KEYS[1], window)
+    return {1, limit - n - 1, 0}
+end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return {0, 0, tonumber(oldest[2]) + window - now}
+"""
+
+class RedisRateLimiter:
+    """
+    Лимитер на Redis: состояние общее для всех процессов бота и переживает рестарт.
+    Включается переменной окружения REDIS_URL (нужен пакет redis>=5).
+    """
+    def __init__(self, url: str):
+        import redis.asyncio as aioredis  # опциональная зависимость
+
+        self.redis = aioredis.from_url(url)
+        # register_script сам использует EVALSHA и загружает скрипт при NOSCRIPT
+        self._check = self.redis.register_script(CHECK_SCRIPT)
+
+    @staticmethod
+    def _key(user_id: int, action: str) -> str:
+        return f"rl:{action}:{user_id}"
+
+    async def check_and_report(self, user_id: int, action: str, limit: int, period: int = 3600) -> tuple:
+        """То же, что RateLimiter.check_and_report: (разрешено, осталось, секунд до сброса)"""
+        now_ms = int(time.time() * 1000)
+        allowed, remaining, reset_ms = await self._check(
+            keys=[self._key(user_id, action)],
+            args=[now_ms, period * 1000, limit, secrets.token_hex(4)]
+        )
+        return bool(allowed), int(remaining), max(0, int(reset_ms) // 1000)
+
+    async def snapshot(self, user_id: int, specs) -> dict:
+        """Остатки по нескольким действиям одним pipeline"""
+        now_ms = int(time.time() * 1000)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for action, limit, period in specs:
+                pipe.zcount(self._key(user_id, action), f"({now_ms - period * 1000}", "+inf")
+            counts = await pipe.execute()
+        return {
+            action: max(0, limit - count)
+            for (action, limit, period), count in zip(specs, counts)
+        }
+
+    async def close(self):
+        try:
+            await self.redis.aclose()
+        except Exception as e:
+            logging.error("[REDIS_LIMITER] Close error: %s", e)
@@ -0,0 +1,46 @@
+from collections import OrderedDict
+import time
+
+class TTLCache:
+    """
+    Небольшой LRU-кэш с временем жизни записей.
+    Используется из event loop бота (один поток), поэтому без блокировок.
+    maxsize: максимальное количество ключей (старые вытесняются)
+    ttl: время жизни записи в секундах
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        """Получить значение, если оно есть и не устарело"""
+        item = self._data.get(key)
+        if item is None:
+            return default
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        """Сохранить значение"""
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Удалить значение (инвалидация)"""
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)